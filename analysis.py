@@ -1,33 +1,125 @@
 # analysis.py
+import json
+import os
 import pandas as pd
 import numpy as np
 from dataclasses import dataclass
 
-def fiscal_year(date: pd.Timestamp) -> int:
-    # 财年：12月-次年11月。用“财年结束年”命名：Dec 2024 -> FY2025
-    if pd.isna(date):
-        return np.nan
-    return date.year + 1 if date.month == 12 else date.year
-
-def fiscal_quarter(date: pd.Timestamp) -> str:
-    # Q1: Dec-Feb, Q2: Mar-May, Q3: Jun-Aug, Q4: Sep-Nov
-    if pd.isna(date):
-        return ""
-    m = date.month
-    if m in (12, 1, 2):
-        return "Q1"
-    if m in (3, 4, 5):
-        return "Q2"
-    if m in (6, 7, 8):
-        return "Q3"
-    return "Q4"
+from fiscal import FY_DTYPE, FY_START_MONTH, QUARTERS, fiscal_fields, fiscal_quarter, fiscal_year, period_key, shift_period, split_period
+from profiling import traced
 
+# 聚合周期 -> 分组列；财季必须带上财年，否则不同年份的同一季度会被合并
+PERIOD_COLUMNS = {
+    "fq": ["fy", "fq", "fp"],
+    "fp": ["fy", "fq", "fp"],
+    "month": ["month"],
+    "fy": ["fy"],
+}
+
+# 清洗后数据的类型约定（列式存储 scripts/excel_to_csv.to_store_frame 也按这个写）：
+# 维度列 category（字典编码），度量列 float32，fy 可空小整数；读入时统一收紧
+DIM_COLUMNS = ["brand", "category", "market_raw", "area", "province", "channel"]
+MEASURE_COLUMNS = [
+    "sales_value", "sales_volume", "price",
+    "share_value_pct", "wdist_pct", "ndist_pct", "velocity_value",
+]
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    把 df 的列原地转成约定类型（已经是目标类型的列不动），返回 df
+    列式存储里 fy=0 分区放的是日期缺失的行，这里还原成缺失值
+    """
+    for c in DIM_COLUMNS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    for c in MEASURE_COLUMNS:
+        if c in df.columns and df[c].dtype != np.float32:
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype(np.float32)
+    if "date" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    if "fy" in df.columns and df["fy"].dtype != FY_DTYPE:
+        fy = df["fy"]
+        if isinstance(fy.dtype, pd.CategoricalDtype):
+            # 分区列读出来是分类：只转换类别表，再按 code 取值
+            cats = pd.to_numeric(pd.Series(fy.cat.categories.astype(str)), errors="coerce").to_numpy(np.float64)
+            fy = pd.Series(np.append(cats, np.nan)[fy.cat.codes.to_numpy()], index=fy.index)
+        else:
+            fy = pd.to_numeric(fy, errors="coerce")
+        df["fy"] = fy.where(fy != 0).astype(FY_DTYPE)
+    return df
+
+def _nonempty(s: pd.Series) -> np.ndarray:
+    """
+    维度值非空（不是 "" 也不是缺失）；category 列只检查类别表，不把整列转成字符串
+    """
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        ok = np.append(s.cat.categories.astype(str).str.len().to_numpy() > 0, False)
+        return ok[s.cat.codes.to_numpy()]  # 缺失值的 code 是 -1，正好取到末尾的 False
+    return (s.notna() & (s.astype(str).str.len() > 0)).to_numpy()
+
+def _engine(engine=None):
+    # engine.py 依赖本模块，这里延迟导入
+    from engine import get_engine
+    return get_engine(engine)
+
+@traced()
+def load_dataset(
+    path: str = "data/clean/nielsen_store",
+    columns: list[str] | None = None,
+    brands: list[str] | None = None,
+    fy: list[int] | None = None,
+) -> pd.DataFrame:
+    """
+    读取清洗后的数据：
+      - Parquet 列式存储（scripts/excel_to_csv.write_store 生成，按 fy 分区）：
+        memory_map 读取，columns 列裁剪，brands / fy 谓词下推（只读命中的分区/行组）
+      - .csv：兼容旧路径（全量解析，brands / fy 过滤在内存里做；fy 由 date 推出，0 = 日期缺失，同列式存储的 fy=0 分区）
+    """
+    if str(path).endswith(".csv"):
+        # 解析时直接按约定类型建列，不先生成 object / float64 再转换
+        dtype = {c: "category" for c in DIM_COLUMNS}
+        dtype.update({c: np.float32 for c in MEASURE_COLUMNS})
+        usecols = columns
+        if columns is not None:
+            dtype = {c: t for c, t in dtype.items() if c in columns}
+            if fy is not None and "date" not in columns:
+                usecols = list(columns) + ["date"]  # 按财年过滤要用，过滤完再去掉
+        df = pd.read_csv(path, usecols=usecols, dtype=dtype)
+        if brands is not None:
+            df = df[df["brand"].isin(brands)]
+        df = apply_schema(df)
+        if fy is not None:
+            years = fiscal_fields(df["date"])["fy"].astype("Int64").fillna(0)
+            df = df[years.isin([int(y) for y in fy]).to_numpy()]
+            if usecols is not columns:
+                df = df.drop(columns="date")
+        return df
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("读取列式存储需要 pyarrow：pip install pyarrow") from e
+
+    filters = []
+    if brands is not None:
+        filters.append(("brand", "in", list(brands)))
+    if fy is not None:
+        filters.append(("fy", "in", [int(y) for y in fy]))
+
+    table = pq.read_table(path, columns=columns, filters=filters or None, memory_map=True)
+    return apply_schema(table.to_pandas())
+
+@traced()
 def add_time_fields(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df["date"] = pd.to_datetime(df["date"], errors="coerce")
-    df["fy"] = df["date"].apply(fiscal_year)
-    df["fq"] = df["date"].apply(fiscal_quarter)
-    df["month"] = df["date"].dt.to_period("M").astype(str)
+    """
+    增加 fy / fq / month / fp（财季键 FY2026Q1）；向量化计算见 fiscal.py，财年起始月读 fiscal.FY_START_MONTH
+    """
+    df = df.copy(deep=False)  # 浅拷贝：只新增/替换列，原有列的数据不复制，也不影响调用方的 df
+    if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    fields = fiscal_fields(df["date"])
+    for c in fields.columns:
+        df[c] = fields[c]
     return df
 
 def _safe_div(a, b):
@@ -38,28 +130,59 @@ def build_brand_category(df: pd.DataFrame) -> pd.DataFrame:
     你 demo 里有 share_value_pct 和 sales_value。
     用它估算 category_sales（避免必须提供品类总销额）：
       category_sales = brand_sales / (share/100)
+    份额为 0 / 负数 / 非有限值的行反推不出品类销额（会得到无穷大并污染所有汇总），记为缺失，
+    与份额缺失的行同样处理；这类行在入库的质量报告里单独列出（见 quality.py）
     """
-    df = df.copy()
-    df["sales_value"] = pd.to_numeric(df["sales_value"], errors="coerce")
-    df["share_value_pct"] = pd.to_numeric(df["share_value_pct"], errors="coerce")
+    df = df.copy(deep=False)
+    for c in ["sales_value", "share_value_pct"]:
+        if not pd.api.types.is_numeric_dtype(df[c]):
+            df[c] = pd.to_numeric(df[c], errors="coerce")
 
-    df["category_sales_value"] = df["sales_value"] / (df["share_value_pct"] / 100.0)
+    share = df["share_value_pct"]
+    df["category_sales_value"] = (df["sales_value"] / (share / 100.0)).where(np.isfinite(share) & (share > 0))
     return df
 
+# 铺货率按权重上卷：存 Σ(铺货率 x 权重) 与 Σ权重 两个可加分量，任意上卷（月 -> 财季、省份 -> 大区、渠道 -> 渠道组）后再相除
+# 加权铺货率的定义就是“有货门店的品类销额 / 全部门店的品类销额”，以品类销额为权重上卷得到的正是上级市场的加权铺货率；
+# 数值铺货率严格应按门店数加权，尼尔森导出里没有门店总数，同样用品类销额近似。
+# 铺货率或权重缺失的行不计入（份额缺失 / 为 0 的行没有品类销额，见 build_brand_category）
+DIST_WEIGHTS = {"wdist_pct": "category_sales_value", "ndist_pct": "category_sales_value"}
+DIST_PARTS = [f"{c}_{s}" for c in DIST_WEIGHTS for s in ("wsum", "w")]
+
+def dist_parts(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """
+    明细行 -> 铺货率的可加分量 {<铺货率>_wsum, <铺货率>_w}（float64；不计入的行为 0）
+    """
+    out = {}
+    for c, weight in DIST_WEIGHTS.items():
+        v = df[c].to_numpy(np.float64, na_value=np.nan)
+        w = df[weight].to_numpy(np.float64, na_value=np.nan)
+        ok = ~np.isnan(v) & ~np.isnan(w)
+        out[f"{c}_wsum"] = np.where(ok, v * w, 0.0)
+        out[f"{c}_w"] = np.where(ok, w, 0.0)
+    return out
+
+@traced()
 def agg_period(df: pd.DataFrame, keys: list[str], period_key: str) -> pd.DataFrame:
     """
-    period_key: 'fq' or 'month'
-    聚合字段：销额、销量、铺货率（简单加权/取平均策略可再迭代）
+    period_key: 'fq'（财季，含 fy/fp）、'month' 或 'fy'
+    聚合字段：销额、销量、品类销额求和；铺货率按品类销额加权（见 DIST_WEIGHTS）
     """
-    g = df.groupby(keys + [period_key], dropna=False).agg(
-        sales_value=("sales_value", "sum"),
-        sales_volume=("sales_volume", "sum"),
-        category_sales_value=("category_sales_value", "sum"),
-        # 铺货率类一般不求和，这里先取均值（你后续可按门店权重做更严谨加权）
-        wdist_pct=("wdist_pct", "mean"),
-        ndist_pct=("ndist_pct", "mean"),
-    ).reset_index()
+    if "fy" not in df.columns:
+        df = add_time_fields(df)
+    period_cols = PERIOD_COLUMNS.get(period_key, [period_key])
+    df = df[keys + period_cols + CUBE_SUMS].assign(**dist_parts(df))
+    g = df.groupby(keys + period_cols, dropna=False, observed=True)[CUBE_SUMS + DIST_PARTS].sum().reset_index()
+    return finish_period(g)
 
+def finish_period(g: pd.DataFrame) -> pd.DataFrame:
+    """
+    聚合后的派生指标：铺货率（加权分量相除）/ 份额 / 单价 / 单点卖力（agg_period、rollup 和各分析引擎共用同一套公式）
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for c in DIST_WEIGHTS:
+            w = g.pop(f"{c}_w").to_numpy(np.float64)
+            g[c] = np.where(w > 0, g.pop(f"{c}_wsum").to_numpy(np.float64) / w, np.nan)
     g["share_value_pct"] = g["sales_value"] / g["category_sales_value"] * 100.0
     g["price"] = np.where(g["sales_volume"] > 0, g["sales_value"] / g["sales_volume"], np.nan)
     g["velocity_value"] = np.where(g["wdist_pct"] > 0, g["sales_value"] / g["wdist_pct"], np.nan)
@@ -83,26 +206,138 @@ def classify_share_move(brand_growth, cat_growth):
         return "份额下跌：品牌增长慢于大盘"
     return "份额下跌：品牌下滑快于大盘（相对更弱）"
 
-def decompose_share_change(df_agg: pd.DataFrame, dim: str, brand: str, fy: int):
+# 份额拆解的周期：周期键 -> (同比间隔, 键 -> 连续整数编号, 编号 -> 键)
+SERIES_PERIODS = {
+    "fp": (4, lambda k: split_period(k)[0] * 4 + QUARTERS.index(split_period(k)[1]),
+           lambda n: period_key(n // 4, QUARTERS[n % 4])),
+    "month": (12, lambda k: int(k[:4]) * 12 + int(k[5:7]) - 1,
+              lambda n: f"{n // 12:04d}-{n % 12 + 1:02d}"),
+}
+DECOMPOSE_COLUMNS = [
+    "cur_sales_value", "cur_share", "last_share", "share_pp",
+    "cur_wdist", "wdist_pp", "vel_share_pp", "cur_price",
+    "vel_contrib_pp", "dist_contrib_pp",
+]
+
+def _period_numbers(s: pd.Series, to_number) -> np.ndarray:
+    # 只解析去重后的周期键（分类列就是类别表），再按 code 展开
+    codes, uniques = pd.factorize(s)
+    nums = np.array([to_number(str(u)) for u in uniques] + [-1], dtype=np.int64)
+    return nums[codes]
+
+@traced()
+def share_decomposition_series(df_agg: pd.DataFrame, dim: str, period: str = "fp") -> pd.DataFrame:
+    """
+    全历史份额拆解（长表）：每个 brand x dim x 周期 一行，与一年前同期对比
+      df_agg: rollup / agg_period 的输出（brand x dim x 周期）；period='fp' 用财季表，'month' 用月度表
+    一次算完所有品牌、所有省份/渠道、所有周期：把 (brand, dim) x 周期编号 铺成稠密网格，
+    “去年同期”就是网格沿周期轴平移同比间隔；只在去年出现的 dim 也保留一行（本期值为空）
+
+    对数（LMDI）拆解：份额 S = 卖力指数 V x 加权铺货率 D（D = wdist/100，V = S/D）
+      dist_contrib_pp = L(S1, S0) x ln(D1/D0) x 100，L 为对数平均 (S1-S0)/ln(S1/S0)
+      vel_contrib_pp  = share_pp - dist_contrib_pp（= L x ln(V1/V0) x 100），两项之和严格等于 share_pp
+    """
+    lag, to_number, _ = SERIES_PERIODS[period]
+    measures = ["sales_value", "category_sales_value", "share_value_pct", "wdist_pct", "price"]
+    d = df_agg.loc[df_agg[period].notna().to_numpy(), ["brand", dim, period] + measures]
+    t = _period_numbers(d[period], to_number)
+    columns = ["brand", dim] + (["fy"] if period == "fp" else []) + [period] + DECOMPOSE_COLUMNS
+    if not len(d):
+        return pd.DataFrame(columns=columns)
+
+    # (brand, dim) 编号：按品牌、再按 dim 排序；dim 缺失排在最后
+    bc, bu = pd.factorize(d["brand"], sort=True)
+    dc, du = pd.factorize(d[dim], sort=True)
+    nd = len(du) + 1
+    pair = bc.astype(np.int64) * nd + np.where(dc < 0, len(du), dc)
+    pairs, g = np.unique(pair, return_inverse=True)
+    t0 = t.min()
+    n_t = int(t.max() - t0) + 1
+
+    grid = np.full((len(measures), len(pairs), n_t), np.nan)
+    grid[:, g, t - t0] = d[measures].to_numpy(np.float64).T
+    present = np.zeros((len(pairs), n_t), dtype=bool)
+    present[g, t - t0] = True
+    last = np.full_like(grid, np.nan)
+    last[:, :, lag:] = grid[:, :, :-lag]
+    last_present = np.zeros_like(present)
+    last_present[:, lag:] = present[:, :-lag]
+
+    rg, rt = np.nonzero(present | last_present)  # 行优先：品牌、dim、周期 依次有序
+    brand_codes, dim_codes = np.divmod(pairs[rg], nd)
+    return decomposition_frame(
+        np.asarray(bu, dtype=object)[brand_codes],
+        np.append(np.asarray(du, dtype=object), np.nan)[dim_codes],
+        rt + t0, grid[:, rg, rt], last[:4, rg, rt], dim, period,
+    )
+
+def decomposition_frame(brands, dims, t, cur, last, dim: str, period: str = "fp") -> pd.DataFrame:
+    """
+    已对齐的 本期 / 去年同期 值 -> 份额拆解长表（share_decomposition_series 和各分析引擎共用同一套公式）
+      t:    周期编号（SERIES_PERIODS）
+      cur:  本期 sales_value, category_sales_value, share_value_pct, wdist_pct, price
+      last: 去年同期 sales_value, category_sales_value, share_value_pct, wdist_pct
+    """
+    _, _, to_key = SERIES_PERIODS[period]
+    sales, cat, share, wdist, price = cur
+    sales0, cat0, share0, wdist0 = last
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # 卖力份额沿用一直以来的口径：(品牌销额/铺货) / (品类销额/铺货)
+        vel_share_pp = ((sales / wdist) / (cat / wdist) - (sales0 / wdist0) / (cat0 / wdist0)) * 100.0
+        s1, s0, d1, d0 = share / 100.0, share0 / 100.0, wdist / 100.0, wdist0 / 100.0
+        ok = (s1 > 0) & (s0 > 0) & (d1 > 0) & (d0 > 0)
+        log_s = np.log(np.where(ok, s1 / s0, np.nan))
+        lmean = np.where(log_s != 0, (s1 - s0) / log_s, s0)
+        dist_contrib = np.where(ok, lmean * np.log(np.where(ok, d1 / d0, np.nan)) * 100.0, np.nan)
+    share_pp = share - share0
+
+    out = pd.DataFrame({
+        "brand": brands,
+        dim: dims,
+        "cur_sales_value": sales,
+        "cur_share": share,
+        "last_share": share0,
+        "share_pp": share_pp,
+        "cur_wdist": wdist,
+        "wdist_pp": wdist - wdist0,
+        "vel_share_pp": vel_share_pp,
+        "cur_price": price,
+        "vel_contrib_pp": share_pp - dist_contrib,
+        "dist_contrib_pp": dist_contrib,
+    })
+    out = out.replace([np.inf, -np.inf], np.nan)
+
+    # 周期编号 -> 周期键（有序分类）；财季另带 fy 方便按财年筛选
+    t = np.asarray(t, dtype=np.int64)
+    used, codes = np.unique(t, return_inverse=True)
+    out[period] = pd.Categorical.from_codes(codes, [to_key(int(u)) for u in used], ordered=True)
+    columns = ["brand", dim] + (["fy"] if period == "fp" else []) + [period] + DECOMPOSE_COLUMNS
+    if period == "fp":
+        out["fy"] = pd.array(t // 4, dtype=FY_DTYPE)
+    return out[columns]
+
+@traced()
+def decompose_share_change(df_agg: pd.DataFrame, dim: str, brand: str, fy: int, series: pd.DataFrame | None = None, engine=None):
     """
-    按省份/渠道：输出 top3 份额增长 & 下跌
-    拆解：销额份额 = 卖力份额 x 加权铺货率(相对/绝对)
+    按省份/渠道：输出最新财季的 top3 份额增长 & 下跌（同比）
+    拆解：销额份额 = 卖力份额 x 加权铺货率；vel_contrib_pp + dist_contrib_pp = share_pp（见 share_decomposition_series）
     这里的“卖力份额”定义：
       velocity_share = brand_velocity / category_velocity
     category_velocity = category_sales / category_wdist
     brand_velocity = brand_sales / brand_wdist
+    series: 已算好的 share_decomposition_series（批量出多个品牌时复用），为空则只算本品牌
+    engine: 分析引擎（见 engine.py；默认读 REPORT_ENGINE）
     """
-    d = df_agg.copy()
-    d = d[(d["brand"] == brand) & (d["fy"] == fy)]
-
-    # 取最新季度作为“最新季度”，同时做同比：同财年同季度 -1
-    latest_fq = d["fq"].dropna().sort_values().iloc[-1] if d["fq"].notna().any() else None
-    cur = d[d["fq"] == latest_fq].copy()
+    b = df_agg[df_agg["brand"] == brand]
+    d = b[b["fy"] == fy]
 
-    # 去年同财年：fy-1，且同 fq
-    last = df_agg[(df_agg["brand"] == brand) & (df_agg["fy"] == fy - 1) & (df_agg["fq"] == latest_fq)].copy()
+    # 取最新季度作为“最新季度”，同时做同比：财季键平移 4 个季度
+    latest_fp = d["fp"].dropna().max() if d["fp"].notna().any() else None
+    latest_fq = split_period(latest_fp)[1] if latest_fp else None
+    last_fp = shift_period(latest_fp, -4) if latest_fp else None
 
-    if cur.empty or last.empty:
+    if latest_fp is None or not (b["fp"] == last_fp).any():
         return {
             "latest_fq": latest_fq,
             "top_up": [],
@@ -110,46 +345,16 @@ def decompose_share_change(df_agg: pd.DataFrame, dim: str, brand: str, fy: int):
             "table": []
         }
 
-    cur = cur.set_index(dim)
-    last = last.set_index(dim)
-
-    # 对齐
-    idx = cur.index.union(last.index)
-    cur = cur.reindex(idx)
-    last = last.reindex(idx)
-
-    # 计算份额同比变化（pp）
-    cur_share = cur["share_value_pct"]
-    last_share = last["share_value_pct"]
-    share_pp = cur_share - last_share
-
-    # 拆解项：品牌/品类卖力、铺货
-    cur_cat_vel = cur["category_sales_value"] / cur["wdist_pct"]
-    last_cat_vel = last["category_sales_value"] / last["wdist_pct"]
-    cur_brand_vel = cur["sales_value"] / cur["wdist_pct"]
-    last_brand_vel = last["sales_value"] / last["wdist_pct"]
-
-    cur_vel_share = cur_brand_vel / cur_cat_vel
-    last_vel_share = last_brand_vel / last_cat_vel
-
-    # “铺货率贡献”这里先用 wdist_pct 的同比变化作为近似（后续可做对数拆解）
-    wdist_pp = cur["wdist_pct"] - last["wdist_pct"]
-    vel_share_pp = (cur_vel_share - last_vel_share) * 100.0  # 变成可读的点数
-
-    out = pd.DataFrame({
-        dim: idx,
-        "cur_sales_value": cur["sales_value"],
-        "cur_share": cur_share,
-        "last_share": last_share,
-        "share_pp": share_pp,
-        "cur_wdist": cur["wdist_pct"],
-        "wdist_pp": wdist_pp,
-        "vel_share_pp": vel_share_pp,
-        "cur_price": cur["price"],
-    }).reset_index(drop=True)
-
-    out = out.replace([np.inf, -np.inf], np.nan)
+    if series is None:
+        # 单次调用只需要本期和去年同期两个财季
+        series = _engine(engine).share_series(b[b["fp"].isin([latest_fp, last_fp]).to_numpy()], dim)
+    out = series[(series["brand"] == brand) & (series["fp"] == latest_fp)]
+    return _drilldown(out[[dim] + DECOMPOSE_COLUMNS].reset_index(drop=True), latest_fq=latest_fq)
 
+def _drilldown(out: pd.DataFrame, **head) -> dict:
+    """
+    单个品牌、单个周期的拆解表 -> 下钻结果：top3 增长 / 下跌 + 归因表
+    """
     top_up = out.sort_values("share_pp", ascending=False).head(3)
     top_down = out.sort_values("share_pp", ascending=True).head(3)
 
@@ -157,89 +362,655 @@ def decompose_share_change(df_agg: pd.DataFrame, dim: str, brand: str, fy: int):
     table = out.sort_values("cur_sales_value", ascending=False).head(30)
 
     return {
-        "latest_fq": latest_fq,
+        **head,
         "top_up": top_up.to_dict(orient="records"),
         "top_down": top_down.to_dict(orient="records"),
         "table": table.to_dict(orient="records")
     }
 
-def build_insight(df: pd.DataFrame, brand: str) -> dict:
+# 立方体：brand x area x province x channel x 月 的可加总量；财季/财年/品牌级、各市场层级都由它上卷得到
+# 铺货率存加权分量（DIST_PARTS），上卷后再相除，与直接对明细行加权完全一致
+CUBE_DIMS = ["brand", "area", "province", "channel"]
+CUBE_KEYS = CUBE_DIMS + ["month", "fy", "fq", "fp"]
+CUBE_SUMS = ["sales_value", "sales_volume", "category_sales_value"]
+CUBE_VALUES = CUBE_SUMS + DIST_PARTS
+
+@traced()
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
     """
-    产出：给 LLM 的结构化 payload
+    明细行 -> 立方体（只扫描一次明细）；列：CUBE_KEYS + CUBE_VALUES
+    """
+    # 列式存储读出来自带分区列 fy，但没有 month/fq/fp
+    if not {"fy", "fq", "month", "fp"} <= set(df.columns):
+        df = add_time_fields(df)
+    if "category_sales_value" not in df.columns:
+        df = build_brand_category(df)
+    missing = [c for c in ["area", "province", "channel"] if c not in df.columns]
+    if missing:
+        df = df.copy(deep=False)
+        for c in missing:
+            df[c] = ""
+    gb = df.groupby(CUBE_KEYS, dropna=False, observed=True)
+    codes = gb.ngroup().to_numpy()
+    cube = gb.size().reset_index(name="_rows").drop(columns="_rows")
+
+    # 明细是 float32；汇总量级大、下游还要做比值/同比，逐列转 float64 再累加（与 SQL 引擎的 SUM 同精度），
+    # 每次只多占一列的临时内存。缺失值不计入（同 pandas sum）
+    for c in CUBE_SUMS:
+        v = df[c].to_numpy(np.float64, na_value=np.nan)
+        cube[c] = np.bincount(codes, weights=np.where(np.isnan(v), 0.0, v), minlength=len(cube))
+    for c, v in dist_parts(df).items():
+        cube[c] = np.bincount(codes, weights=v, minlength=len(cube))
+    return conform_cube(cube)
+
+def conform_cube(cube: pd.DataFrame) -> pd.DataFrame:
     """
-    df = add_time_fields(df)
-    df = build_brand_category(df)
+    立方体列统一成约定类型（各分析引擎的输出、落盘再读回的立方体都过一遍）：
+      brand/area/province/channel -> category，month/fq/fp -> 有序分类，类别表一律按字典序
+      （分组、排序结果不依赖数据写入顺序，不同引擎的输出逐行可比）；fy -> FY_DTYPE
+    已经符合的列不动
+    """
+    for c in CUBE_DIMS + ["month", "fq", "fp"]:
+        if c not in cube.columns:
+            continue
+        s = cube[c]
+        if not isinstance(s.dtype, pd.CategoricalDtype):
+            s = s.astype("category")  # 由取值建类别表，自带排序
+        if not s.cat.categories.is_monotonic_increasing:
+            s = s.cat.reorder_categories(s.cat.categories.sort_values())
+        ordered = c in ("month", "fq", "fp")
+        if s.cat.ordered != ordered:
+            s = s.cat.as_ordered() if ordered else s.cat.as_unordered()
+        cube[c] = s
+    if "fy" in cube.columns and cube["fy"].dtype != FY_DTYPE:
+        cube["fy"] = pd.to_numeric(cube["fy"], errors="coerce").astype(FY_DTYPE)
+    return cube
+
+@traced()
+def rollup(cube: pd.DataFrame, keys: list[str], period_key: str, where: np.ndarray | None = None) -> pd.DataFrame:
+    """
+    立方体上卷，输出与 agg_period(明细, keys, period_key) 相同的列
+    where：行过滤掩码；只取分组要用的列再过滤，不复制整张立方体
+    """
+    period_cols = PERIOD_COLUMNS.get(period_key, [period_key])
+    if where is not None:
+        cube = cube.loc[where, keys + period_cols + CUBE_VALUES]
+    g = cube.groupby(keys + period_cols, dropna=False, observed=True)[CUBE_VALUES].sum().reset_index()
+    return finish_period(g)
+
+# 市场层级（与下钻同口径：省份层 = 带省份的格子，渠道层 = 不带省份的渠道格子）：
+#   area          大区 -> 省份：由省份格子按所属大区上卷；某品牌某月某大区没有省份格子时才用直接报告的大区行
+#   province      省份（省内各渠道合计）
+#   channel_group 渠道组 -> 渠道：由渠道格子按 CHANNEL_PARENTS 上卷，规则同 area；不在渠道树里的渠道自成一组
+#   channel       渠道
+MARKET_LEVELS = ["area", "province", "channel_group", "channel"]
+
+# 渠道树：渠道 -> 渠道组（scripts/excel_to_csv.CHANNEL_HINTS 里的渠道；市场字段形如 全国/现代渠道/超市/CN）
+CHANNEL_PARENTS = {
+    "超市": "现代渠道", "大卖场": "现代渠道", "便利店": "现代渠道", "KA": "现代渠道", "CVS": "现代渠道", "MT": "现代渠道",
+    "GT": "传统渠道",
+    "电商": "线上", "O2O": "线上", "社区团购": "线上",
+}
+
+def _category_map(s: pd.Series, mapping: dict) -> np.ndarray:
+    # 只映射类别表，再按 code 展开；缺失值映射为空串
+    s = s.astype("category")
+    cats = np.array([mapping.get(c, c) for c in s.cat.categories.astype(str)] + [""], dtype=object)
+    return cats[s.cat.codes.to_numpy()]
+
+def level_rows(cube: pd.DataFrame, dim: str, channel_parents: dict | None = None) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    立方体里构成层级 dim 的格子（见 MARKET_LEVELS）-> (行掩码, 每行的成员)；成员就是 dim 列本身时为 None
+    每个 品牌 x 成员 x 月 只取一种颗粒：有直接报告的汇总行（省份合计 / 大区行 / 渠道大类行）就用它，
+    没有才由子层级格子上卷，避免同一笔销售算两次
+    """
+    if dim not in MARKET_LEVELS:
+        raise ValueError(f"未知的市场层级：{dim}（可选 {'/'.join(MARKET_LEVELS)}）")
+    has_prov = _nonempty(cube["province"])
+    has_ch = _nonempty(cube["channel"])
+    if dim == "province":
+        # 省份合计行（无渠道）优先，否则用该省的 省份 x 渠道 格子
+        return _one_grain(cube, cube["province"].astype(object).to_numpy(), has_prov & has_ch, has_prov & ~has_ch), None
+    # 全国/东部/CN 这样的大区行，parse_market 会把末段同时当成渠道：它们不属于渠道层级
+    channel = cube["channel"].astype(object).fillna("").to_numpy()
+    area_row = channel == cube["area"].astype(object).fillna("").to_numpy()
+    channels = has_ch & ~has_prov & ~area_row
+    if dim == "channel":
+        return channels, None
+    if dim == "area":
+        has_area = _nonempty(cube["area"])
+        member = cube["area"].astype(object).to_numpy()
+        children = has_area & level_rows(cube, "province")[0]
+        return _one_grain(cube, member, children, has_area & ~has_prov & (~has_ch | area_row)), None
+    parents = CHANNEL_PARENTS if channel_parents is None else channel_parents
+    is_group = np.isin(channel, list(set(parents.values())))
+    member = _category_map(cube["channel"], parents)
+    return _one_grain(cube, member, channels & ~is_group, channels & is_group), member
+
+def _one_grain(cube: pd.DataFrame, member: np.ndarray, children: np.ndarray, direct: np.ndarray) -> np.ndarray:
+    # 同一 品牌 x 成员 x 月 有直接报告的行时丢掉子层级格子
+    keys = pd.MultiIndex.from_arrays([cube["brand"].to_numpy(), member, cube["month"].to_numpy()])
+    return direct | (children & ~keys.isin(keys[direct]))
 
-    # 先聚合“总览”：按 brand + fq / month（不区分省份/渠道）
-    base = df.copy()
+def market_level(cube: pd.DataFrame, dim: str, channel_parents: dict | None = None) -> pd.DataFrame:
+    """
+    层级 dim 的格子，dim 列为该层级的成员；上卷这些格子即得该层级的精确汇总
+    """
+    rows, member = level_rows(cube, dim, channel_parents)
+    part = cube.loc[rows]
+    if member is not None:
+        part = part.assign(**{dim: pd.Categorical(member[rows])})
+    return part
+
+@traced()
+def hierarchy_rollup(
+    cube: pd.DataFrame,
+    period_key: str = "fq",
+    levels: list[str] | None = None,
+    keys: list[str] | None = None,
+    channel_parents: dict | None = None,
+) -> pd.DataFrame:
+    """
+    一次分组得到全部市场层级的汇总（口径同 rollup：可加总量求和，铺货率加权分量相除）
+    各层级的格子（level_rows）按行号纵向拼接，带上 (level, member) 两列后只取一次、只做一次 groupby
+    输出列：keys（默认 brand）+ level + member + 周期列 + rollup 的指标列
+    """
+    levels = MARKET_LEVELS if levels is None else levels
+    keys = ["brand"] if keys is None else keys
+    period_cols = PERIOD_COLUMNS.get(period_key, [period_key])
+    idx, level, member = [], [], []
+    for i, lv in enumerate(levels):
+        rows, values = level_rows(cube, lv, channel_parents)
+        if values is None:
+            values = cube[lv].astype(object).to_numpy()
+        pos = np.flatnonzero(rows)
+        idx.append(pos)
+        level.append(np.full(len(pos), i))
+        member.append(values[pos])
+    stacked = cube[keys + period_cols + CUBE_VALUES].take(np.concatenate(idx)).reset_index(drop=True)
+    stacked["level"] = pd.Categorical.from_codes(np.concatenate(level), categories=levels)
+    stacked["member"] = np.concatenate(member)
+    g = stacked.groupby(keys + ["level", "member"] + period_cols, dropna=False, observed=True, sort=True)[CUBE_VALUES].sum()
+    return finish_period(g.reset_index())
+
+def save_cube(cube: pd.DataFrame, path: str = "data/clean/nielsen_cube.parquet") -> None:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError("保存立方体需要 pyarrow：pip install pyarrow") from e
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cube.to_parquet(path, index=False)
+
+# 列式存储里的逐月校验和清单（scripts/excel_to_csv.py 写入；pyarrow 读数据集时忽略 _ 开头的文件）
+STORE_MANIFEST = "_months.json"
+
+def month_key(dates) -> pd.Series:
+    """
+    日期 -> 自然月 YYYY-MM（字符串）；日期缺失为空串。增量刷新、校验和都以它为键
+    """
+    return fiscal_fields(dates)["month"].astype(object).fillna("")
+
+def read_store_manifest(data_path: str) -> dict:
+    path = os.path.join(data_path, STORE_MANIFEST)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def replace_cube_months(cube: pd.DataFrame, fresh: pd.DataFrame | None, months: list[str]) -> pd.DataFrame:
+    """
+    立方体里 months 这些月份的格子整体替换为 fresh（None 表示这些月份已不存在）
+    """
+    keep = cube[~month_key_of_cube(cube).isin(months)]
+    if fresh is None or fresh.empty:
+        return keep.reset_index(drop=True)
+    return pd.concat([keep, fresh], ignore_index=True)
+
+def month_key_of_cube(cube: pd.DataFrame) -> pd.Series:
+    return cube["month"].astype(object).fillna("")
+
+@traced()
+def refresh_cube(
+    data_path: str = "data/clean/nielsen_store",
+    cube_path: str = "data/clean/nielsen_cube.parquet",
+    rebuild: bool = False,
+    engine=None,
+) -> tuple[pd.DataFrame, list[str] | None]:
+    """
+    读取/更新立方体，返回 (cube, changed_months)；changed_months 为 None 表示全量重建
+      - 列式存储带逐月校验和清单时：与立方体上次构建时的快照比对，
+        只重读新增 / 重述（校验和变化）/ 已删除的月份所在财年分区，替换这些月份的格子
+      - 否则（CSV 或旧存储）：立方体比源数据旧就全量重建
+      - 落盘的立方体列不全（旧版本的立方体，如铺货率还是简单均值）：全量重建
+    明细的扫描和聚合交给 engine（见 engine.py；默认读 REPORT_ENGINE）
+    """
+    engine = _engine(engine)
+    manifest = read_store_manifest(data_path).get("months", {})
+    checksums = {m: v["checksum"] for m, v in manifest.items()}
+    snapshot_path = cube_path + ".months.json"
+
+    cube = None
+    if not rebuild and os.path.exists(cube_path):
+        cube = conform_cube(pd.read_parquet(cube_path))
+        if not set(CUBE_KEYS + CUBE_VALUES) <= set(cube.columns):
+            cube = None
+    if cube is not None:
+        if manifest and os.path.exists(snapshot_path):
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                built = json.load(f)
+            changed = sorted(m for m in set(checksums) | set(built) if checksums.get(m) != built.get(m))
+            if changed:
+                fys = sorted({manifest[m]["fy"] for m in changed if m in manifest})
+                fresh = None
+                if fys:
+                    fresh = engine.build_cube(data_path, fy=fys, months=changed)
+                cube = conform_cube(replace_cube_months(cube, fresh, changed))
+                _save_cube_state(cube, cube_path, checksums)
+            return cube, changed
+        if not manifest and (not os.path.exists(data_path) or os.path.getmtime(cube_path) >= os.path.getmtime(data_path)):
+            return cube, []
+
+    cube = engine.build_cube(data_path)
+    _save_cube_state(cube, cube_path, checksums)
+    return cube, None
+
+def _save_cube_state(cube: pd.DataFrame, cube_path: str, checksums: dict) -> None:
+    save_cube(cube, cube_path)
+    snapshot_path = cube_path + ".months.json"
+    if checksums:
+        with open(snapshot_path, "w", encoding="utf-8") as f:
+            json.dump(checksums, f, ensure_ascii=False, indent=2)
+    elif os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+
+def load_cube(
+    data_path: str = "data/clean/nielsen_store",
+    cube_path: str = "data/clean/nielsen_cube.parquet",
+    rebuild: bool = False,
+) -> pd.DataFrame:
+    """
+    读取已物化的立方体（必要时增量或全量更新并落盘，见 refresh_cube）
+    之后换品牌/换周期的查询只碰立方体，不再扫描明细
+    """
+    return refresh_cube(data_path, cube_path, rebuild)[0]
+
+def brands_in_months(cube: pd.DataFrame, months: list[str]) -> list:
+    """
+    这些月份里出现过的品牌（增量刷新时只需重算它们的 payload）
+    """
+    return cube.loc[month_key_of_cube(cube).isin(months), "brand"].dropna().unique().tolist()
+
+# 分析窗口：名称 -> 说明；另外支持 r<N>m（滚动 N 个月）和 YYYY-MM:YYYY-MM（自定义月份区间）
+WINDOWS = {
+    "fq": "最新财季",
+    "mat": "滚动12个月（MAT）",
+    "ytd": "财年至今（YTD）",
+    "r3m": "滚动3个月",
+}
+
+def window_months(window: str, end: int) -> tuple[int, int]:
+    """
+    窗口 -> (起始月, 结束月) 月编号（SERIES_PERIODS['month']，闭区间）；end 是最新月
+    去年同期窗口 = 两端各减 12
+    """
+    w = str(window).strip().lower()
+    to_number = SERIES_PERIODS["month"][1]
+    if ":" in w:
+        a, b = (x.strip() for x in w.split(":", 1))
+        try:
+            start, end = to_number(a), to_number(b)
+        except ValueError:
+            raise ValueError(f"自定义窗口应为 YYYY-MM:YYYY-MM：{window}") from None
+        if start > end:
+            raise ValueError(f"窗口起始月晚于结束月：{window}")
+        return start, end
+    offset = (end % 12 + 1 - FY_START_MONTH) % 12  # 最新月在财年里是第几个月（0 起）
+    if w == "fq":
+        return end - offset % 3, end
+    if w == "ytd":
+        return end - offset, end
+    if w == "mat":
+        return end - 11, end
+    if w.startswith("r") and w.endswith("m") and w[1:-1].isdigit() and int(w[1:-1]) > 0:
+        return end - int(w[1:-1]) + 1, end
+    raise ValueError(f"未知窗口：{window}（可选 {'/'.join(WINDOWS)}、r<N>m 或 YYYY-MM:YYYY-MM）")
+
+class WindowIndex:
+    """
+    立方体 -> 逐月前缀和（品牌 / 品牌 x 任一市场层级（MARKET_LEVELS），口径与下钻相同）
+    任意连续月份窗口的合计 = 前缀和两次查表相减，窗口再多也不用重新扫描立方体
+    每层在第一次查询时构建：prefix[度量, (brand, dim), 月] 稠密网格，月轴前补一列 0
+    """
+    MEASURES = CUBE_VALUES + ["cells"]
+
+    def __init__(self, cube: pd.DataFrame):
+        self.cube = cube
+        self._levels = {}
+
+    def level(self, dim: str | None = None) -> dict:
+        if dim not in self._levels:
+            self._levels[dim] = self._build(dim)
+        return self._levels[dim]
+
+    def _build(self, dim: str | None) -> dict:
+        cube = self.cube if dim is None else market_level(self.cube, dim)
+        cube = cube.loc[cube["month"].notna().to_numpy() & cube["brand"].notna().to_numpy()]
+        keys = ["brand"] + ([dim] if dim else [])
+        if cube.empty:
+            return {"keys": pd.DataFrame(columns=keys), "rows": {}, "t0": 0, "n_t": 0, "prefix": np.zeros((len(self.MEASURES), 0, 1))}
+
+        t = _period_numbers(cube["month"], SERIES_PERIODS["month"][1])
+        gb = cube.groupby(keys, observed=True, dropna=False, sort=True)
+        g = gb.ngroup().to_numpy()
+        key_frame = gb.size().index.to_frame(index=False)
+        t0 = int(t.min())
+        n_t = int(t.max()) - t0 + 1
+        flat = g * (n_t + 1) + (t - t0 + 1)
+        size = len(key_frame) * (n_t + 1)
+        grid = np.stack(
+            [np.bincount(flat, weights=cube[c].to_numpy(np.float64), minlength=size) for c in self.MEASURES[:-1]]
+            + [np.bincount(flat, minlength=size).astype(np.float64)]
+        )
+        return {
+            "keys": key_frame,
+            "rows": key_frame.groupby("brand", observed=True, sort=False).indices,
+            "t0": t0,
+            "n_t": n_t,
+            "prefix": grid.reshape(len(self.MEASURES), len(key_frame), n_t + 1).cumsum(axis=2),
+        }
+
+    def sums(self, brand, start: int, end: int, dim: str | None = None) -> tuple[np.ndarray, dict]:
+        """
+        [start, end] 月窗口内的合计：返回 (dim 取值, {度量: 数组})；dim 为空时是品牌级（数组长度 0 或 1）
+        """
+        lv = self.level(dim)
+        rows = lv["rows"].get(brand, np.array([], dtype=np.int64))
+        a = int(np.clip(start - lv["t0"], 0, lv["n_t"]))
+        b = int(np.clip(end - lv["t0"] + 1, 0, lv["n_t"]))
+        v = lv["prefix"][:, rows, max(a, b)] - lv["prefix"][:, rows, a]
+        dims = lv["keys"][dim].to_numpy(dtype=object)[rows] if dim else np.full(len(rows), brand, dtype=object)
+        return dims, dict(zip(self.MEASURES, v))
+
+def _window_values(v: dict) -> dict:
+    """
+    窗口合计 -> 指标（口径同 finish_period）；窗口内没有任何格子的记为缺失
+    """
+    empty = v["cells"] == 0
+    out = {c: np.where(empty, np.nan, v[c]) for c in CUBE_SUMS}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for c in DIST_WEIGHTS:
+            w = v[f"{c}_w"]
+            out[c] = np.where(empty | (w <= 0), np.nan, v[f"{c}_wsum"] / w)
+        out["share_value_pct"] = out["sales_value"] / out["category_sales_value"] * 100.0
+        out["price"] = np.where(out["sales_volume"] > 0, out["sales_value"] / out["sales_volume"], np.nan)
+    out["present"] = ~empty
+    return out
+
+def _window_drilldown(index: WindowIndex, brand, dim: str, start: int, end: int, head: dict) -> dict:
+    """
+    窗口版 decompose_share_change：本窗口 vs 去年同期窗口，逐 dim 做份额拆解
+    """
+    dims, v = index.sums(brand, start, end, dim)
+    cur = _window_values(v)
+    last = _window_values(index.sums(brand, start - 12, end - 12, dim)[1])
+    if not last["present"].any():
+        return {**head, "top_up": [], "top_down": [], "table": []}
+    out = decomposition_frame(
+        np.full(len(dims), brand, dtype=object), dims, np.full(len(dims), end),
+        [cur[c] for c in ("sales_value", "category_sales_value", "share_value_pct", "wdist_pct", "price")],
+        [last[c] for c in ("sales_value", "category_sales_value", "share_value_pct", "wdist_pct")],
+        dim, period="month",
+    )
+    out = out[cur["present"] | last["present"]]
+    return _drilldown(out[[dim] + DECOMPOSE_COLUMNS].reset_index(drop=True), **head)
+
+@dataclass
+class InsightAggregates:
+    """
+    build_insight 需要的全部聚合表（所有品牌共用，只算一次）
+      agg_fq:   brand x 财季（总览）
+      agg_m:    brand x 月（趋势）
+      agg_prov: brand x province x 财季（省份下钻）
+      agg_ch:   brand x channel x 财季（渠道下钻）
+      windows:  逐月前缀和（WindowIndex），window= 任意月份窗口时用；没有则只能出最新财季
+      quality:  入库时的质量报告（quality.read_quality_report），有则按品牌放进 payload 的 data_quality
+    """
+    agg_fq: pd.DataFrame
+    agg_m: pd.DataFrame
+    agg_prov: pd.DataFrame
+    agg_ch: pd.DataFrame
+    windows: WindowIndex | None = None
+    quality: dict | None = None
+
+    TABLES = ("agg_fq", "agg_m", "agg_prov", "agg_ch")
+
+    def brands(self) -> list:
+        return self.agg_fq["brand"].dropna().unique().tolist()
+
+    def split_by_brand(self) -> dict:
+        """按品牌切分一次，避免每个品牌都对全表做布尔过滤"""
+        parts = {}
+        for name in self.TABLES:
+            for b, g in getattr(self, name).groupby("brand", sort=False, observed=True):
+                parts.setdefault(b, {})[name] = g
+        return {b: InsightAggregates(**{**self.empty().__dict__, **p}) for b, p in parts.items()}
+
+    def empty(self) -> "InsightAggregates":
+        return InsightAggregates(**{name: getattr(self, name).iloc[0:0] for name in self.TABLES},
+                                 windows=self.windows, quality=self.quality)
+
+    def as_of(self, fp: str) -> "InsightAggregates":
+        """
+        截到财季 fp（含）为止：由此派生的 payload 以 fp 为“最新财季”，月度趋势也只到该季度末
+        """
+        split_period(fp)  # 校验格式，FY2026Q1
+        months = self.agg_m["month"].astype(object)
+        month_fp = fiscal_fields(pd.to_datetime(months, format="%Y-%m", errors="coerce"))["fp"].astype(object)
+        out = {name: getattr(self, name) for name in self.TABLES}
+        for name in ("agg_fq", "agg_prov", "agg_ch"):
+            out[name] = out[name][_until(out[name]["fp"].astype(object), fp)]
+        out["agg_m"] = self.agg_m[_until(month_fp, fp)]
+        return InsightAggregates(**out, windows=self.windows, quality=self.quality)
+
+def _until(keys: pd.Series, last: str) -> np.ndarray:
+    # 周期键字符串序即时间序；缺失的不要
+    return (keys.notna() & (keys.fillna("") <= last)).to_numpy()
+
+def build_aggregates(df: pd.DataFrame) -> InsightAggregates:
+    """
+    明细 -> 立方体 -> 四张聚合表：整份数据只扫描一次
+    """
+    return aggregates_from_cube(build_cube(df))
+
+@traced()
+def aggregates_from_cube(cube: pd.DataFrame, engine=None, quality: dict | None = None) -> InsightAggregates:
+    """
+    四张聚合表全部由立方体上卷得到（不碰明细行）；上卷交给 engine（见 engine.py）
+    月份窗口的前缀和挂在 windows 上，第一次按窗口出 payload 时才构建
+    """
+    rollup_ = _engine(engine).rollup
+    # 总览：按 brand + fq / month（不区分省份/渠道）
     # 只保留“全国级/不带省份的行”可能更合理，但你的数据来源可能不同，这里先不过滤
-    agg_fq = agg_period(base, keys=["brand"], period_key="fq")
-    agg_m = agg_period(base, keys=["brand"], period_key="month")
-
-    # 补 fy/fq 到聚合表
-    # fq 聚合：用原始 df 的 fy 对应 fq 的最近值（简化）
-    # 更严谨：fq 本身属于财年，这里按日期映射
-    fq_map = df.dropna(subset=["fq","fy"])[["fq","fy"]].drop_duplicates().set_index("fq")["fy"].to_dict()
-    agg_fq["fy"] = agg_fq["fq"].map(fq_map)
-
-    # 取最新财年、最新季度
-    brand_fq = agg_fq[agg_fq["brand"] == brand].dropna(subset=["fy","fq"]).copy()
-    latest_fy = int(brand_fq["fy"].max()) if not brand_fq.empty else None
-    latest_fq = brand_fq[brand_fq["fy"] == latest_fy]["fq"].iloc[-1] if latest_fy else None
-
-    cur = brand_fq[(brand_fq["fy"] == latest_fy) & (brand_fq["fq"] == latest_fq)]
-    last = brand_fq[(brand_fq["fy"] == latest_fy - 1) & (brand_fq["fq"] == latest_fq)] if latest_fy else pd.DataFrame()
-
-    # 总览指标
-    if not cur.empty:
-        cur_row = cur.iloc[0]
-        cur_sales = float(cur_row["sales_value"]) if pd.notna(cur_row["sales_value"]) else None
-        cur_share = float(cur_row["share_value_pct"]) if pd.notna(cur_row["share_value_pct"]) else None
-    else:
-        cur_sales, cur_share = None, None
+    agg_fq = rollup_(cube, keys=["brand"], period_key="fq")
+    agg_m = rollup_(cube, keys=["brand"], period_key="month")
+
+    # 省份下钻 / 渠道下钻的格子口径见 level_rows（每个 品牌 x 成员 x 月 只取一种颗粒）
+    agg_prov = rollup_(cube, keys=["brand","province"], period_key="fq", where=level_rows(cube, "province")[0])
+    agg_ch = rollup_(cube, keys=["brand","channel"], period_key="fq", where=level_rows(cube, "channel")[0])
+
+    return InsightAggregates(agg_fq=agg_fq, agg_m=agg_m, agg_prov=agg_prov, agg_ch=agg_ch,
+                             windows=WindowIndex(cube), quality=quality)
+
+@traced()
+def build_insight(df: pd.DataFrame, brand: str, window: str | None = None) -> dict:
+    """
+    产出：给 LLM 的结构化 payload
+    window: 总览和省份/渠道下钻的对比窗口（见 WINDOWS / window_months），为空 = 最新财季 vs 去年同季
+    """
+    # 聚合都按 brand 分组：先切出本品牌的明细行，不为其他品牌建立方体
+    return insight_from_aggregates(build_aggregates(df[(df["brand"] == brand).to_numpy()]), brand, window=window)
+
+def build_insight_many(df: pd.DataFrame, brands: list[str] | None = None, window: str | None = None) -> dict:
+    """
+    批量版 build_insight：聚合只做一次，再逐品牌派生 payload
+    brands 为空则输出数据里的全部品牌；返回 {brand: payload}
+    """
+    return insight_many_from_cube(build_cube(df), brands, window=window)
+
+@traced()
+def insight_from_cube(cube: pd.DataFrame, brand: str, engine=None, window: str | None = None, quality: dict | None = None) -> dict:
+    """
+    只用立方体里该品牌的切片生成 payload
+    """
+    aggs = aggregates_from_cube(cube[cube["brand"] == brand], engine, quality)
+    return insight_from_aggregates(aggs, brand, engine, window)
+
+def share_history_from_cube(
+    cube: pd.DataFrame,
+    dim: str = "province",
+    period: str = "fp",
+    brands: list[str] | None = None,
+    engine=None,
+) -> pd.DataFrame:
+    """
+    立方体 -> 全历史份额拆解时间序列（见 share_decomposition_series），用来看某个省份/渠道从哪个周期开始掉份额
+    dim: 市场层级（MARKET_LEVELS，与下钻同口径：渠道只取不带省份的格子，大区 / 渠道组由下级精确上卷）；
+    period: 'fp' 财季 / 'month' 月
+    """
+    if brands is not None:
+        cube = cube[cube["brand"].isin(brands).to_numpy()]
+    engine = _engine(engine)
+    agg = engine.rollup(market_level(cube, dim), keys=["brand", dim], period_key="fq" if period == "fp" else period)
+    return engine.share_series(agg, dim, period=period)
+
+@traced()
+def insight_many_from_cube(
+    cube: pd.DataFrame,
+    brands: list[str] | None = None,
+    engine=None,
+    window: str | None = None,
+    quality: dict | None = None,
+) -> dict:
+    aggs = aggregates_from_cube(cube, engine, quality)
+    by_brand = aggs.split_by_brand()
+    if brands is None:
+        brands = aggs.brands()
+    return {b: insight_from_aggregates(by_brand.get(b) or aggs.empty(), b, engine, window) for b in brands}
+
+def _overview(cur, last) -> dict:
+    """
+    总览指标：cur / last 为本期、去年同期的一行（含 sales_value / category_sales_value / share_value_pct），缺失为 None
+    """
+    cur_sales, cur_share = None, None
+    if cur is not None:
+        cur_sales = float(cur["sales_value"]) if pd.notna(cur["sales_value"]) else None
+        cur_share = float(cur["share_value_pct"]) if pd.notna(cur["share_value_pct"]) else None
 
     share_pp = None
     brand_growth = None
     cat_growth = None
     share_story = "无法判断（缺少同比基期）"
 
-    if not cur.empty and not last.empty:
-        last_row = last.iloc[0]
-        share_pp = float(cur_row["share_value_pct"] - last_row["share_value_pct"])
-        brand_growth = float((cur_row["sales_value"] - last_row["sales_value"]) / last_row["sales_value"] * 100.0) if last_row["sales_value"] else None
-        cat_growth = float((cur_row["category_sales_value"] - last_row["category_sales_value"]) / last_row["category_sales_value"] * 100.0) if last_row["category_sales_value"] else None
+    if cur is not None and last is not None:
+        share_pp = float(cur["share_value_pct"] - last["share_value_pct"])
+        brand_growth = float((cur["sales_value"] - last["sales_value"]) / last["sales_value"] * 100.0) if last["sales_value"] else None
+        cat_growth = float((cur["category_sales_value"] - last["category_sales_value"]) / last["category_sales_value"] * 100.0) if last["category_sales_value"] else None
         share_story = classify_share_move(brand_growth, cat_growth)
 
+    return {
+        "latest_quarter_sales_value": cur_sales,
+        "latest_quarter_share_value_pct": cur_share,
+        "share_yoy_pp": share_pp,
+        "brand_sales_yoy_pct": brand_growth,
+        "category_sales_yoy_pct": cat_growth,
+        "share_story": share_story,
+    }
+
+@traced()
+def insight_from_aggregates(aggs: InsightAggregates, brand: str, engine=None, window: str | None = None) -> dict:
+    """
+    从聚合表派生单个品牌的 payload（不再扫描明细行）
+    window: 为空 = 最新财季 vs 去年同季（财季聚合表）；否则按月份窗口（aggs.windows 前缀和查表），
+    总览 latest_quarter_* 和两个下钻都换成该窗口 vs 去年同期窗口，payload 多一个 window 字段说明区间
+    同比一律同口径：最新财季不满 3 个月（数据截至季中）时，只与去年同季的相同月份比较（即按 window="fq" 计算），
+    所以 window 为空与 window="fq" 的总览和下钻总是相同，差别只在后者多一个 window 字段
+    """
+    agg_fq, agg_m, agg_prov, agg_ch = aggs.agg_fq, aggs.agg_m, aggs.agg_prov, aggs.agg_ch
+
     # 月度趋势（用于画图）
     m = agg_m[agg_m["brand"] == brand].copy().sort_values("month")
-    monthly_trend = m[["month","sales_value","share_value_pct"]].to_dict(orient="records")
+    months = m["month"].dropna().astype(str)
+    latest = SERIES_PERIODS["month"][1](months.max()) if len(months) else None
 
-    # 省份下钻：对原始 df 先过滤省份非空，再按 fy+fq+province 聚合
-    df_prov = df[df["province"].astype(str).str.len() > 0].copy()
-    agg_prov = agg_period(df_prov, keys=["brand","province"], period_key="fq")
-    agg_prov["fy"] = agg_prov["fq"].map(fq_map)
+    partial = False
+    if window is None and latest is not None and aggs.windows is not None:
+        start, end = window_months("fq", latest)
+        partial = end - start < 2
+
+    if window is None and not partial:
+        # 取最新财季（财季键 FY2026Q1 可直接排序），同比基期 = 平移 4 个季度
+        brand_fq = agg_fq[agg_fq["brand"] == brand].dropna(subset=["fy","fq"])
+        latest_fp = brand_fq["fp"].max() if not brand_fq.empty else None
+        latest_fy, latest_fq = split_period(latest_fp) if latest_fp else (None, None)
+
+        cur = brand_fq[brand_fq["fp"] == latest_fp]
+        last = brand_fq[brand_fq["fp"] == shift_period(latest_fp, -4)] if latest_fp else pd.DataFrame()
+        overview = _overview(cur.iloc[0] if not cur.empty else None, last.iloc[0] if not last.empty else None)
+
+        # 省份 / 渠道下钻
+        prov_res = decompose_share_change(agg_prov, dim="province", brand=brand, fy=latest_fy, engine=engine) if latest_fy else {}
+
+        ch_res = decompose_share_change(agg_ch, dim="channel", brand=brand, fy=latest_fy, engine=engine) if latest_fy else {}
+        window_info = None
+    else:
+        if aggs.windows is None:
+            raise ValueError("聚合表没有逐月前缀和（aggregates_from_cube 生成的才有），不能按窗口出 payload")
+        name = "fq" if window is None else str(window).strip().lower()
+        window_months(name, 0)  # 先校验写法：品牌没有数据时也要报错
+        latest_fy = latest_fq = None
+        overview, prov_res, ch_res, window_info = _overview(None, None), {}, {}, None
+        if latest is not None:
+            start, end = window_months(name, latest)
+            to_key = SERIES_PERIODS["month"][2]
+            end_date = pd.Timestamp(year=end // 12, month=end % 12 + 1, day=1)
+            latest_fy, latest_fq = fiscal_year(end_date), fiscal_quarter(end_date)
+            if window is not None:
+                window_info = {
+                    "name": name,
+                    "label": WINDOWS.get(name, f"{to_key(start)} 至 {to_key(end)}"),
+                    "start": to_key(start),
+                    "end": to_key(end),
+                    "base_start": to_key(start - 12),
+                    "base_end": to_key(end - 12),
+                    "months": end - start + 1,
+                }
+            cur = _window_values(aggs.windows.sums(brand, start, end)[1])
+            last = _window_values(aggs.windows.sums(brand, start - 12, end - 12)[1])
+            overview = _overview(
+                {c: v[0] for c, v in cur.items()} if cur["present"].any() else None,
+                {c: v[0] for c, v in last.items()} if last["present"].any() else None,
+            )
+            head = {"latest_fq": latest_fq, **({"window": name} if window is not None else {})}
+            prov_res = _window_drilldown(aggs.windows, brand, "province", start, end, head)
+            ch_res = _window_drilldown(aggs.windows, brand, "channel", start, end, head)
+            m = m[m["month"].astype(str) <= to_key(end)]
 
-    prov_res = decompose_share_change(agg_prov.assign(fy=agg_prov["fy"]), dim="province", brand=brand, fy=latest_fy) if latest_fy else {}
+    # 品类销额随月度趋势带上：跨月份额要用 销额合计 / 品类销额合计 重算（compact.summarize_trend），不能平均月度份额
+    monthly_trend = m[["month","sales_value","category_sales_value","share_value_pct"]].to_dict(orient="records")
 
-    # 渠道下钻：过滤 channel 非空且 province 为空（尽量避免混维）
-    df_ch = df[(df["channel"].astype(str).str.len() > 0) & ~(df["province"].astype(str).str.len() > 0)].copy()
-    agg_ch = agg_period(df_ch, keys=["brand","channel"], period_key="fq")
-    agg_ch["fy"] = agg_ch["fq"].map(fq_map)
+    quality = None
+    if aggs.quality:
+        from quality import brand_quality  # quality.py 依赖本模块，这里延迟导入
 
-    ch_res = decompose_share_change(agg_ch.assign(fy=agg_ch["fy"]), dim="channel", brand=brand, fy=latest_fy) if latest_fy else {}
+        quality = brand_quality(aggs.quality, brand)
 
     return {
         "brand": brand,
         "latest_fy": latest_fy,
         "latest_fq": latest_fq,
-        "overview": {
-            "latest_quarter_sales_value": cur_sales,
-            "latest_quarter_share_value_pct": cur_share,
-            "share_yoy_pp": share_pp,
-            "brand_sales_yoy_pct": brand_growth,
-            "category_sales_yoy_pct": cat_growth,
-            "share_story": share_story,
-        },
+        **({"window": window_info} if window is not None else {}),
+        **({"data_quality": quality} if quality else {}),
+        "overview": overview,
         "monthly_trend": monthly_trend,
         "province_drilldown": prov_res,
         "channel_drilldown": ch_res,
@@ -247,10 +1018,13 @@ def build_insight(df: pd.DataFrame, brand: str) -> dict:
             "sales_value": "销售额",
             "sales_volume": "销售量",
             "price": "单价=销额/销量",
-            "wdist_pct": "加权铺货率",
-            "ndist_pct": "数值铺货率",
+            "wdist_pct": "加权铺货率（多月 / 多市场汇总时按品类销额加权）",
+            "ndist_pct": "数值铺货率（同上加权）",
             "velocity_value": "单点卖力=销额/加权铺货率（百分点口径）",
             "share_value_pct": "销额份额",
-            "share_decompose": "销额份额 = 卖力份额 x 加权铺货率（近似拆解）"
+            "share_decompose": "销额份额 = 卖力份额 x 加权铺货率（近似拆解）",
+            "vel_contrib_pp": "份额同比变化中卖力贡献的点数（对数拆解，与 dist_contrib_pp 相加 = share_pp）",
+            "dist_contrib_pp": "份额同比变化中加权铺货贡献的点数",
+            **({"window": "对比窗口：latest_quarter_* 与各下钻均为 window 区间 vs 去年同期同长度窗口"} if window is not None else {}),
         }
     }
\ No newline at end of file
@@ -0,0 +1,199 @@
+# charts.py
+"""
+报告图表：月度销额/份额趋势、份额增长/下跌 Top 柱图、份额拆解（卖力 vs 铺货）
+
+- matplotlib 用 Agg 后端，无界面渲染；只在真的要画图时才导入
+- 内容寻址缓存：key = hash(图表类型, 数据, 字体, CHART_VERSION)，PNG 落在 outputs/chart_cache/，
+  数据没变的图跨运行、跨品牌直接复用；和 llm_cache 一样按 mtime 做 LRU，超过条数 / 字节上限从最久未用的开始淘汰
+- 缓存未命中的图用进程池并行渲染（workers<=1 时在当前进程画）
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from llm import SECTION_PROMPTS
+from llm_cache import canonical_json, list_entries, lru_overflow
+from report import find_zh_font
+
+CHART_CACHE_DIR = "outputs/chart_cache"
+CHART_VERSION = 2  # 改了画法就加 1，让旧缓存失效
+CHART_CACHE_MAX_ENTRIES = 2000
+CHART_CACHE_MAX_BYTES = 200 * 1024 * 1024
+FIGSIZE = (8.0, 3.6)  # 英寸；与 report.CHART_ASPECT 保持同样宽高比
+TREND_MONTHS = 36
+TOP_N = 8
+
+_font_ready = False
+
+
+def _setup_matplotlib():
+    global _font_ready
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    if not _font_ready:
+        path = find_zh_font()
+        if path:
+            from matplotlib import font_manager
+            font_manager.fontManager.addfont(path)
+            plt.rcParams["font.sans-serif"] = [font_manager.FontProperties(fname=path).get_name()]
+        plt.rcParams["axes.unicode_minus"] = False
+        _font_ready = True
+    return plt
+
+
+def _draw_trend(ax, data):
+    months = [r["month"] for r in data]
+    ax.bar(months, [r.get("sales_value") or 0 for r in data], color="#9bb7d4", label="销额")
+    ax.set_ylabel("销额")
+    step = max(1, len(months) // 12)
+    ax.set_xticks(range(0, len(months), step))
+    ax.set_xticklabels(months[::step], rotation=45, ha="right", fontsize=7)
+    ax2 = ax.twinx()
+    ax2.plot(months, [r.get("share_value_pct") for r in data], color="#c0392b", marker="o", ms=2, label="份额%")
+    ax2.set_ylabel("份额 %")
+    ax.set_title("月度销额 & 份额趋势")
+
+
+def _draw_top_moves(ax, data):
+    dim, rows = data["dim"], data["rows"]
+    names = [str(r[dim]) for r in rows]
+    vals = [r.get("share_pp") or 0 for r in rows]
+    ax.barh(names, vals, color=["#27ae60" if v >= 0 else "#c0392b" for v in vals])
+    ax.axvline(0, color="#555", lw=0.8)
+    ax.invert_yaxis()
+    ax.set_xlabel("份额同比 pp")
+    ax.set_title(f"份额增长 / 下跌 Top（{data['label']}）")
+
+
+def _draw_decompose(ax, data):
+    dim, rows = data["dim"], data["rows"]
+    names = [str(r[dim]) for r in rows]
+    x = range(len(names))
+    w = 0.38
+    # 两项贡献（对数拆解）相加 = 份额变化
+    ax.bar([i - w / 2 for i in x], [r.get("vel_contrib_pp") or 0 for r in rows], w, label="卖力贡献 pp", color="#2980b9")
+    ax.bar([i + w / 2 for i in x], [r.get("dist_contrib_pp") or 0 for r in rows], w, label="铺货贡献 pp", color="#f39c12")
+    ax.plot(list(x), [r.get("share_pp") or 0 for r in rows], "k_", ms=14, mew=2, label="份额 pp")
+    ax.axhline(0, color="#555", lw=0.8)
+    ax.set_xticks(list(x))
+    ax.set_xticklabels(names, rotation=30, ha="right", fontsize=8)
+    ax.legend(fontsize=7)
+    ax.set_title(f"份额拆解：卖力 vs 铺货（{data['label']}）")
+
+
+DRAWERS = {"trend": _draw_trend, "top_moves": _draw_top_moves, "decompose": _draw_decompose}
+
+
+def chart_key(kind: str, data) -> str:
+    return hashlib.sha256(canonical_json([kind, data, find_zh_font(), CHART_VERSION]).encode("utf-8")).hexdigest()
+
+
+def render_chart(kind: str, data, out_path: str) -> str:
+    plt = _setup_matplotlib()
+    fig, ax = plt.subplots(figsize=FIGSIZE)
+    try:
+        DRAWERS[kind](ax, data)
+        fig.tight_layout()
+        tmp = f"{out_path}.{os.getpid()}.tmp.png"
+        fig.savefig(tmp, dpi=150)
+        os.replace(tmp, out_path)  # 原子写：并行渲染同一张图也不会读到半个文件
+    finally:
+        plt.close(fig)
+    return out_path
+
+
+def chart_specs(payload: dict) -> dict:
+    """
+    payload -> {分析层 key: [(kind, data), ...]}；只取画图需要的字段，作为缓存 key 的输入
+    """
+    specs = {}
+    trend = [r for r in payload.get("monthly_trend") or [] if r.get("month")][-TREND_MONTHS:]
+    if trend:
+        specs["overview"] = [("trend", trend)]
+
+    for key, dim, label in (("province", "province", "省份"), ("channel", "channel", "渠道")):
+        d = payload.get(f"{key}_drilldown") or {}
+        items = []
+        moves = list(d.get("top_up") or []) + list(reversed(d.get("top_down") or []))
+        seen, rows = set(), []
+        for r in moves:
+            if r.get(dim) not in seen:
+                seen.add(r.get(dim))
+                rows.append({dim: r.get(dim), "share_pp": r.get("share_pp")})
+        if rows:
+            items.append(("top_moves", {"dim": dim, "label": label, "rows": rows}))
+        table = [
+            {c: r.get(c) for c in (dim, "share_pp", "vel_contrib_pp", "dist_contrib_pp")}
+            for r in (d.get("table") or [])[:TOP_N]
+        ]
+        if table:
+            items.append(("decompose", {"dim": dim, "label": label, "rows": table}))
+        if items:
+            specs[key] = items
+    return specs
+
+
+def render_charts(
+    payloads: list[dict],
+    cache_dir: str = CHART_CACHE_DIR,
+    workers: int = 1,
+    max_entries: int | None = CHART_CACHE_MAX_ENTRIES,
+    max_bytes: int | None = CHART_CACHE_MAX_BYTES,
+) -> list[dict]:
+    """
+    批量出图：先查缓存（命中刷新 mtime），未命中的图去重后用进程池并行渲染，最后按 LRU 淘汰超限的缓存
+    （本批用到的图不淘汰）；返回与 payloads 对应的 [{分析层 key: [png 路径, ...]}]
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    results, todo = [], {}
+    for payload in payloads:
+        out = {}
+        for section, items in chart_specs(payload).items():
+            paths = []
+            for kind, data in items:
+                path = os.path.join(cache_dir, f"{chart_key(kind, data)}.png")
+                if path not in todo:
+                    try:
+                        os.utime(path)  # 命中：最近使用
+                    except OSError:
+                        todo[path] = (kind, data)
+                paths.append(path)
+            out[section] = paths
+        results.append(out)
+
+    if todo and workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(min(workers, len(todo))) as pool:
+            list(pool.map(render_chart, *zip(*[(k, d, p) for p, (k, d) in todo.items()])))
+    else:
+        for path, (kind, data) in todo.items():
+            render_chart(kind, data, path)
+
+    used = {p for out in results for paths in out.values() for p in paths}
+    entries = [e for e in list_entries(cache_dir, ".png") if not e[0].endswith(".tmp.png")]  # 别的进程正在写的不算
+    for path, _, _ in lru_overflow(entries, max_entries, max_bytes, keep=used):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return results
+
+
+def attach_charts(sections: list, charts: dict) -> list:
+    """
+    把图挂到对应分析层的 section 上：(标题, 正文) -> (标题, 正文, [png, ...])
+    标题对不上的图（如整篇单次生成时）放到末尾的“图表”一节
+    """
+    titles = {title: key for key, title, _ in SECTION_PROMPTS}
+    used, out = set(), []
+    for sec in sections:
+        key = titles.get(sec[0])
+        images = charts.get(key, []) if key else []
+        if key:
+            used.add(key)
+        out.append((sec[0], sec[1], list(sec[2]) + images if len(sec) > 2 else images))
+    rest = [p for k, paths in charts.items() if k not in used for p in paths]
+    if rest:
+        out.append(("图表", "", rest))
+    return out
@@ -0,0 +1,166 @@
+# compact.py
+"""
+LLM 提示词的 payload 压缩：build_insight -> PayloadCompactor -> generate_text / llm_async
+
+依次执行（last_report 记录前后 token 估算）：
+  1. 月度趋势摘要：只保留最近 trend_months 个月 + 每个财年的汇总（yearly_trend）；下钻表截到 max_table_rows 行
+  2. 数值按有效数字取整（默认 4 位），NaN/inf -> None
+  3. 删掉 None / 空列表 / 空 dict 字段
+  4. 记录表改为列式：{"cols": [...], "rows": [[...], ...]}
+超出 token_budget 时再逐级收紧：下钻表行数 -> 趋势月数 -> 有效数字。
+"""
+import json
+import math
+
+
+def estimate_tokens(obj) -> int:
+    """
+    粗估 token 数：中日韩字符约 1 token/字，其余约 4 字符/token
+    """
+    text = obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False)
+    cjk = sum(1 for ch in text if "　" <= ch <= "鿿" or "＀" <= ch <= "￯")
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def round_sig(x: float, sig: int = 4):
+    if x is None or isinstance(x, bool):
+        return x
+    if not math.isfinite(x):
+        return None
+    if x == 0:
+        return 0
+    digits = sig - 1 - int(math.floor(math.log10(abs(x))))
+    v = round(x, digits)
+    return int(v) if digits <= 0 else v
+
+
+def round_numbers(obj, sig: int = 4):
+    if isinstance(obj, float):
+        return round_sig(obj, sig)
+    if isinstance(obj, dict):
+        return {k: round_numbers(v, sig) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [round_numbers(v, sig) for v in obj]
+    return obj
+
+
+def drop_empty(obj):
+    if isinstance(obj, dict):
+        out = {k: drop_empty(v) for k, v in obj.items()}
+        return {k: v for k, v in out.items() if v is not None and v != [] and v != {}}
+    if isinstance(obj, list):
+        return [drop_empty(v) for v in obj]
+    return obj
+
+
+def summarize_trend(monthly: list[dict], keep_months: int = 13) -> tuple[list, list]:
+    """
+    monthly_trend -> (最近 keep_months 个月, 每个财年汇总：销额合计 / 份额 / 月数)
+    财年份额 = 品牌销额合计 / 品类销额合计（不是月度份额的平均）；品类销额只用来算份额，不留在输出里
+    """
+    if not monthly:
+        return [], []
+    # 延迟导入：只渲染 PDF 的子命令不需要 pandas
+    import pandas as pd
+
+    from fiscal import fiscal_fields
+
+    m = pd.DataFrame(monthly).sort_values("month")
+    m["fy"] = fiscal_fields(pd.to_datetime(m["month"], errors="coerce"))["fy"]
+    agg = {"months": ("month", "size")}
+    if "sales_value" in m.columns:
+        agg["sales_value"] = ("sales_value", "sum")
+    share = {"sales_value", "category_sales_value"} <= set(m.columns)
+    if share:
+        # 销额缺失的月份品类销额也不计，分子分母口径一致
+        m["category_sales_value"] = m["category_sales_value"].where(m["sales_value"].notna())
+        agg["category_sales_value"] = ("category_sales_value", "sum")
+    yearly = m.dropna(subset=["fy"]).groupby("fy", as_index=False).agg(**agg)
+    yearly["fy"] = yearly["fy"].astype(int)
+    if share:
+        cat = yearly.pop("category_sales_value")
+        yearly["share_value_pct"] = (yearly["sales_value"] / cat.where(cat > 0) * 100.0).astype(object)
+        yearly["share_value_pct"] = yearly["share_value_pct"].where(yearly["share_value_pct"].notna(), None)
+    recent = m.drop(columns=["fy", "category_sales_value"], errors="ignore").tail(keep_months)
+    return recent.to_dict(orient="records"), yearly.to_dict(orient="records")
+
+
+def to_columnar(records: list[dict]) -> dict | list:
+    """
+    [{a:1,b:2},{a:3,b:4}] -> {"cols": ["a","b"], "rows": [[1,2],[3,4]]}；字段名只出现一次
+    """
+    if not records or not all(isinstance(r, dict) for r in records):
+        return records
+    cols = list(dict.fromkeys(k for r in records for k in r))
+    return {"cols": cols, "rows": [[r.get(c) for c in cols] for r in records]}
+
+
+def _columnarize(obj):
+    if isinstance(obj, dict):
+        return {k: _columnarize(v) for k, v in obj.items()}
+    if isinstance(obj, list) and obj and all(isinstance(r, dict) for r in obj):
+        return to_columnar(obj)
+    return obj
+
+
+class PayloadCompactor:
+    """
+    可插拔的 payload 压缩步骤；调用后 last_report 记录每一步的 token 估算
+      token_budget：目标 token 上限（None 表示只做基础压缩，不逐级收紧）
+    """
+
+    def __init__(
+        self,
+        token_budget: int | None = 6000,
+        sig_digits: int = 4,
+        trend_months: int = 13,
+        max_table_rows: int = 15,
+        columnar: bool = True,
+    ):
+        self.token_budget = token_budget
+        self.sig_digits = sig_digits
+        self.trend_months = trend_months
+        self.max_table_rows = max_table_rows
+        self.columnar = columnar
+        self.last_report: dict = {}
+
+    def _compact(self, payload: dict, sig: int, months: int, rows: int) -> dict:
+        p = dict(payload)
+        if "monthly_trend" in p:
+            p["monthly_trend"], p["yearly_trend"] = summarize_trend(p["monthly_trend"], months)
+        for key in ("province_drilldown", "channel_drilldown"):
+            d = p.get(key)
+            if isinstance(d, dict) and isinstance(d.get("table"), list):
+                p[key] = {**d, "table": d["table"][:rows]}
+        p = drop_empty(round_numbers(p, sig))
+        return _columnarize(p) if self.columnar else p
+
+    def __call__(self, payload: dict) -> dict:
+        before = estimate_tokens(payload)
+        sig, months, rows = self.sig_digits, self.trend_months, self.max_table_rows
+        out = self._compact(payload, sig, months, rows)
+        steps = [{"sig": sig, "months": months, "rows": rows, "tokens": estimate_tokens(out)}]
+
+        # 超预算：按信息损失从小到大逐级收紧
+        while self.token_budget is not None and steps[-1]["tokens"] > self.token_budget:
+            if rows > 5:
+                rows = max(5, rows // 2)
+            elif months > 6:
+                months = 6
+            elif sig > 3:
+                sig = 3
+            else:
+                break
+            out = self._compact(payload, sig, months, rows)
+            steps.append({"sig": sig, "months": months, "rows": rows, "tokens": estimate_tokens(out)})
+
+        after = steps[-1]["tokens"]
+        self.last_report = {
+            "tokens_before": before,
+            "tokens_after": after,
+            "saved_pct": round((1 - after / before) * 100, 1) if before else 0.0,
+            "token_budget": self.token_budget,
+            "within_budget": self.token_budget is None or after <= self.token_budget,
+            "steps": steps,
+        }
+        return out
@@ -0,0 +1,293 @@
+# engine.py
+"""
+可替换的分析引擎：明细 -> 立方体、上卷（agg_period / rollup）、份额拆解序列（decompose_share_change 用）
+
+  pandas（默认）  analysis.py 里的实现，明细整体读进内存
+  duckdb          内嵌 DuckDB（本进程内，无服务）：SQL 直接扫 Parquet 列式存储 / CSV，
+                  多线程执行，超出内存上限时溢写到临时目录
+
+REPORT_ENGINE=duckdb 切换（run_report.py / report_farm.py 也可用 --engine）；DuckDB 另有：
+  REPORT_DUCKDB_THREADS   线程数（默认 CPU 核数）
+  REPORT_DUCKDB_MEMORY    内存上限，如 4GB（默认物理内存的 80%）
+  REPORT_DUCKDB_TEMP      溢写目录
+
+两个引擎输出同样的列和类型（立方体统一过 analysis.conform_cube），派生指标共用 analysis 里的公式，
+差别只在浮点求和顺序；一致性用 scripts/check_engine_parity.py 在合成数据上核对 payload
+"""
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis import (
+    CUBE_DIMS,
+    CUBE_SUMS,
+    CUBE_VALUES,
+    DECOMPOSE_COLUMNS,
+    DIM_COLUMNS,
+    DIST_WEIGHTS,
+    MEASURE_COLUMNS,
+    PERIOD_COLUMNS,
+    SERIES_PERIODS,
+    _period_numbers,
+    agg_period,
+    build_brand_category,
+    build_cube,
+    conform_cube,
+    decomposition_frame,
+    finish_period,
+    load_dataset,
+    month_key,
+    rollup,
+    share_decomposition_series,
+)
+from fiscal import fiscal_fields
+from profiling import traced
+
+DEFAULT_ENGINE = "pandas"
+
+
+class PandasEngine:
+    name = "pandas"
+
+    def _frame(self, source, fy=None) -> pd.DataFrame:
+        return source if isinstance(source, pd.DataFrame) else load_dataset(source, fy=fy)
+
+    def build_cube(self, source, fy: list[int] | None = None, months: list[str] | None = None) -> pd.DataFrame:
+        """
+        source：清洗后数据的路径（列式存储目录 / .csv）或已读入的明细 DataFrame
+        fy / months：只取这些财年分区里这些月份的行（增量刷新用）
+        """
+        df = self._frame(source, fy)
+        if months is not None:
+            df = df[month_key(df["date"]).isin(months).to_numpy()]
+        return build_cube(df)
+
+    def agg_period(self, source, keys: list[str], period_key: str) -> pd.DataFrame:
+        df = self._frame(source)
+        if "category_sales_value" not in df.columns:
+            df = build_brand_category(df)
+        return agg_period(df, keys, period_key)
+
+    def rollup(self, cube: pd.DataFrame, keys: list[str], period_key: str, where: np.ndarray | None = None) -> pd.DataFrame:
+        return rollup(cube, keys, period_key, where)
+
+    def share_series(self, df_agg: pd.DataFrame, dim: str, period: str = "fp") -> pd.DataFrame:
+        return share_decomposition_series(df_agg, dim, period)
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class DuckDBEngine:
+    """
+    每个进程一个内存库连接（report_farm 的工作进程各自建）；查询用 cursor，线程间互不干扰
+    """
+    name = "duckdb"
+
+    def __init__(self, threads: int | None = None, memory_limit: str | None = None, temp_dir: str | None = None):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise RuntimeError("duckdb 引擎需要 duckdb：pip install duckdb") from e
+        config = {}
+        threads = threads or os.getenv("REPORT_DUCKDB_THREADS")
+        if threads:
+            config["threads"] = int(threads)
+        memory_limit = memory_limit or os.getenv("REPORT_DUCKDB_MEMORY")
+        if memory_limit:
+            config["memory_limit"] = memory_limit
+        temp_dir = temp_dir or os.getenv("REPORT_DUCKDB_TEMP")
+        if temp_dir:
+            config["temp_directory"] = temp_dir
+        self.con = duckdb.connect(":memory:", config=config)
+
+    def _cursor(self):
+        cur = self.con.cursor()
+        cur.execute("SET enable_progress_bar = false")  # 连接级设置：长查询不往终端打进度条
+        return cur
+
+    # ---------- 数据源 ----------
+
+    def _source(self, cur, source, fy: list[int] | None = None) -> tuple[str, list[str]]:
+        """
+        返回 (FROM 子句, 列名)；DataFrame 注册成视图（零拷贝扫描），路径直接交给 read_parquet / read_csv
+        """
+        if isinstance(source, pd.DataFrame):
+            cur.register("_detail", source)
+            rel = "_detail"
+        elif str(source).endswith(".csv"):
+            with open(source, "r", encoding="utf-8", newline="") as f:
+                header = next(csv.reader(f), [])
+            # 与 load_dataset 同样的列类型：维度按字符串读，度量 float32
+            types = {c: "VARCHAR" for c in DIM_COLUMNS if c in header}
+            types.update({c: "FLOAT" for c in MEASURE_COLUMNS if c in header})
+            spec = ", ".join(f"{_literal(c)}: {_literal(t)}" for c, t in types.items())
+            rel = f"read_csv({_literal(source)}, header = true, types = {{{spec}}})"
+        else:
+            path = source if str(source).endswith(".parquet") else os.path.join(source, "**", "*.parquet")
+            # 按 fy 分区的目录：fy 作为分区列读出，谓词只读命中的分区
+            rel = f"read_parquet({_literal(path)}, hive_partitioning = true)"
+        columns = [r[0] for r in cur.execute(f"DESCRIBE SELECT * FROM {rel}").fetchall()]
+        if fy is not None and "fy" in columns:
+            rel = f"(SELECT * FROM {rel} WHERE fy IN ({', '.join(str(int(y)) for y in fy)}))"
+        return rel, columns
+
+    def _aggregate_detail(self, source, keys: list[str], fy: list[int] | None = None,
+                          months: list[str] | None = None) -> pd.DataFrame:
+        """
+        明细按 keys + 自然月分组：可加总量求和，铺货率输出加权分量 wsum / w（精度同 analysis.build_cube：float64 累加）
+        category_sales_value 按 float32 计算后再累加，与 build_brand_category 的逐行结果一致
+        SQL 里只按整数月份编号分组，fy/fq/month/fp 在结果上用 fiscal.fiscal_fields 推出（口径只有一份）；
+        结果经 Arrow 取回，维度列字典编码后直接成为 category
+        """
+        ym = 'year(CAST("date" AS DATE)) * 12 + month(CAST("date" AS DATE)) - 1'
+        cur = self._cursor()
+        try:
+            rel, columns = self._source(cur, source, fy)
+            select = [_ident(k) if k in columns else f"'' AS {_ident(k)}" for k in keys] + [f"{ym} AS _ym"]
+            measures = {c: f"CAST({_ident(c)} AS DOUBLE)" for c in ["sales_value", "sales_volume"]}
+            # 份额为 0 / 负数 / 非有限值的行记为缺失（同 build_brand_category）
+            measures["category_sales_value"] = (
+                "CASE WHEN isfinite(CAST(share_value_pct AS DOUBLE)) AND CAST(share_value_pct AS DOUBLE) > 0 THEN "
+                "CAST(CAST(sales_value AS FLOAT) / CAST(CAST(share_value_pct AS DOUBLE) / 100.0 AS FLOAT) AS DOUBLE) END"
+            )
+            aggs = [f"COALESCE(SUM({measures[c]}), 0) AS {c}" for c in CUBE_SUMS]
+            # 铺货率与权重都有值的行才计入（同 analysis.dist_parts）
+            for c, weight in DIST_WEIGHTS.items():
+                v, w = f"CAST({_ident(c)} AS DOUBLE)", measures[weight]
+                ok = f"{_ident(c)} IS NOT NULL AND ({w}) IS NOT NULL"
+                aggs.append(f"COALESCE(SUM(CASE WHEN {ok} THEN {v} * ({w}) END), 0) AS {c}_wsum")
+                aggs.append(f"COALESCE(SUM(CASE WHEN {ok} THEN {w} END), 0) AS {c}_w")
+            where = ""
+            if months is not None:
+                # 月份键 "" = 日期缺失的行（清单里 fy=0 分区的月份），对应 _ym 为 NULL
+                to_number = SERIES_PERIODS["month"][1]
+                numbers = [str(to_number(m)) for m in months if m]
+                conds = ([f"{ym} IN ({', '.join(numbers)})"] if numbers else []) + ([f"{ym} IS NULL"] if "" in months else [])
+                where = f"WHERE {' OR '.join(conds)}" if conds else "WHERE false"
+            group = ", ".join(str(i + 1) for i in range(len(select)))
+            res = cur.execute(f"SELECT {', '.join(select + aggs)} FROM {rel} {where} GROUP BY {group}").arrow()
+            table = res.read_all() if hasattr(res, "read_all") else res  # 新版返回 RecordBatchReader
+        finally:
+            cur.close()
+
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        table = pa.table({
+            c: pc.dictionary_encode(table[c]) if c in keys else table[c] for c in table.column_names
+        })
+        g = table.to_pandas()
+        ym = g.pop("_ym").to_numpy(np.float64)  # 日期缺失 -> NaN
+        valid = ~np.isnan(ym)
+        dates = (np.where(valid, ym, 0).astype(np.int64) - 1970 * 12).astype("datetime64[M]").astype("datetime64[ns]")
+        dates[~valid] = np.datetime64("NaT")
+        fields = fiscal_fields(pd.Series(dates, index=g.index))
+        return pd.concat([g[keys], fields[["month", "fy", "fq", "fp"]], g.drop(columns=keys)], axis=1)
+
+    # ---------- 引擎接口 ----------
+
+    @traced("duckdb.build_cube")
+    def build_cube(self, source, fy: list[int] | None = None, months: list[str] | None = None) -> pd.DataFrame:
+        return conform_cube(self._aggregate_detail(source, CUBE_DIMS, fy, months))
+
+    @traced("duckdb.agg_period")
+    def agg_period(self, source, keys: list[str], period_key: str) -> pd.DataFrame:
+        """
+        明细 -> keys x 月 由 SQL 聚合，再上卷到 period_key（铺货率 = wsum / w，与直接对明细加权一致）
+        """
+        return self.rollup(conform_cube(self._aggregate_detail(source, keys)), keys, period_key)
+
+    @traced("duckdb.rollup")
+    def rollup(self, cube: pd.DataFrame, keys: list[str], period_key: str, where: np.ndarray | None = None) -> pd.DataFrame:
+        """
+        同 analysis.rollup；立方体已在内存里，注册成视图由 DuckDB 分组（fsum 补偿求和，同 pandas 的 sum）
+        """
+        period_cols = PERIOD_COLUMNS.get(period_key, [period_key])
+        cols = keys + period_cols
+        view = cube.loc[where, cols + CUBE_VALUES] if where is not None else cube[cols + CUBE_VALUES]
+        aggs = [f"fsum({_ident(c)}) AS {_ident(c)}" for c in CUBE_VALUES]
+        cur = self._cursor()
+        try:
+            cur.register("_cube", view)
+            group = ", ".join(map(_ident, cols))
+            order = ", ".join(f"{_ident(c)} NULLS LAST" for c in cols)
+            g = cur.execute(f"SELECT {group}, {', '.join(aggs)} FROM _cube GROUP BY {group} ORDER BY {order}").df()
+        finally:
+            cur.close()
+        return finish_period(conform_cube(g))
+
+    @traced("duckdb.share_series")
+    def share_series(self, df_agg: pd.DataFrame, dim: str, period: str = "fp") -> pd.DataFrame:
+        """
+        同 analysis.share_decomposition_series：周期编号平移同比间隔后与自身全外连接得到“去年同期”，
+        拆解公式用 analysis.decomposition_frame
+        """
+        lag, to_number, _ = SERIES_PERIODS[period]
+        measures = ["sales_value", "category_sales_value", "share_value_pct", "wdist_pct", "price"]
+        has_period = df_agg[period].notna().to_numpy()
+        d = df_agg.loc[has_period, ["brand", dim] + measures]
+        d["_t"] = _period_numbers(df_agg.loc[has_period, period], to_number)
+        columns = ["brand", dim] + (["fy"] if period == "fp" else []) + [period] + DECOMPOSE_COLUMNS
+        if not len(d):
+            return pd.DataFrame(columns=columns)
+
+        k = _ident(dim)
+        sql = f"""
+            WITH cur AS (
+                SELECT CAST(brand AS VARCHAR) AS b, CAST({k} AS VARCHAR) AS k, _t,
+                       sales_value, category_sales_value, share_value_pct, wdist_pct, price
+                FROM _agg
+            ), prev AS (
+                SELECT b, k, _t + {int(lag)} AS _t,
+                       sales_value AS sales0, category_sales_value AS cat0, share_value_pct AS share0, wdist_pct AS wdist0
+                FROM cur
+            )
+            SELECT COALESCE(cur.b, prev.b) AS b, COALESCE(cur.k, prev.k) AS k, COALESCE(cur._t, prev._t) AS t,
+                   sales_value, category_sales_value, share_value_pct, wdist_pct, price, sales0, cat0, share0, wdist0
+            FROM cur FULL OUTER JOIN prev
+              ON cur.b IS NOT DISTINCT FROM prev.b AND cur.k IS NOT DISTINCT FROM prev.k AND cur._t = prev._t
+            WHERE COALESCE(cur._t, prev._t) <= (SELECT max(_t) FROM cur)
+            ORDER BY b NULLS LAST, k NULLS LAST, t
+        """
+        cur = self._cursor()
+        try:
+            cur.register("_agg", d)
+            r = cur.execute(sql).df()
+        finally:
+            cur.close()
+        return decomposition_frame(
+            r["b"].to_numpy(dtype=object, na_value=np.nan),
+            r["k"].to_numpy(dtype=object, na_value=np.nan),
+            r["t"].to_numpy(np.int64),
+            r[measures].to_numpy(np.float64).T,
+            r[["sales0", "cat0", "share0", "wdist0"]].to_numpy(np.float64).T,
+            dim, period,
+        )
+
+
+ENGINES = {"pandas": PandasEngine, "duckdb": DuckDBEngine}
+_instances: dict = {}
+
+
+def get_engine(engine=None):
+    """
+    engine：引擎实例 / 名称 / None（读 REPORT_ENGINE，默认 pandas）；同一进程内按名称复用
+    """
+    if engine is not None and not isinstance(engine, str):
+        return engine
+    name = (engine or os.getenv("REPORT_ENGINE") or DEFAULT_ENGINE).lower()
+    if name not in ENGINES:
+        raise ValueError(f"未知的分析引擎：{name}（可选 {', '.join(ENGINES)}）")
+    # fork 出来的子进程不能沿用父进程的 DuckDB 连接：按进程缓存
+    key = (name, os.getpid())
+    if key not in _instances:
+        _instances[key] = ENGINES[name]()
+    return _instances[key]
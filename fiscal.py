@@ -0,0 +1,103 @@
+# fiscal.py
+"""
+向量化财年日历：在 datetime64 列上直接做月份偏移运算，避免逐行 apply。
+
+默认口径：
+  - FY 从 12月 到 次年11月，用“财年结束年”命名：Dec 2024 -> FY2025
+  - Q1=12-2, Q2=3-5, Q3=6-8, Q4=9-11
+财年起始月是全局唯一的设置 FY_START_MONTH（fiscal_calendar.py，环境变量 REPORT_FY_START_MONTH，1 表示自然年），
+入库分区、分析、引擎、窗口和 llm.py 提示词里的口径说明都读它，不要在调用处各传各的；
+改了以后列式库要重新全量入库（fy 分区是入库时算的）。
+"""
+import numpy as np
+import pandas as pd
+
+# 起始月设置在不依赖 pandas 的 fiscal_calendar.py 里（llm.py 的提示词也要读它）
+from fiscal_calendar import FY_START_MONTH, QUARTERS, _check_start_month  # noqa: F401
+
+FY_DTYPE = "Int16"  # 可空小整数：财年取值 4 位数，没必要 8 字节
+
+
+def _fy_offset(year, month, start_month: int):
+    # 财年 = 结束年；起始月为 1 时即自然年
+    fy = year + (month >= start_month) if start_month != 1 else year
+    offset = (month - start_month) % 12  # 财年内第几个月（0-11）
+    return fy, offset
+
+
+def fiscal_year(date: pd.Timestamp, start_month: int = FY_START_MONTH):
+    if pd.isna(date):
+        return np.nan
+    fy, _ = _fy_offset(date.year, date.month, _check_start_month(start_month))
+    return int(fy)
+
+
+def fiscal_quarter(date: pd.Timestamp, start_month: int = FY_START_MONTH) -> str:
+    if pd.isna(date):
+        return ""
+    _, offset = _fy_offset(date.year, date.month, _check_start_month(start_month))
+    return QUARTERS[offset // 3]
+
+
+def period_key(fy, fq) -> str:
+    """财季排序键，如 FY2026Q1（字符串排序 == 时间排序）"""
+    return f"FY{int(fy)}{fq}"
+
+
+def split_period(fp: str) -> tuple[int, str]:
+    """FY2026Q1 -> (2026, "Q1")"""
+    return int(fp[2:-2]), fp[-2:]
+
+
+def shift_period(fp: str, quarters: int) -> str:
+    """FY2026Q1 -> 平移 quarters 个财季；-4 即去年同期"""
+    fy, fq = split_period(fp)
+    n = fy * 4 + QUARTERS.index(fq) + quarters
+    return period_key(n // 4, QUARTERS[n % 4])
+
+
+def _categorical_from_ints(values: np.ndarray, valid: np.ndarray, fmt) -> pd.Categorical:
+    # 取值范围很小（月/季编号），用 bincount 建查找表代替排序去重；只对去重后的取值做字符串格式化
+    codes = np.full(len(values), -1, dtype=np.int64)
+    cats = []
+    if valid.any():
+        v = values[valid]
+        lo = v.min()
+        present = np.bincount(v - lo) > 0
+        lookup = np.cumsum(present) - 1
+        codes[valid] = lookup[v - lo]
+        cats = [fmt(int(u) + int(lo)) for u in np.flatnonzero(present)]
+    return pd.Categorical.from_codes(codes, categories=cats, ordered=True)
+
+
+def fiscal_fields(dates, start_month: int = FY_START_MONTH) -> pd.DataFrame:
+    """
+    输入：日期列（任意可被 to_datetime 解析的序列）
+    输出（与输入同 index）：
+      fy     财年（Int16，可空）
+      fq     财季（有序分类 Q1-Q4）
+      month  自然月 YYYY-MM（有序分类）
+      fp     财季键 FY2026Q1（有序分类，可直接排序/取 max）
+    """
+    start_month = _check_start_month(start_month)
+    s = pd.Series(dates)
+    if not pd.api.types.is_datetime64_any_dtype(s):
+        s = pd.to_datetime(s, errors="coerce")
+
+    valid = s.notna().to_numpy()
+    # datetime64[M] 的整数值 = (year - 1970) * 12 + (month - 1)
+    ym = s.to_numpy(dtype="datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+    year = ym // 12 + 1970
+    month = ym % 12 + 1
+
+    fy, offset = _fy_offset(year, month, start_month)
+    q = offset // 3
+
+    fy_arr = pd.array(np.where(valid, fy, 0), dtype=FY_DTYPE)
+    fy_arr[~valid] = pd.NA
+
+    fq = pd.Categorical.from_codes(np.where(valid, q, -1), categories=QUARTERS, ordered=True)
+    month_cat = _categorical_from_ints(ym, valid, lambda v: f"{v // 12 + 1970:04d}-{v % 12 + 1:02d}")
+    fp = _categorical_from_ints(fy * 4 + q, valid, lambda v: period_key(v // 4, QUARTERS[v % 4]))
+
+    return pd.DataFrame({"fy": fy_arr, "fq": fq, "month": month_cat, "fp": fp}, index=s.index)
@@ -0,0 +1,30 @@
+# fiscal_calendar.py
+"""
+财年口径设置：起始月 FY_START_MONTH 和给提示词用的口径说明。
+不依赖 pandas / numpy：llm.py 在模块级用它拼提示词，渲染 / 生成子命令的冷启动不能因此加载 pandas
+（scripts/bench_startup.py 会核对）。向量化计算见 fiscal.py。
+"""
+import os
+
+QUARTERS = ["Q1", "Q2", "Q3", "Q4"]
+
+
+def _check_start_month(start_month: int) -> int:
+    start_month = int(start_month)
+    if not 1 <= start_month <= 12:
+        raise ValueError(f"财年起始月必须在 1-12 之间：{start_month}")
+    return start_month
+
+
+FY_START_MONTH = _check_start_month(os.getenv("REPORT_FY_START_MONTH") or 12)
+
+
+def fiscal_calendar_text() -> str:
+    """口径说明（给提示词用），如：FY 从 12月 到 次年11月 / Q1=12-2, ..."""
+    months = [(FY_START_MONTH - 1 + i) % 12 + 1 for i in range(12)]
+    quarters = ", ".join(f"{q}={months[3 * i]}-{months[3 * i + 2]}" for i, q in enumerate(QUARTERS))
+    if FY_START_MONTH == 1:
+        span = "FY 即自然年（1月 到 12月）"
+    else:
+        span = f"FY 从 {months[0]}月 到 次年{months[-1]}月（按结束年命名）"
+    return f"- {span}\n- {quarters}"
@@ -1,66 +1,143 @@
 # llm.py
 import os
 import json
-from openai import OpenAI
+import time
+
+from fiscal_calendar import fiscal_calendar_text
+from llm_cache import LLMCache, cache_key
+from profiling import event
+
+TEMPERATURE = 0.5
+# 模型：LLM_MODEL 环境变量，默认 deepseek-chat；generate_text / SectionGenerator 的 model 参数可再覆盖
+DEFAULT_MODEL = os.getenv("LLM_MODEL") or "deepseek-chat"
+
+def _client_kwargs() -> dict:
+    # 你可以用 OPENAI_API_KEY 或 DEEPSEEK_API_KEY（密钥只从环境变量读，不要写进代码）
+    # 如果你用 deepseek：设置 DEEPSEEK_API_KEY，默认 BASE_URL 就是 https://api.deepseek.com
+    api_key = os.getenv("OPENAI_API_KEY") or os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        raise RuntimeError("没有 LLM 密钥：请设置 OPENAI_API_KEY 或 DEEPSEEK_API_KEY（本地 mock 服务随便填一个即可）")
+
+    # LLM_BASE_URL 可指向本地 mock 服务（scripts/mock_llm_server.py）做离线测试
+    base_url = os.getenv("LLM_BASE_URL") or "https://api.deepseek.com"
+    return {"api_key": api_key, "base_url": base_url}
 
 def get_client():
-    # 你可以用 OPENAI_API_KEY 或 DEEPSEEK_API_KEY
-    # 如果你用 deepseek：设置 DEEPSEEK_API_KEY，并把 BASE_URL 改成 https://api.deepseek.com
-    api_key = "sk-bfb199cd27974a9180c3282dc9abce55"
-    #api_key = os.getenv("OPENAI_API_KEY") or os.getenv("DEEPSEEK_API_KEY")
-    
-    base_url = "https://api.deepseek.com"
-    #base_url = os.getenv("LLM_BASE_URL")  # 为空则走 OpenAI 默认
-    if base_url:
-        return OpenAI(api_key=api_key, base_url=base_url)
-    return OpenAI(api_key=api_key)
-
-client = get_client()
-
-def generate_text(payload: dict, model: str | None = None) -> str:
-    model = "deepseek-chat" #model or os.getenv("deepseek-chat", "gpt-4o-mini")
+    from openai import OpenAI  # 延迟导入：缓存命中时不需要加载 SDK / 建连接
+    return OpenAI(**_client_kwargs())
 
-    data = json.dumps(payload, ensure_ascii=False)
+def get_async_client(**overrides):
+    from openai import AsyncOpenAI
+    # 重试由 llm_async 自己做（区分限流 / 额度不足），SDK 内置重试关掉
+    return AsyncOpenAI(**{**_client_kwargs(), "max_retries": 0, **overrides})
 
-    prompt = f"""
+_client = None
+_cache = None
+
+def get_cache() -> LLMCache:
+    global _cache
+    if _cache is None:
+        _cache = LLMCache(os.getenv("LLM_CACHE_DIR", "outputs/llm_cache"))
+    return _cache
+
+PROMPT_HEADER = f"""
 你是一名快消行业（食品饮料）商业分析负责人。你要基于给定数据，产出“每期定制化”的管理层报告：既有结论，也有可执行建议。
 注意：不要泛泛而谈，不要写教科书；要像真实业务负责人一样，明确指出哪里最好/最差、为什么、下一步做什么。
 
 【财年口径】
-- FY 从 12月 到 次年11月
-- Q1=12-2, Q2=3-5, Q3=6-8, Q4=9-11
+{fiscal_calendar_text()}
 - 数据按季度更新，但颗粒度是月度
 
 【指标优先级】
 销售额、销售量、单价（销额/销量）、加权铺货率、数值铺货率、单点卖力（销额/加权铺货率）
+"""
 
-【分析结构（必须按此输出，中文）】
-1）第一层：销额&份额及趋势
+# 报告的四个分析层：(key, PDF 标题, 提示词)；整篇生成与分层并发生成（llm_async.py）共用
+SECTION_PROMPTS = [
+    ("overview", "销额&份额及趋势", """1）第一层：销额&份额及趋势
 - 最新财季：该品牌销额、份额、份额同比pp
 - 解释份额变化属于哪种情况（品牌增速 vs 大盘增速四象限），并说清楚“这意味着什么”
 - 给出对月度销额/份额趋势的解读（不要说“见图”，要写趋势结论）
-
-2）第二层：分省份下钻
+- 如果数据里有 data_quality（重复/异常行、层级混用、环比突变），用一句话提示哪些结论要打折扣
+"""),
+    ("province", "分省份下钻", """2）第二层：分省份下钻
 - 最新财季：Top3 份额增长省份 / Top3 份额下跌省份（分别给原因）
 - 用“份额 ≈ 卖力份额 x 加权铺货率”的框架做归因：是卖力驱动还是铺货驱动？
 - 讨论单价对生意的可能影响（如果 price 为空，就说‘当前数据未提供销量/单价，无法判断单价影响’）
-
-3）第三层：分渠道下钻
+"""),
+    ("channel", "分渠道下钻", """3）第三层：分渠道下钻
 - 同省份逻辑：Top3 增长/下跌渠道 + 原因归因 + 单价影响判断
-
-4）总结层：建议（要具体）
+"""),
+    ("recommendations", "建议", """4）总结层：建议（要具体）
 - 给出 5-8 条建议，按优先级排序
 - 每条建议要包含：做什么 / 为什么 / 预期影响 / 风险点
 - 建议要尽量落到“哪些省份/渠道/动作”，而不是抽象口号
+"""),
+]
+
+# 初稿模式（narrative.draft_payload）：数据里只有规则模板写好的初稿和关键数字
+PROMPT_DRAFT = """
+【初稿】数据里的 draft 是按固定规则从完整数据生成的初稿，数字都已核对。
+请在初稿基础上改写成管理层报告的口吻，补充判断和解读；不要改动、也不要编造初稿以外的数字
+"""
 
+PROMPT_DATA = """
 下面是数据
 【数据（JSON）】
 {data}
 """
 
-    resp = client.chat.completions.create(
+PROMPT_TEMPLATE = (
+    PROMPT_HEADER
+    + "\n【分析结构（必须按此输出，中文）】\n"
+    + "\n".join(p for _, _, p in SECTION_PROMPTS)
+    + PROMPT_DATA
+)
+
+def generate_text(
+    payload: dict,
+    model: str | None = None,
+    use_cache: bool = True,
+    refresh: bool = False,
+    cache: LLMCache | None = None,
+) -> str:
+    """
+    use_cache=False：完全绕过缓存（不读不写）
+    refresh=True：不读缓存，强制调用 LLM 并覆盖缓存
+    """
+    global _client
+    model = model or DEFAULT_MODEL
+
+    cache = cache or get_cache()
+    key = cache_key(payload, PROMPT_TEMPLATE, model, TEMPERATURE)
+    if use_cache and not refresh:
+        text = cache.get(key)
+        if text is not None:
+            event("llm", brand=payload.get("brand"), section="single", cache_hit=True)
+            return text
+
+    data = json.dumps(payload, ensure_ascii=False)
+    prompt = PROMPT_TEMPLATE.replace("{data}", data)
+
+    if _client is None:
+        _client = get_client()
+    started = time.perf_counter()
+    resp = _client.chat.completions.create(
         model=model,
         messages=[{"role": "user", "content": prompt}],
-        temperature=0.5,
+        temperature=TEMPERATURE,
+    )
+    text = resp.choices[0].message.content
+    usage = getattr(resp, "usage", None)
+    event(
+        "llm",
+        brand=payload.get("brand"),
+        section="single",
+        cache_hit=False,
+        latency_s=round(time.perf_counter() - started, 3),
+        prompt_tokens=getattr(usage, "prompt_tokens", None),
+        completion_tokens=getattr(usage, "completion_tokens", None),
     )
-    return resp.choices[0].message.content
\ No newline at end of file
+    if use_cache:
+        cache.set(key, text, meta={"model": model, "brand": payload.get("brand")})
+    return text
\ No newline at end of file
@@ -0,0 +1,220 @@
+# llm_async.py
+"""
+分层并发生成：把报告拆成提示词里定义的四个分析层（销额&份额 / 省份 / 渠道 / 建议），
+每层一个请求，用 asyncio 并发发出，整体墙钟 ≈ 最慢的一层，而不是所有层相加。
+
+- 所有品牌、所有分层共用一个 Semaphore（concurrency），控制同时在途的请求数
+- 429 限流 / 超时 / 5xx 指数退避重试（优先用服务端 Retry-After，都不超过 backoff_max）；额度不足（insufficient_quota）不重试
+- 每个请求有 timeout；每层单独走 llm_cache（payload 子集 + 分层提示词做 key）
+- 输出按 SECTION_PROMPTS 顺序组装成 create_pdf 需要的 [(标题, 正文), ...]
+- narrative='rules' 不调用 LLM，直接用规则模板（narrative.py）；'draft' 把模板初稿发给 LLM 润色（提示词更短）
+- fallback=True：某一层重试用尽 / 超时 / 额度不足时，这一层回退到模板文本，报告照样能出（回退结果不写缓存）
+"""
+import asyncio
+import json
+import random
+import time
+
+from llm import DEFAULT_MODEL, PROMPT_DATA, PROMPT_DRAFT, PROMPT_HEADER, SECTION_PROMPTS, TEMPERATURE, get_async_client, get_cache
+from llm_cache import LLMCache, cache_key
+from narrative import draft_payload, section_text
+from profiling import event
+
+# 每层只带它需要的 payload 字段，缩短提示词；建议层需要全貌
+_BASE_KEYS = ["brand", "latest_fy", "latest_fq", "window", "metric_definition"]
+SECTION_PAYLOAD_KEYS = {
+    "overview": _BASE_KEYS + ["overview", "monthly_trend", "yearly_trend", "data_quality"],
+    "province": _BASE_KEYS + ["province_drilldown"],
+    "channel": _BASE_KEYS + ["channel_drilldown"],
+    "recommendations": None,
+}
+
+
+class LLMQuotaError(RuntimeError):
+    """额度不足 / 鉴权失败这类重试也无用的错误"""
+
+
+def section_payload(payload: dict, key: str) -> dict:
+    keys = SECTION_PAYLOAD_KEYS.get(key)
+    if keys is None:
+        return payload
+    return {k: payload[k] for k in keys if k in payload}
+
+
+def section_template(key: str, draft: bool = False) -> str:
+    prompt = dict((k, p) for k, _, p in SECTION_PROMPTS)[key]
+    return PROMPT_HEADER + "\n【本次只输出这一部分（中文）】\n" + prompt + (PROMPT_DRAFT if draft else "") + PROMPT_DATA
+
+
+def _retry_after(err) -> float | None:
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _classify(err) -> str:
+    """
+    'retry'：限流 / 超时 / 连接 / 5xx；'fatal'：额度不足、鉴权、4xx 参数错误
+    """
+    if isinstance(err, asyncio.TimeoutError):
+        return "retry"
+    status = getattr(err, "status_code", None)
+    code = getattr(err, "code", None)
+    if status == 429:
+        return "fatal" if code == "insufficient_quota" else "retry"
+    if status is not None:
+        return "retry" if status >= 500 else "fatal"
+    # 没有状态码：APIConnectionError / APITimeoutError 等网络层错误
+    return "retry" if type(err).__name__ in ("APIConnectionError", "APITimeoutError") else "fatal"
+
+
+class SectionGenerator:
+    """
+    共享 client / 并发上限 / 重试策略的分层生成器；一个实例可同时服务多个品牌
+    narrative: 'llm'（默认）/ 'rules'（只用规则模板）/ 'draft'（模板初稿 + LLM 润色）
+    """
+
+    NARRATIVES = ("llm", "rules", "draft")
+
+    def __init__(
+        self,
+        client=None,
+        model: str = DEFAULT_MODEL,
+        concurrency: int = 4,
+        timeout: float = 120.0,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        cache: LLMCache | None = None,
+        use_cache: bool = True,
+        refresh: bool = False,
+        narrative: str = "llm",
+        fallback: bool = True,
+    ):
+        if narrative not in self.NARRATIVES:
+            raise ValueError(f"narrative 只能是 {'/'.join(self.NARRATIVES)}：{narrative}")
+        self.client = client
+        self.model = model
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache = cache
+        self.use_cache = use_cache
+        self.refresh = refresh
+        self.narrative = narrative
+        self.fallback = fallback
+        self.stats = {"requests": 0, "retries": 0, "cache_hits": 0, "rules": 0, "fallbacks": 0}
+        self.fallback_brands = set()
+        self._sem = None
+
+    async def _complete(self, prompt: str, meta: dict | None = None) -> str:
+        if self.client is None:
+            self.client = get_async_client(timeout=self.timeout)
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            try:
+                async with self._sem:
+                    self.stats["requests"] += 1
+                    resp = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=self.model,
+                            messages=[{"role": "user", "content": prompt}],
+                            temperature=TEMPERATURE,
+                        ),
+                        timeout=self.timeout,
+                    )
+                usage = getattr(resp, "usage", None)
+                event(
+                    "llm",
+                    **(meta or {}),
+                    cache_hit=False,
+                    retries=attempt,
+                    latency_s=round(time.perf_counter() - started, 3),
+                    prompt_tokens=getattr(usage, "prompt_tokens", None),
+                    completion_tokens=getattr(usage, "completion_tokens", None),
+                )
+                return resp.choices[0].message.content
+            except Exception as e:
+                kind = _classify(e)
+                if kind == "fatal" and getattr(e, "code", None) == "insufficient_quota":
+                    raise LLMQuotaError(f"LLM 额度不足：{e}") from e
+                if kind == "fatal" or attempt >= self.max_retries:
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * (0.5 + random.random() / 2)
+                # 服务端的 Retry-After 也封顶：异常大的值不能把整批报告挂住
+                delay = min(delay, self.backoff_max)
+                attempt += 1
+                self.stats["retries"] += 1
+                # 退避期间不占用并发名额
+                await asyncio.sleep(delay)
+
+    async def section(self, payload: dict, key: str) -> str:
+        if self.narrative == "rules":
+            return self._rules(payload, key)
+        draft = self.narrative == "draft"
+        sub = draft_payload(payload, key) if draft else section_payload(payload, key)
+        template = section_template(key, draft)
+        cache = self.cache or get_cache()
+        ck = cache_key(sub, template, self.model, TEMPERATURE)
+        if self.use_cache and not self.refresh:
+            text = cache.get(ck)
+            if text is not None:
+                self.stats["cache_hits"] += 1
+                event("llm", brand=payload.get("brand"), section=key, cache_hit=True)
+                return text
+
+        prompt = template.replace("{data}", json.dumps(sub, ensure_ascii=False))
+        try:
+            text = await self._complete(prompt, meta={"brand": payload.get("brand"), "section": key})
+        except Exception as e:
+            if not self.fallback:
+                raise
+            return self._rules(payload, key, error=f"{type(e).__name__}: {e}")
+        if self.use_cache:
+            cache.set(ck, text, meta={"model": self.model, "brand": payload.get("brand"), "section": key})
+        return text
+
+    def _rules(self, payload: dict, key: str, error: str | None = None) -> str:
+        self.stats["fallbacks" if error else "rules"] += 1
+        if error:
+            self.fallback_brands.add(payload.get("brand"))
+        event("narrative", brand=payload.get("brand"), section=key, fallback=bool(error), **({"error": error} if error else {}))
+        return section_text(payload, key)
+
+    async def sections(self, payload: dict) -> list[tuple[str, str]]:
+        self._ensure_semaphore()
+        texts = await asyncio.gather(*(self.section(payload, k) for k, _, _ in SECTION_PROMPTS))
+        return [(title, text) for (_, title, _), text in zip(SECTION_PROMPTS, texts)]
+
+    async def sections_many(self, payloads: dict) -> dict:
+        self._ensure_semaphore()
+        brands = list(payloads)
+        results = await asyncio.gather(*(self.sections(payloads[b]) for b in brands))
+        return dict(zip(brands, results))
+
+    def _ensure_semaphore(self):
+        # Semaphore 需要在事件循环里创建；同一个循环内所有品牌共用
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+
+
+def generate_sections(payload: dict, **kwargs) -> list[tuple[str, str]]:
+    """
+    同步入口：单品牌四层并发生成，返回 create_pdf 的 sections
+    """
+    return asyncio.run(SectionGenerator(**kwargs).sections(payload))
+
+
+def generate_sections_many(payloads: dict, **kwargs) -> dict:
+    """
+    同步入口：多品牌 x 四层全部并发（受 concurrency 限制），返回 {brand: sections}
+    """
+    return asyncio.run(SectionGenerator(**kwargs).sections_many(payloads))
@@ -0,0 +1,143 @@
+# llm_cache.py
+"""
+LLM 文本的内容寻址缓存：key = hash(规范化 payload, 提示词模板, 模型, temperature)。
+
+每条缓存一个 JSON 文件（<key>.json），文件 mtime 即“最近使用时间”：
+  - 命中时刷新 mtime（LRU）
+  - 写入后按 max_age_days 清理过期条目，再按 max_entries / max_bytes 从最久未用的开始淘汰
+数据、品牌、模板、模型任一变化都会得到新 key，不会串用别的品牌的文本。
+"""
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_CACHE_DIR = "outputs/llm_cache"
+
+
+def canonical_json(obj) -> str:
+    # key 顺序、空白、NaN/日期等都规范化，保证同样的数据得到同样的字符串
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def cache_key(payload: dict, template: str, model: str, temperature: float) -> str:
+    h = hashlib.sha256()
+    for part in (canonical_json(payload), template, str(model), repr(float(temperature))):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def list_entries(cache_dir: str, suffix: str) -> list[tuple[str, float, int]]:
+    """
+    目录里以 suffix 结尾的缓存文件 -> [(path, mtime, size)]，按最久未用在前（mtime 即最近使用时间）
+    """
+    out = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        out.append((path, st.st_mtime, st.st_size))
+    return sorted(out, key=lambda e: e[1])
+
+
+def lru_overflow(entries: list, max_entries: int | None, max_bytes: int | None, keep=()) -> list:
+    """
+    entries（最久未用在前）超出条数 / 字节上限时，从最久未用的开始要淘汰的条目；keep 里的路径不淘汰
+    """
+    keep = set(keep)
+    count, total = len(entries), sum(e[2] for e in entries)
+    drop = []
+    for e in entries:
+        if not ((max_entries is not None and count > max_entries) or (max_bytes is not None and total > max_bytes)):
+            break
+        if e[0] in keep:
+            continue
+        drop.append(e)
+        count -= 1
+        total -= e[2]
+    return drop
+
+
+class LLMCache:
+    """
+    本地磁盘缓存（LRU + 过期淘汰），stats 记录 hits / misses / writes / evictions
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_entries: int | None = 500,
+        max_bytes: int | None = 50 * 1024 * 1024,
+        max_age_days: float | None = 90,
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _expired(self, mtime: float, now: float) -> bool:
+        return self.max_age_days is not None and now - mtime > self.max_age_days * 86400
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if self._expired(st.st_mtime, time.time()):
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                text = json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            self.stats["misses"] += 1
+            return None
+        try:
+            os.utime(path)  # 最近使用
+        except OSError:
+            pass  # 读完之后被别的进程淘汰了：文本已经拿到，照常算命中
+        self.stats["hits"] += 1
+        return text
+
+    def set(self, key: str, text: str, meta: dict | None = None) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"text": text, "meta": meta or {}, "created": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp, path)  # 原子写，避免并发读到半个文件
+        self.stats["writes"] += 1
+        self.evict()
+
+    def entries(self) -> list[tuple[str, float, int]]:
+        """
+        [(path, mtime, size)]，按最久未用在前
+        """
+        return list_entries(self.cache_dir, ".json")
+
+    def evict(self) -> int:
+        now = time.time()
+        entries = self.entries()
+        keep, drop = [], []
+        for e in entries:
+            (drop if self._expired(e[1], now) else keep).append(e)
+
+        drop += lru_overflow(keep, self.max_entries, self.max_bytes)
+
+        for path, _, _ in drop:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.stats["evictions"] += len(drop)
+        return len(drop)
+
+    def clear(self) -> None:
+        for path, _, _ in self.entries():
+            os.remove(path)
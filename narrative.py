@@ -0,0 +1,294 @@
+# narrative.py
+"""
+规则模板版报告正文：直接由 payload 生成四个分析层（销额&份额趋势 / 分省份 / 分渠道 / 建议），毫秒级、不调用 LLM
+  - --no-llm（REPORT_LLM_MODE=rules）：整份报告只用模板文本
+  - LLM 调用失败 / 超时 / 额度不足时按层自动回退到模板文本（llm_async.SectionGenerator fallback）
+  - 初稿模式（narrative="draft"）：模板文本作为初稿发给 LLM，只附关键数字，提示词比完整 payload 小得多
+payload 可以是 build_insight 的原始输出，也可以是 compact.PayloadCompactor 压缩后的（列式表、取整、删空字段）
+"""
+from llm import SECTION_PROMPTS
+
+_DIM_NAMES = {"province": "省份", "channel": "渠道"}
+
+# 份额四象限（analysis.classify_share_move 的结论）-> 对管理层意味着什么
+_STORY_MEANING = {
+    "份额提升：品牌增长快于大盘": "品类在增长且我们跑赢大盘，增长质量较好，重点是守住领先的省份/渠道并复制打法",
+    "份额提升：品牌下滑慢于大盘（相对更强）": "份额提升来自“跌得比大盘少”，绝对销额仍在下滑，不能把相对优势当成增长",
+    "份额下跌：品牌增长慢于大盘": "品类在增长但我们没有吃到红利，竞品在抢增量，需要尽快找到掉份额的省份/渠道",
+    "份额下跌：品牌下滑快于大盘（相对更弱）": "品类下滑且我们跌得更快，处于最被动的位置，需要优先止血",
+}
+
+
+def _records(x) -> list[dict]:
+    # 压缩后的表是列式 {"cols": [...], "rows": [[...]]}
+    if isinstance(x, dict) and "cols" in x and "rows" in x:
+        return [dict(zip(x["cols"], r)) for r in x["rows"]]
+    return [r for r in (x or []) if isinstance(r, dict)]
+
+
+def _num(x) -> float | None:
+    if x is None or isinstance(x, bool):
+        return None
+    try:
+        x = float(x)
+    except (TypeError, ValueError):
+        return None
+    return x if x == x and abs(x) != float("inf") else None
+
+
+def fmt_money(x) -> str:
+    x = _num(x)
+    if x is None:
+        return "—"
+    if abs(x) >= 1e8:
+        return f"{x / 1e8:,.2f}亿"
+    if abs(x) >= 1e4:
+        return f"{x / 1e4:,.1f}万"
+    return f"{x:,.0f}"
+
+
+def fmt_pct(x, digits: int = 1) -> str:
+    x = _num(x)
+    return "—" if x is None else f"{x:.{digits}f}%"
+
+
+def fmt_signed(x, unit: str = "pp", digits: int = 2) -> str:
+    x = _num(x)
+    return "—" if x is None else f"{x:+.{digits}f}{unit}"
+
+
+def period_label(payload: dict) -> str:
+    """
+    本期口径：按窗口出的 payload 写窗口区间，否则是最新财季
+    """
+    w = payload.get("window")
+    if w:
+        return f"{w.get('label') or w.get('name')}（{w.get('start')}~{w.get('end')}，对比 {w.get('base_start')}~{w.get('base_end')}）"
+    if payload.get("latest_fy"):
+        return f"最新财季 FY{payload['latest_fy']}{payload.get('latest_fq') or ''}"
+    return "最新财季"
+
+
+def driver(row: dict) -> str:
+    """
+    份额变化的主因：卖力贡献和铺货贡献谁的绝对值大；两者方向相反时注明另一项是拖累还是对冲
+    """
+    vel, dist = _num(row.get("vel_contrib_pp")), _num(row.get("dist_contrib_pp"))
+    if vel is None and dist is None:
+        return "缺少铺货数据，无法拆解"
+    if dist is None:
+        return "卖力驱动"
+    if vel is None:
+        return "铺货驱动"
+    if abs(vel) >= abs(dist):
+        main, minor_name, minor = "卖力驱动", "铺货", dist
+    else:
+        main, minor_name, minor = "铺货驱动", "卖力", vel
+    if vel * dist < 0:
+        # 次要因素方向相反：为负是拖累，为正是部分对冲了下跌
+        main += f"（{minor_name}{'拖累' if minor < 0 else '对冲'}）"
+    return main
+
+
+def _row_line(dim: str, r: dict) -> str:
+    name = r.get(dim) or "（未标注）"
+    parts = [
+        f"份额 {fmt_pct(r.get('cur_share'))}，同比 {fmt_signed(r.get('share_pp'))}",
+        f"卖力贡献 {fmt_signed(r.get('vel_contrib_pp'))} / 铺货贡献 {fmt_signed(r.get('dist_contrib_pp'))}，{driver(r)}",
+        f"加权铺货 {fmt_pct(r.get('cur_wdist'))}（{fmt_signed(r.get('wdist_pp'))}）",
+        f"销额 {fmt_money(r.get('cur_sales_value'))}",
+    ]
+    if _num(r.get("cur_price")) is not None:
+        parts.append(f"单价 {_num(r.get('cur_price')):.2f}")
+    return f"- {name}：" + "；".join(parts)
+
+
+def overview_text(payload: dict) -> str:
+    ov = payload.get("overview") or {}
+    brand = payload.get("brand") or ""
+    lines = ["### 核心结论"]
+    lines.append(
+        f"{period_label(payload)}，{brand} 销额 {fmt_money(ov.get('latest_quarter_sales_value'))}，"
+        f"份额 {fmt_pct(ov.get('latest_quarter_share_value_pct'), 2)}，份额同比 {fmt_signed(ov.get('share_yoy_pp'))}。"
+    )
+    story = ov.get("share_story") or "无法判断（缺少同比基期）"
+    lines.append(f"- 品牌销额同比 {fmt_signed(ov.get('brand_sales_yoy_pct'), '%', 1)}，品类（大盘）同比 {fmt_signed(ov.get('category_sales_yoy_pct'), '%', 1)}：{story}")
+    if story in _STORY_MEANING:
+        lines.append(f"- 这意味着：{_STORY_MEANING[story]}")
+
+    trend = [r for r in _records(payload.get("monthly_trend")) if _num(r.get("sales_value")) is not None]
+    if trend:
+        lines.append("### 月度趋势")
+        first, last = trend[0], trend[-1]
+        lines.append(
+            f"- {first.get('month')} ~ {last.get('month')} 共 {len(trend)} 个月：月销额 {fmt_money(first.get('sales_value'))} -> {fmt_money(last.get('sales_value'))}，"
+            f"份额 {fmt_pct(first.get('share_value_pct'), 2)} -> {fmt_pct(last.get('share_value_pct'), 2)}"
+        )
+        shares = [(r.get("month"), _num(r.get("share_value_pct"))) for r in trend if _num(r.get("share_value_pct")) is not None]
+        if shares:
+            hi, lo = max(shares, key=lambda x: x[1]), min(shares, key=lambda x: x[1])
+            lines.append(f"- 份额最高 {hi[0]}（{hi[1]:.2f}%），最低 {lo[0]}（{lo[1]:.2f}%）")
+        if len(trend) >= 6:
+            recent = sum(_num(r["sales_value"]) for r in trend[-3:])
+            before = sum(_num(r["sales_value"]) for r in trend[-6:-3])
+            s_recent = [_num(r.get("share_value_pct")) for r in trend[-3:] if _num(r.get("share_value_pct")) is not None]
+            s_before = [_num(r.get("share_value_pct")) for r in trend[-6:-3] if _num(r.get("share_value_pct")) is not None]
+            line = f"- 近 3 个月销额较前 3 个月 {fmt_signed((recent / before - 1) * 100 if before else None, '%', 1)}"
+            if s_recent and s_before:
+                line += f"，平均份额 {fmt_signed(sum(s_recent) / len(s_recent) - sum(s_before) / len(s_before))}"
+            lines.append(line)
+    for r in _records(payload.get("yearly_trend")):
+        lines.append(f"- FY{r.get('fy')}：销额 {fmt_money(r.get('sales_value'))}，份额 {fmt_pct(r.get('share_value_pct'), 2)}（{r.get('months')} 个月）")
+    lines += quality_text(payload.get("data_quality"))
+    return "\n".join(lines)
+
+
+def quality_text(dq: dict | None) -> list[str]:
+    """
+    payload 的 data_quality（入库质量报告里本品牌的部分）-> 总览末尾的数据提示
+    """
+    if not dq:
+        return []
+    lines = ["### 数据提示"]
+    issues = dq.get("row_issues") or {}
+    if issues:
+        lines.append("- 异常行：" + "，".join(f"{k} {v:,} 行" for k, v in issues.items()) + "；相关汇总可能有偏差")
+    mixed = dq.get("mixed_level")
+    if mixed:
+        lines.append(f"- 层级混用：{mixed.get('range')} 有 {mixed.get('months')} 个月同时含多个市场层级的行，总量可能重复计算")
+    spikes = dq.get("mom_spikes")
+    if spikes:
+        top = (_records(spikes.get("top")) or [{}])[0]
+        where = "/".join(str(top.get(k)) for k in ("province", "channel") if top.get(k)) or "全国"
+        lines.append(
+            f"- 环比突变 {spikes.get('count')} 处，最大一处：{where} {top.get('month')} 月销额环比 {fmt_signed(top.get('change_pct'), '%', 1)}，"
+            "建议核对源数据后再解读"
+        )
+    return lines
+
+
+def drilldown_text(payload: dict, dim: str) -> str:
+    d = payload.get(f"{dim}_drilldown") or {}
+    name = _DIM_NAMES.get(dim, dim)
+    up, down, table = _records(d.get("top_up")), _records(d.get("top_down")), _records(d.get("table"))
+    if not up and not down:
+        return f"{period_label(payload)}缺少去年同期的{name}数据，无法做同比下钻。"
+
+    lines = [f"口径：{period_label(payload)} vs 去年同期；份额变化 = 卖力贡献 + 铺货贡献（对数拆解）。"]
+    lines.append(f"### 份额增长 Top{len(up)} {name}")
+    lines += [_row_line(dim, r) for r in up]
+    lines.append(f"### 份额下跌 Top{len(down)} {name}")
+    lines += [_row_line(dim, r) for r in down]
+
+    rows = table or up + down
+    moved = [r for r in rows if _num(r.get("share_pp")) is not None]
+    lines.append("### 归因小结")
+    if moved:
+        gain = [r for r in moved if r["share_pp"] > 0]
+        loss = [r for r in moved if r["share_pp"] < 0]
+        by_vel = lambda rs: sum(driver(r).startswith("卖力") for r in rs)  # noqa: E731
+        lines.append(f"- 份额提升 {len(gain)} 个{name}（卖力驱动 {by_vel(gain)} 个），下跌 {len(loss)} 个（卖力驱动 {by_vel(loss)} 个）")
+        sales = sum(_num(r.get("cur_sales_value")) or 0 for r in moved)
+        loss_sales = sum(_num(r.get("cur_sales_value")) or 0 for r in loss)
+        if sales:
+            lines.append(f"- 掉份额的{name}合计占本期销额 {loss_sales / sales * 100:.0f}%")
+    prices = [(r.get(dim), _num(r.get("cur_price"))) for r in rows if _num(r.get("cur_price")) is not None]
+    if prices:
+        hi, lo = max(prices, key=lambda x: x[1]), min(prices, key=lambda x: x[1])
+        lines.append(f"- 单价：{name}间 {lo[1]:.2f}（{lo[0]}）~ {hi[1]:.2f}（{hi[0]}）；单价偏高且卖力下滑的{name}需排查价格竞争力")
+    else:
+        lines.append("- 单价：当前数据未提供销量/单价，无法判断单价影响")
+    return "\n".join(lines)
+
+
+def actions(payload: dict, limit: int = 8) -> list[dict]:
+    """
+    建议清单：每个掉份额 / 涨份额的省份、渠道一条，按影响（份额变化点数 x 该维度品类销额）排序
+    """
+    out = []
+    for dim in ("province", "channel"):
+        d = payload.get(f"{dim}_drilldown") or {}
+        for kind, rows in (("down", _records(d.get("top_down"))), ("up", _records(d.get("top_up")))):
+            for r in rows:
+                pp, share, sales = _num(r.get("share_pp")), _num(r.get("cur_share")), _num(r.get("cur_sales_value"))
+                if pp is None or (kind == "down") != (pp < 0) or pp == 0:
+                    continue
+                # 份额变动 1pp 对应的销额 ≈ 该维度品类销额的 1%
+                impact = abs(pp) / 100.0 * (sales / share * 100.0) if sales and share else 0.0
+                out.append({"dim": dim, "name": r.get(dim) or "（未标注）", "kind": kind, "row": r, "impact": impact})
+    out.sort(key=lambda a: (a["kind"] != "down", -a["impact"]))
+    return out[:limit]
+
+
+def _action_text(a: dict) -> str:
+    r, name, label = a["row"], a["name"], _DIM_NAMES.get(a["dim"], a["dim"])
+    drv = driver(r)
+    impact = f"按当前品类规模，约对应 {fmt_money(a['impact'])} 的销额" if a["impact"] else "影响规模待补数据"
+    if a["kind"] == "down" and drv.startswith("铺货"):
+        what = f"{label}「{name}」补铺货：加权铺货 {fmt_pct(r.get('cur_wdist'))}，同比 {fmt_signed(r.get('wdist_pp'))}，优先恢复流失的门店/终端"
+        risk = "新增门店的动销需要跟上，否则铺货率上去了单点卖力会被摊薄"
+    elif a["kind"] == "down":
+        what = f"{label}「{name}」提升单点卖力：份额 {fmt_signed(r.get('share_pp'))} 主要来自卖力（{fmt_signed(r.get('vel_contrib_pp'))}），排查陈列、促销力度和价格竞争力"
+        risk = "促销拉动的卖力可能不可持续，要控制费用率和对价格带的冲击"
+    elif drv.startswith("铺货"):
+        what = f"{label}「{name}」巩固铺货优势：份额 {fmt_signed(r.get('share_pp'))}，铺货贡献 {fmt_signed(r.get('dist_contrib_pp'))}，把新进终端的动销做起来"
+        risk = "铺货扩张期库存和账期压力上升"
+    else:
+        what = f"{label}「{name}」复制卖力打法：份额 {fmt_signed(r.get('share_pp'))}，卖力贡献 {fmt_signed(r.get('vel_contrib_pp'))}，总结可复制的陈列/促销动作推广到相近{label}"
+        risk = "打法未必适用于渠道结构不同的市场，先小范围试点"
+    why = f"份额同比 {fmt_signed(r.get('share_pp'))}（{drv}），本期销额 {fmt_money(r.get('cur_sales_value'))}"
+    return f"{what}\n- 为什么：{why}\n- 预期影响：{impact}\n- 风险点：{risk}"
+
+
+def recommendations_text(payload: dict) -> str:
+    ov = payload.get("overview") or {}
+    lines = []
+    story = ov.get("share_story") or ""
+    if story.startswith("份额下跌"):
+        lines.append(f"总体判断：{story}，建议以止跌为先，按影响从大到小处理下列{_DIM_NAMES['province']}/{_DIM_NAMES['channel']}。")
+    elif story.startswith("份额提升"):
+        lines.append(f"总体判断：{story}，建议在守住增长点的同时修补掉份额的短板。")
+    items = actions(payload)
+    if not items:
+        lines.append("当前数据缺少同比基期或下钻明细，暂无法给出落到省份/渠道的建议。")
+    for i, a in enumerate(items, 1):
+        lines.append(f"{i}. {_action_text(a)}")
+    return "\n".join(lines)
+
+
+SECTION_BUILDERS = {
+    "overview": overview_text,
+    "province": lambda p: drilldown_text(p, "province"),
+    "channel": lambda p: drilldown_text(p, "channel"),
+    "recommendations": recommendations_text,
+}
+
+
+def section_text(payload: dict, key: str) -> str:
+    return SECTION_BUILDERS[key](payload)
+
+
+def narrative_sections(payload: dict) -> list[tuple[str, str]]:
+    """
+    与 llm_async.generate_sections 相同的返回格式：[(标题, 正文), ...]
+    """
+    return [(title, section_text(payload, key)) for key, title, _ in SECTION_PROMPTS]
+
+
+# 初稿模式下每层随初稿附带的 payload 字段（下钻的数字已逐条写在初稿里，不再重复）
+_DRAFT_FACTS = {
+    "overview": ["overview"],
+    "province": [],
+    "channel": [],
+    "recommendations": ["overview"],
+}
+
+
+def draft_payload(payload: dict, key: str) -> dict:
+    """
+    给 LLM 的精简输入：品牌 / 口径 + 该层的模板初稿 + 少量关键数字
+    """
+    out = {k: payload[k] for k in ("brand", "latest_fy", "latest_fq", "window") if payload.get(k) is not None}
+    out.update({k: payload[k] for k in _DRAFT_FACTS[key] if k in payload})
+    out["draft"] = section_text(payload, key)
+    return out
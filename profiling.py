@@ -0,0 +1,200 @@
+# profiling.py
+"""
+流水线埋点：分阶段计时（墙钟 + CPU）、内存峰值、处理行数、LLM 指标，输出结构化 JSON 追踪
+
+  REPORT_TRACE=1            开启（默认关闭；关闭时 span/traced/event 只多一次布尔判断）
+  REPORT_TRACE_MEMORY=1     另外用 tracemalloc 记录每个阶段的内存峰值（会明显变慢，按需开）
+  REPORT_PROFILE_STAGE=llm  对名为 llm 的阶段跑 cProfile，结果存 outputs/profile_llm.prof
+                            （用 python -m pstats 或 snakeviz 查看）
+
+用法：
+  with span("pdf", rows=len(sections)): ...
+  @traced()                       # 函数级：自动记录第一个 DataFrame 参数 / 返回值的行数
+  event("llm", latency_s=..., prompt_tokens=...)
+  dump("outputs/trace.json")
+"""
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+TRACE_PATH = "outputs/trace.json"
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.profile_stage = None
+        self.profile_dir = "outputs"
+        self.spans = []
+        self.events = []
+        # 进行中的 span：父子关系按线程 / asyncio 任务各记一份（ContextVar，元组不可变，子任务拿到的是副本）；
+        # tracemalloc 的峰值是全进程的，所以所有线程里进行中的 span 另记在 _active 上，和 spans/events 一起用锁保护
+        self._stack = contextvars.ContextVar("trace_stack", default=())
+        self._active = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def enable(self, memory: bool = False, profile_stage: str | None = None, profile_dir: str = "outputs") -> None:
+        self.enabled = True
+        self.memory = memory
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir
+        self._t0 = time.perf_counter()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans, self.events, self._active = [], [], []
+        self._stack.set(())
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            yield attrs
+            return
+        stack = self._stack.get()
+        frame = {"name": name, "parent": stack[-1]["name"] if stack else None,
+                 "depth": len(stack), "child_peak": 0}
+        with self._lock:
+            if self.memory:
+                # reset_peak 会清掉所有进行中的 span（包括别的线程里的）已经到过的峰值，先把它记到它们身上
+                self._fold_peak(tracemalloc.get_traced_memory()[1])
+                frame["mem_start"] = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            self._active.append(frame)
+        self._stack.set(stack + (frame,))
+        prof = cProfile.Profile() if name == self.profile_stage else None
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        if prof:
+            prof.enable()
+        try:
+            yield attrs  # 调用方可以在 with 块里补充 attrs（如输出行数）
+        finally:
+            if prof:
+                prof.disable()
+            rec = {
+                "name": name,
+                "parent": frame["parent"],
+                "depth": frame["depth"],
+                "start_s": round(start_wall - self._t0, 4),
+                "wall_s": round(time.perf_counter() - start_wall, 4),
+                "cpu_s": round(time.process_time() - start_cpu, 4),
+            }
+            self._stack.set(stack)
+            if prof:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                rec["profile"] = os.path.join(self.profile_dir, f"profile_{name}.prof")
+                prof.dump_stats(rec["profile"])
+            rec.update({k: v for k, v in attrs.items() if v is not None})
+            with self._lock:
+                # 按身份删：两个同名同深度的 frame 用 == 比较会相等
+                del self._active[next(i for i, f in enumerate(self._active) if f is frame)]
+                if self.memory:
+                    peak = max(tracemalloc.get_traced_memory()[1], frame["child_peak"])
+                    rec["peak_mb"] = round((peak - frame["mem_start"]) / 2**20, 2)
+                    self._fold_peak(peak)
+                self.spans.append(rec)
+
+    def _fold_peak(self, peak: int) -> None:
+        # 调用方持有 _lock
+        for f in self._active:
+            f["child_peak"] = max(f["child_peak"], peak)
+
+    def event(self, kind: str, **fields) -> None:
+        if self.enabled:
+            rec = {"kind": kind, "at_s": round(time.perf_counter() - self._t0, 4), **fields}
+            with self._lock:
+                self.events.append(rec)
+
+    def summary(self) -> dict:
+        """
+        按阶段名汇总（同一函数被调用多次时合计），LLM 指标合计
+        """
+        with self._lock:
+            spans, events = list(self.spans), list(self.events)
+        stages = {}
+        for s in spans:
+            agg = stages.setdefault(s["name"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            agg["calls"] += 1
+            agg["wall_s"] = round(agg["wall_s"] + s["wall_s"], 4)
+            agg["cpu_s"] = round(agg["cpu_s"] + s["cpu_s"], 4)
+            if "peak_mb" in s:
+                agg["peak_mb"] = max(agg.get("peak_mb", 0.0), s["peak_mb"])
+        llm = [e for e in events if e["kind"] == "llm"]
+        out = {"stages": stages}
+        if llm:
+            out["llm"] = {
+                "calls": len(llm),
+                "cache_hits": sum(bool(e.get("cache_hit")) for e in llm),
+                "retries": sum(e.get("retries", 0) for e in llm),
+                "prompt_tokens": sum(e.get("prompt_tokens") or 0 for e in llm),
+                "completion_tokens": sum(e.get("completion_tokens") or 0 for e in llm),
+                "latency_s": round(sum(e.get("latency_s") or 0 for e in llm), 3),
+            }
+        rules = [e for e in events if e["kind"] == "narrative"]
+        if rules:
+            # 规则模板生成的分层（--no-llm，或 LLM 失败后回退）
+            out["narrative"] = {"sections": len(rules), "fallbacks": sum(bool(e.get("fallback")) for e in rules)}
+        try:
+            import resource
+            # Linux 上单位是 KB
+            out["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        except ImportError:
+            pass
+        return out
+
+    def dump(self, path: str = TRACE_PATH, **meta) -> str | None:
+        if not self.enabled:
+            return None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        summary = self.summary()
+        with self._lock:
+            doc = {"meta": meta, "summary": summary, "spans": list(self.spans), "events": list(self.events)}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2, default=str)
+        return path
+
+
+tracer = Tracer()
+if os.getenv("REPORT_TRACE", "") == "1":
+    tracer.enable(memory=os.getenv("REPORT_TRACE_MEMORY", "") == "1", profile_stage=os.getenv("REPORT_PROFILE_STAGE") or None)
+
+span = tracer.span
+event = tracer.event
+dump = tracer.dump
+
+
+def _rows(obj) -> int | None:
+    # 不主动导入 pandas（渲染等轻量子命令用不到）；还没导入过就不可能是 DataFrame
+    pd = sys.modules.get("pandas")
+    return len(obj) if pd is not None and isinstance(obj, pd.DataFrame) else None
+
+
+def traced(name: str | None = None):
+    """
+    函数级 span：记录第一个 DataFrame 参数的行数（rows_in）和 DataFrame 返回值的行数（rows_out）
+    """
+    def deco(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            rows_in = next((n for n in map(_rows, list(args) + list(kwargs.values())) if n is not None), None)
+            with tracer.span(label, rows_in=rows_in) as attrs:
+                out = fn(*args, **kwargs)
+                attrs["rows_out"] = _rows(out[0] if isinstance(out, tuple) and out else out)
+            return out
+        return wrapper
+    return deco
@@ -0,0 +1,420 @@
+# quality.py
+"""
+数据质量 / 异常扫描：入库时逐块做一次向量化检查（scripts/excel_to_csv.py），也可以对已有数据分块重扫
+  python quality.py data/clean/nielsen_store            # 重扫列式存储，写 <store>/_quality.json
+  python quality.py data/clean/nielsen_clean.csv        # 重扫 CSV，写 nielsen_clean.quality.json
+
+检查项：
+  1. 度量异常：空值 / 为 0 / 负值 / inf / 百分比超过 100 / 份额为 0 但有销额（按份额反推品类销额会得到无穷大）/ 日期缺失
+  2. 重复键：同一 日期 x 品牌 x 品类 x 市场 出现多行（跨块检查）
+  3. 层级混用：同一品牌同一月既有全国/大区行，又有省份/渠道行；总览直接相加会重复计算
+  4. 环比突变：品牌 x 省份 x 渠道 的月度销额（月度立方体），环比对数变化的稳健 z 分数（中位数 / MAD）超过阈值
+内存：重复键每个不同的键留一个 8 字节哈希；其余只和 品牌 x 省份 x 渠道 x 月 的格子数有关，与行数无关
+analysis.aggregates_from_cube(quality=...) 把单个品牌的发现放进 payload 的 data_quality
+"""
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from analysis import MEASURE_COLUMNS, SERIES_PERIODS, month_key
+
+QUALITY_REPORT = "_quality.json"  # 列式存储目录里（pyarrow 读数据集时忽略 _ 开头的文件）
+KEY_COLUMNS = ["date", "brand", "category", "market_raw"]
+PCT_COLUMNS = ["share_value_pct", "wdist_pct", "ndist_pct"]
+
+# 层级：由 area / province / channel 是否为空决定；同一品牌同一月出现多个层级即“混用”
+LEVELS = ["national", "area", "province", "channel", "province_channel"]
+LEVEL_NAMES = {"national": "全国", "area": "大区", "province": "省份", "channel": "渠道", "province_channel": "省份x渠道"}
+
+ISSUE_NAMES = {
+    "empty": "度量为空",
+    "zero": "度量为0",
+    "negative": "负值",
+    "inf": "无穷大",
+    "over_100": "百分比超过100",
+    "zero_share": "份额为0但有销额",
+    "missing_date": "日期缺失",
+    "duplicate_key": "重复键（日期x品牌x品类x市场）",
+}
+
+
+def quality_report_path(data_path: str) -> str:
+    if str(data_path).endswith(".csv"):
+        return str(data_path)[:-4] + ".quality.json"
+    return os.path.join(data_path, QUALITY_REPORT)
+
+
+def read_quality_report(data_path: str) -> dict | None:
+    path = quality_report_path(data_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _floats(s: pd.Series) -> np.ndarray:
+    return pd.to_numeric(s, errors="coerce").to_numpy(np.float64, na_value=np.nan)
+
+
+def _filled(s: pd.Series) -> np.ndarray:
+    # 维度非空（不是 "" 也不是缺失）
+    return (s.notna() & (s.astype(str).str.len() > 0)).to_numpy()
+
+
+def row_flags(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """
+    每个检查项一个布尔掩码：{"<检查>:<列>": mask}；只算一遍列值，不逐行循环
+    """
+    flags = {}
+    values = {c: _floats(df[c]) for c in MEASURE_COLUMNS if c in df.columns}
+    with np.errstate(invalid="ignore"):
+        for c, v in values.items():
+            flags[f"empty:{c}"] = np.isnan(v)
+            flags[f"zero:{c}"] = v == 0
+            flags[f"negative:{c}"] = v < 0
+            flags[f"inf:{c}"] = np.isinf(v)
+            if c in PCT_COLUMNS:
+                flags[f"over_100:{c}"] = v > 100
+        if "share_value_pct" in values and "sales_value" in values:
+            flags["zero_share:share_value_pct"] = (values["share_value_pct"] == 0) & (values["sales_value"] > 0)
+    if "date" in df.columns:
+        flags["missing_date:date"] = pd.to_datetime(df["date"], errors="coerce").isna().to_numpy()
+    return flags
+
+
+def hierarchy_level(df: pd.DataFrame) -> np.ndarray:
+    """
+    每行的层级编号（LEVELS 的下标）
+    """
+    n = len(df)
+    empty = np.zeros(n, dtype=bool)
+    area = _filled(df["area"]) if "area" in df.columns else empty
+    prov = _filled(df["province"]) if "province" in df.columns else empty
+    ch = _filled(df["channel"]) if "channel" in df.columns else empty
+    return np.select(
+        [prov & ch, prov, ch, area],
+        [LEVELS.index("province_channel"), LEVELS.index("province"), LEVELS.index("channel"), LEVELS.index("area")],
+        default=LEVELS.index("national"),
+    )
+
+
+class SeenKeys:
+    """
+    已见过的键哈希（跨块查重）：若干个有序 uint64 数组，新块作为最新一层，
+    相邻两层大小接近时合并（层数 O(log n)），查询对每层 searchsorted
+    """
+
+    def __init__(self):
+        self.levels: list[np.ndarray] = []
+
+    def _seen(self, h: np.ndarray) -> np.ndarray:
+        out = np.zeros(len(h), dtype=bool)
+        for lv in self.levels:
+            i = np.minimum(np.searchsorted(lv, h), len(lv) - 1)
+            out |= lv[i] == h
+        return out
+
+    def check_add(self, h: np.ndarray) -> np.ndarray:
+        """
+        返回“与更早的行重复”的掩码（同一块内第一次出现的不算），并记下新键
+        """
+        order = np.argsort(h, kind="stable")
+        hs = h[order]
+        repeat = np.zeros(len(h), dtype=bool)
+        repeat[1:] = hs[1:] == hs[:-1]
+        seen = self._seen(hs)
+        dup = np.empty(len(h), dtype=bool)
+        dup[order] = repeat | seen
+        new = hs[~repeat & ~seen]
+        if len(new):
+            self.levels.append(new)
+            while len(self.levels) > 1 and len(self.levels[-2]) < 2 * len(self.levels[-1]):
+                b = self.levels.pop()
+                a = self.levels.pop()
+                self.levels.append(np.sort(np.concatenate([a, b])))
+        return dup
+
+    @property
+    def nbytes(self) -> int:
+        return sum(lv.nbytes for lv in self.levels)
+
+
+class PartialSums:
+    """
+    按 keys 分组求和的累加器：每块先聚合成小表，攒到 flush_every 块再合并一次
+    """
+
+    def __init__(self, keys: list[str], values: list[str], flush_every: int = 16):
+        self.keys = keys
+        self.values = values
+        self.flush_every = flush_every
+        self._parts: list[pd.DataFrame] = []
+
+    def add(self, frame: pd.DataFrame) -> None:
+        self._parts.append(frame.groupby(self.keys, observed=True, sort=False)[self.values].sum().reset_index())
+        if len(self._parts) >= self.flush_every:
+            self._parts = [self.result()]
+
+    def result(self) -> pd.DataFrame:
+        if not self._parts:
+            return pd.DataFrame(columns=self.keys + self.values)
+        # 各块的分类列类别表不同，合并前统一成字符串
+        parts = [p.astype({k: str for k in self.keys}) for p in self._parts]
+        return pd.concat(parts, ignore_index=True).groupby(self.keys, sort=False)[self.values].sum().reset_index()
+
+
+def mom_spikes(monthly: pd.DataFrame, keys: list[str], value: str = "sales_value",
+               z_threshold: float = 4.0, min_change: float = 0.3, min_points: int = 6) -> pd.DataFrame:
+    """
+    月度立方体 -> 环比突变表
+    每条序列（keys）相邻两月的 d = ln(本月/上月)，稳健 z = 0.6745 x (d - 中位数) / MAD；
+    |z| >= z_threshold 且变化幅度 >= min_change（0.3 = ±30%）才算突变；有效环比点少于 min_points 的序列不判断
+    MAD 至少取 0.01，避免几乎不变的序列把微小波动放大成突变
+    """
+    cols = keys + ["month", "prev_month", value, f"prev_{value}", "change_pct", "z"]
+    m = monthly.loc[monthly["month"].astype(str).str.len() > 0, keys + ["month", value]]
+    if m.empty:
+        return pd.DataFrame(columns=cols)
+    codes, uniques = pd.factorize(m["month"].astype(str))
+    m = m.assign(_t=np.array([SERIES_PERIODS["month"][1](k) for k in uniques], dtype=np.int64)[codes])
+    m = m.sort_values(keys + ["_t"], kind="stable").reset_index(drop=True)
+    sid = m.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+    t = m["_t"].to_numpy()
+    v = m[value].to_numpy(np.float64)
+
+    i = np.nonzero((sid[1:] == sid[:-1]) & (t[1:] == t[:-1] + 1) & (v[1:] > 0) & (v[:-1] > 0))[0] + 1
+    if not len(i):
+        return pd.DataFrame(columns=cols)
+    d = pd.Series(np.log(v[i] / v[i - 1]))
+    g = pd.Series(sid[i])
+    med = d.groupby(g).transform("median")
+    mad = (d - med).abs().groupby(g).transform("median").clip(lower=0.01)
+    z = 0.6745 * (d - med) / mad
+    enough = g.map(g.value_counts()) >= min_points
+    hit = (enough & (z.abs() >= z_threshold) & (d.abs() >= np.log1p(min_change))).to_numpy()
+
+    rows, prev = i[hit], i[hit] - 1
+    out = m.loc[rows, keys + ["month", value]].reset_index(drop=True)
+    out["prev_month"] = m["month"].to_numpy()[prev]
+    out[f"prev_{value}"] = v[prev]
+    out["change_pct"] = (v[rows] / v[prev] - 1) * 100.0
+    out["z"] = z.to_numpy()[hit]
+    return out[cols].sort_values("z", key=np.abs, ascending=False, ignore_index=True)
+
+
+class QualityScan:
+    """
+    分块累加的质量扫描：update(块) 逐块调用，report() 汇总成报告 dict
+    块可以是清洗后的明细（excel_to_csv.clean_frame / to_store_frame 的输出）或 load_dataset 读出的数据
+    """
+
+    def __init__(self, samples: int = 5, z_threshold: float = 4.0, min_change: float = 0.3, top_spikes: int = 20):
+        self.samples = samples
+        self.z_threshold = z_threshold
+        self.min_change = min_change
+        self.top_spikes = top_spikes
+        self.rows = 0
+        self.issue_rows: dict[str, int] = {}
+        self.issue_samples: dict[str, list] = {}
+        self.brand_issues: dict[str, dict[str, int]] = {}
+        self.seen = SeenKeys()
+        self.levels = PartialSums(["brand", "month", "level"], ["rows", "sales_value"])
+        self.monthly = PartialSums(["brand", "province", "channel", "month"], ["sales_value"])
+
+    def _record(self, issue: str, mask: np.ndarray, df: pd.DataFrame, brands: pd.Series, column: str | None) -> None:
+        n = int(mask.sum())
+        if not n:
+            return
+        self.issue_rows[issue] = self.issue_rows.get(issue, 0) + n
+        counts = brands[mask].value_counts()
+        for b, k in counts.items():
+            per = self.brand_issues.setdefault(str(b), {})
+            per[issue] = per.get(issue, 0) + int(k)
+        kept = self.issue_samples.setdefault(issue, [])
+        if len(kept) < self.samples:
+            cols = [c for c in ["date", "brand", "category", "market_raw"] if c in df.columns]
+            cols += [column] if column and column in df.columns and column not in cols else []
+            sample = df.loc[mask, cols].head(self.samples - len(kept))
+            kept += json.loads(sample.to_json(orient="records", date_format="iso", force_ascii=False))
+
+    def update(self, df: pd.DataFrame) -> None:
+        if df.empty:
+            return
+        self.rows += len(df)
+        brands = df["brand"].astype(object).fillna("").astype(str).reset_index(drop=True)
+        df = df.reset_index(drop=True)
+
+        for name, mask in row_flags(df).items():
+            issue, column = name.split(":", 1)
+            self._record(name, mask, df, brands, column)
+
+        keys = [c for c in KEY_COLUMNS if c in df.columns]
+        h = pd.util.hash_pandas_object(df[keys], index=False).to_numpy(np.uint64)
+        self._record("duplicate_key", self.seen.check_add(h), df, brands, None)
+
+        month = month_key(pd.to_datetime(df["date"], errors="coerce")).to_numpy() if "date" in df.columns else np.full(len(df), "")
+        sales = np.nan_to_num(_floats(df["sales_value"]), nan=0.0, posinf=0.0, neginf=0.0)
+        dims = {c: df[c].astype(object).fillna("").astype(str).to_numpy() if c in df.columns else np.full(len(df), "")
+                for c in ["province", "channel"]}
+        self.levels.add(pd.DataFrame({
+            "brand": brands.to_numpy(), "month": month, "level": hierarchy_level(df),
+            "rows": np.ones(len(df), dtype=np.int64), "sales_value": sales,
+        }))
+        self.monthly.add(pd.DataFrame({
+            "brand": brands.to_numpy(), "province": dims["province"], "channel": dims["channel"],
+            "month": month, "sales_value": sales,
+        }))
+
+    def _mixed_levels(self) -> tuple[dict, dict]:
+        lv = self.levels.result()
+        lv = lv[lv["month"].astype(str).str.len() > 0]
+        if lv.empty:
+            return {"brand_months": 0, "rows_by_level": {}}, {}
+        lv["level"] = lv["level"].astype(int)
+        per = lv.groupby(["brand", "month"])["level"].nunique()
+        mixed = per[per > 1].reset_index()[["brand", "month"]]
+        rows_by_level = lv.groupby("level")["rows"].sum()
+        summary = {
+            "brand_months": len(mixed),
+            "rows_by_level": {LEVELS[int(k)]: int(v) for k, v in rows_by_level.items()},
+        }
+        brands = {}
+        if len(mixed):
+            sales = lv.groupby(["brand", "level"])["sales_value"].sum()
+            months = mixed.groupby("brand")["month"].apply(lambda s: sorted(s.astype(str)))
+            for b, ms in months.items():
+                s = sales.loc[b]
+                total = float(s.sum())
+                brands[str(b)] = {
+                    "mixed_level_months": len(ms),
+                    "first_month": ms[0],
+                    "last_month": ms[-1],
+                    "sales_pct_by_level": {LEVELS[int(k)]: round(float(v) / total * 100.0, 1) for k, v in s.items()} if total else {},
+                }
+        return summary, brands
+
+    def report(self, scope: dict | None = None) -> dict:
+        keys = ["brand", "province", "channel"]
+        spikes = mom_spikes(self.monthly.result(), keys, z_threshold=self.z_threshold, min_change=self.min_change)
+        mixed, mixed_brands = self._mixed_levels()
+
+        brands: dict[str, dict] = {}
+        for b, issues in self.brand_issues.items():
+            brands.setdefault(b, {})["issues"] = dict(sorted(issues.items()))
+        for b, v in mixed_brands.items():
+            brands.setdefault(b, {}).update(v)
+        for b, g in spikes.groupby("brand", sort=False):
+            brands.setdefault(str(b), {})["spikes"] = _spike_records(g.head(5))
+            brands[str(b)]["spike_count"] = len(g)
+
+        return {
+            "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "scope": scope or {},
+            "rows": self.rows,
+            "issues": {k: {"rows": v, "samples": self.issue_samples.get(k, [])} for k, v in sorted(self.issue_rows.items())},
+            "mixed_level": mixed,
+            "spikes": {"count": len(spikes), "z_threshold": self.z_threshold, "min_change_pct": self.min_change * 100,
+                       "top": _spike_records(spikes.head(self.top_spikes))},
+            "brands": dict(sorted(brands.items())),
+            "key_hash_mb": round(self.seen.nbytes / 2**20, 1),
+        }
+
+
+def _spike_records(df: pd.DataFrame) -> list[dict]:
+    out = df.copy()
+    for c in ("sales_value", "prev_sales_value"):
+        out[c] = out[c].round(2)
+    out["change_pct"] = out["change_pct"].round(1)
+    out["z"] = out["z"].round(1)
+    return out.to_dict(orient="records")
+
+
+def write_quality_report(report: dict, data_path: str) -> str:
+    path = quality_report_path(data_path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    return path
+
+
+def summary_lines(report: dict) -> list[str]:
+    """
+    命令行里打印的摘要
+    """
+    lines = [f"数据质量：{report['rows']:,} 行"]
+    for name, v in report["issues"].items():
+        issue, _, column = name.partition(":")
+        lines.append(f"  ⚠️ {ISSUE_NAMES.get(issue, issue)}{f'（{column}）' if column else ''}：{v['rows']:,} 行")
+    if report["mixed_level"]["brand_months"]:
+        lines.append(f"  ⚠️ 层级混用：{report['mixed_level']['brand_months']:,} 个 品牌x月 同时有多个层级的行（直接相加会重复计算）")
+    if report["spikes"]["count"]:
+        lines.append(f"  ⚠️ 环比突变：{report['spikes']['count']:,} 处（|z| >= {report['spikes']['z_threshold']}）")
+    if len(lines) == 1:
+        lines.append("  ✅ 未发现异常")
+    return lines
+
+
+def brand_quality(report: dict | None, brand: str) -> dict | None:
+    """
+    报告 -> 单个品牌放进 payload 的摘要；该品牌没有任何发现时返回 None
+    """
+    found = (report or {}).get("brands", {}).get(str(brand))
+    if not found:
+        return None
+    out = {}
+    if found.get("issues"):
+        out["row_issues"] = {
+            f"{ISSUE_NAMES.get(k.split(':')[0], k)}{'（' + k.split(':')[1] + '）' if ':' in k else ''}": v
+            for k, v in found["issues"].items()
+        }
+    if found.get("mixed_level_months"):
+        out["mixed_level"] = {
+            "months": found["mixed_level_months"],
+            "range": f"{found['first_month']} ~ {found['last_month']}",
+            "sales_pct_by_level": {LEVEL_NAMES.get(k, k): v for k, v in found.get("sales_pct_by_level", {}).items()},
+            "note": "同一月份同时有全国/大区与省份/渠道等多个层级的行，总览按全部行相加，可能重复计算",
+        }
+    if found.get("spikes"):
+        out["mom_spikes"] = {"count": found.get("spike_count", len(found["spikes"])), "top": found["spikes"]}
+    return out or None
+
+
+def scan_dataset(data_path: str, batch_rows: int = 500_000, scope: dict | None = None, **kwargs) -> dict:
+    """
+    对已有的列式存储 / CSV 分块重扫（每次只读 batch_rows 行）；scope 并入报告的 scope
+    增量入库合并后也用它重扫整个存储：重复键、环比突变都要看到全部历史
+    """
+    scan = QualityScan(**kwargs)
+    if str(data_path).endswith(".csv"):
+        for chunk in pd.read_csv(data_path, chunksize=batch_rows, low_memory=False):
+            scan.update(chunk)
+    else:
+        try:
+            import pyarrow.dataset as ds
+        except ImportError as e:
+            raise RuntimeError("扫描列式存储需要 pyarrow：pip install pyarrow") from e
+        dataset = ds.dataset(data_path, format="parquet", partitioning="hive")
+        columns = [c for c in dataset.schema.names if c != "fy"]
+        for batch in dataset.to_batches(columns=columns, batch_size=batch_rows):
+            scan.update(batch.to_pandas())
+    return scan.report(scope={"source": str(data_path), "rescan": True, **(scope or {})})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="清洗后数据的质量 / 异常扫描（分块，内存与行数无关）")
+    parser.add_argument("data", nargs="?", default="data/clean/nielsen_store", help="列式存储目录或 .csv")
+    parser.add_argument("--batch-rows", type=int, default=500_000)
+    parser.add_argument("--z", type=float, default=4.0, help="环比突变的稳健 z 分数阈值")
+    parser.add_argument("--min-change", type=float, default=0.3, help="环比变化幅度下限（0.3 = ±30%%）")
+    args = parser.parse_args()
+
+    rep = scan_dataset(args.data, args.batch_rows, z_threshold=args.z, min_change=args.min_change)
+    print("\n".join(summary_lines(rep)))
+    print(f"✅ 质量报告：{write_quality_report(rep, args.data)}")
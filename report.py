@@ -1,72 +1,197 @@
 # report.py
 import os
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+import re
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
 
-def _register_zh_font() -> str:
-    # Windows 常见字体：黑体（最稳）
-    font_path = r"C:\Windows\Fonts\simhei.ttf"
-    if not os.path.exists(font_path):
-        raise RuntimeError("未找到中文字体 simhei.ttf。请确认 C:\\Windows\\Fonts\\simhei.ttf 存在。")
+# 中文字体候选（按顺序找第一个存在的）；REPORT_FONT 环境变量可指定任意 .ttf/.ttc
+FONT_CANDIDATES = [
+    r"C:\Windows\Fonts\simhei.ttf",
+    r"C:\Windows\Fonts\msyh.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/arphic/uming.ttc",
+    "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+]
+# 找不到字体文件时用 PDF 阅读器内置的 CID 字体（不嵌入，文件最小）
+CID_FALLBACK = "STSong-Light"
 
-    pdfmetrics.registerFont(TTFont("ZH", font_path))
-    return "ZH"
+# 图表宽度（高度按 charts.FIGSIZE 的宽高比）
+CHART_WIDTH = 16 * cm
+CHART_ASPECT = 3.6 / 8.0
+
+_FONTS: dict = {}   # 字体文件路径 -> 已注册的字体名（进程内只解析一次）
+_RENDERERS: dict = {}
+
+def find_zh_font() -> str | None:
+    for path in [os.getenv("REPORT_FONT")] + FONT_CANDIDATES:
+        if path and os.path.exists(path):
+            return path
+    return None
+
+def _register_zh_font(font_path: str | None = None, embed: bool = True) -> str:
+    """
+    注册中文字体并返回字体名；同一字体进程内只注册一次
+    embed=True：嵌入 TrueType 字体（reportlab 只嵌入用到的字形子集）
+    embed=False 或找不到字体文件：用内置 CID 字体，不嵌入
+    """
+    font_path = font_path or (find_zh_font() if embed else None)
+    key = font_path or CID_FALLBACK
+    if key in _FONTS:
+        return _FONTS[key]
+
+    name = None
+    if font_path:
+        try:
+            # .ttc 字体集合取第一个子字体；CFF 轮廓（.otf）reportlab 不支持，会退回 CID 字体
+            font = TTFont(f"ZH{len(_FONTS)}", font_path, subfontIndex=0)
+            pdfmetrics.registerFont(font)
+            name = font.fontName
+        except TTFError:
+            name = None
+    if name is None:
+        name = CID_FALLBACK
+        pdfmetrics.registerFont(UnicodeCIDFont(name))
+    _FONTS[key] = name
+    return name
 
 def _escape_for_paragraph(s: str) -> str:
     # Paragraph 需要转义 + <br/> 换行
     s = (s or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
     return s.replace("\n", "<br/>")
 
+# 列表项：- / * / • 开头，或 1. 1、 1） (1) 这类编号
+_BULLET = re.compile(r"^\s*(?:[-*•·]\s+|\d+[.、)）]\s*|[（(]\d+[)）]\s*)")
+_HEADING = re.compile(r"^\s*#{1,6}\s+")
+# 中日韩文字及全角标点：断行两侧只要有一个是这类字符，接回时就不加空格
+_CJK = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]")
+
+def _join_wrapped(lines: list[str]) -> str:
+    out = lines[0]
+    for line in lines[1:]:
+        out += ("" if _CJK.match(out[-1]) or _CJK.match(line[0]) else " ") + line
+    return out
+
+def split_blocks(text: str) -> list[tuple[str, str]]:
+    """
+    LLM 正文 -> [(kind, 文本)]，kind: 'h' 小标题 / 'li' 列表项 / 'p' 段落
+    每行/每段单独成一个 flowable，避免整篇塞进一个 Paragraph 导致排版超慢甚至失败
+    """
+    blocks = []
+    para = []
+
+    def flush():
+        if para:
+            blocks.append(("p", _join_wrapped(para)))
+            para.clear()
+
+    for line in (text or "").splitlines():
+        line = line.strip().replace("**", "")
+        if not line:
+            flush()
+        elif _HEADING.match(line):
+            flush()
+            blocks.append(("h", _HEADING.sub("", line)))
+        elif _BULLET.match(line):
+            flush()
+            blocks.append(("li", line))
+        else:
+            para.append(line)
+    flush()
+    return blocks
+
+class PdfRenderer:
+    """
+    可复用的 PDF 渲染器：字体和样式只初始化一次，同一进程里可以连续渲染很多份报告
+    """
+
+    def __init__(self, font_path: str | None = None, embed: bool = True):
+        self.font_name = _register_zh_font(font_path, embed)
+        self.styles = self._build_styles(self.font_name)
+
+    @staticmethod
+    def _build_styles(font_name: str) -> dict:
+        base_styles = getSampleStyleSheet()
+        body = ParagraphStyle(
+            "ZhBody",
+            parent=base_styles["Normal"],
+            fontName=font_name,
+            fontSize=11,
+            leading=16,
+            spaceAfter=4,
+            wordWrap="CJK",
+        )
+        return {
+            "title": ParagraphStyle(
+                "ZhTitle",
+                parent=base_styles["Title"],
+                fontName=font_name,
+                fontSize=18,
+                leading=22,
+                spaceAfter=12,
+            ),
+            "h2": ParagraphStyle(
+                "ZhH2",
+                parent=base_styles["Heading2"],
+                fontName=font_name,
+                fontSize=13,
+                leading=18,
+                spaceBefore=12,
+                spaceAfter=6,
+            ),
+            "h3": ParagraphStyle(
+                "ZhH3",
+                parent=body,
+                fontSize=12,
+                leading=17,
+                spaceBefore=6,
+            ),
+            "body": body,
+            "li": ParagraphStyle("ZhLi", parent=body, leftIndent=14, spaceAfter=2),
+        }
+
+    def flowables(self, sections, title: str = "尼尔森 市场分析报告") -> list:
+        st = self.styles
+        story = [Paragraph(title, st["title"]), Spacer(1, 12)]
+
+        # 分段写入（你要的“拆分打印”就在这里）
+        # section 可以带第三项：图片路径列表（charts.attach_charts），放在正文后面
+        for sec_title, sec_body, *rest in sections:
+            if sec_title:
+                story.append(Paragraph(_escape_for_paragraph(sec_title), st["h2"]))
+            for kind, text in split_blocks(sec_body):
+                style = {"h": st["h3"], "li": st["li"]}.get(kind, st["body"])
+                story.append(Paragraph(_escape_for_paragraph(text), style))
+            for path in (rest[0] if rest else []):
+                story.append(Spacer(1, 6))
+                story.append(Image(path, width=CHART_WIDTH, height=CHART_WIDTH * CHART_ASPECT))
+            story.append(Spacer(1, 10))
+        return story
+
+    def render(self, sections, out_path: str = "Nielsen_Report.pdf", title: str = "尼尔森 市场分析报告") -> int:
+        """
+        渲染一份报告，返回页数
+        """
+        doc = SimpleDocTemplate(out_path, pagesize=A4)
+        doc.build(self.flowables(sections, title))
+        return doc.page
+
+def get_renderer(font_path: str | None = None, embed: bool = True) -> PdfRenderer:
+    key = (font_path, embed)
+    if key not in _RENDERERS:
+        _RENDERERS[key] = PdfRenderer(font_path, embed)
+    return _RENDERERS[key]
+
 def create_pdf(sections, out_path="Nielsen_Report.pdf"):
     """
-    sections: [(标题, 正文), (标题, 正文), ...]
+    sections: [(标题, 正文), (标题, 正文), ...]，也可以是 (标题, 正文, [图片路径, ...])
     这样就天然实现“拆分PDF打印”的能力（逐段写入）。
     """
-    font_name = _register_zh_font()
-
-    doc = SimpleDocTemplate(out_path, pagesize=A4)
-    base_styles = getSampleStyleSheet()
-
-    title_style = ParagraphStyle(
-        "ZhTitle",
-        parent=base_styles["Title"],
-        fontName=font_name,
-        fontSize=18,
-        leading=22,
-        spaceAfter=12,
-    )
-
-    h2_style = ParagraphStyle(
-        "ZhH2",
-        parent=base_styles["Heading2"],
-        fontName=font_name,
-        fontSize=13,
-        leading=18,
-        spaceBefore=12,
-        spaceAfter=6,
-    )
-
-    body_style = ParagraphStyle(
-        "ZhBody",
-        parent=base_styles["Normal"],
-        fontName=font_name,
-        fontSize=11,
-        leading=16,
-    )
-
-    story = []
-    story.append(Paragraph("尼尔森 市场分析报告", title_style))
-    story.append(Spacer(1, 12))
-
-    # 分段写入（你要的“拆分打印”就在这里）
-    for sec_title, sec_body in sections:
-        if sec_title:
-            story.append(Paragraph(_escape_for_paragraph(sec_title), h2_style))
-        if sec_body:
-            story.append(Paragraph(_escape_for_paragraph(sec_body), body_style))
-        story.append(Spacer(1, 10))
-
-    doc.build(story)
\ No newline at end of file
+    return get_renderer().render(sections, out_path=out_path)
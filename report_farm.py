@@ -0,0 +1,235 @@
+# report_farm.py
+"""
+全品牌并行出报告：
+  python report_farm.py                       # 全部品牌
+  python report_farm.py --brands A B --workers 8
+  python report_farm.py --by-province         # 再按省份拆分（品牌 x 省份各一份）
+  python report_farm.py --engine duckdb       # 立方体由内嵌 DuckDB 直接扫列式存储构建（见 engine.py）
+  python report_farm.py --narrative rules     # 不调用 LLM，正文由规则模板生成（见 narrative.py），几秒出全部 PDF
+
+流水线（每个任务 = 一个品牌，或品牌 x 省份）：
+  payload（进程池，CPU） -> LLM 四个分析层（asyncio，I/O）| 图表（进程池，与 LLM 重叠） -> create_pdf（进程池，CPU）
+一个任务在等 LLM 时，别的任务的 payload / PDF 在进程池里并行跑；
+每个任务的输出单独落在 outputs/farm/ 下，不覆盖 outputs/llm_text.json 等共享文件。
+单个任务失败只记录在 farm_report.json 里，不影响其他任务。
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from analysis import conform_cube, insight_from_cube, refresh_cube
+from charts import attach_charts
+from compact import PayloadCompactor
+from llm_async import SectionGenerator
+from quality import read_quality_report
+
+OUT_DIR = "outputs/farm"
+
+_cube = None  # 每个工作进程读一次立方体
+_quality = None  # 入库时的质量报告（quality.py），放进 payload 的 data_quality
+
+
+def _init_worker(cube_path: str, quality: dict | None = None) -> None:
+    global _cube, _quality
+    _cube = conform_cube(pd.read_parquet(cube_path))  # 与 refresh_cube 读回的类型、类别表一致
+    _quality = quality
+
+
+def _build_payload(brand: str, province: str | None) -> dict:
+    cube = _cube if province is None else _cube[_cube["province"] == province]
+    return insight_from_cube(cube, brand, quality=_quality)
+
+
+def _render_charts(payload: dict) -> dict:
+    from charts import render_charts  # matplotlib 只在渲染进程里导入
+
+    return render_charts([payload])[0]
+
+
+def _render_pdf(sections: list, out_path: str) -> str:
+    from report import create_pdf  # 每个渲染进程各自缓存一份 PdfRenderer（字体/样式只初始化一次）
+
+    create_pdf(sections, out_path=out_path)
+    return out_path
+
+
+def safe_name(s: str) -> str:
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", str(s)).strip("_") or "_"
+
+
+def job_name(brand: str, province: str | None) -> str:
+    return safe_name(brand) if province is None else f"{safe_name(brand)}__{safe_name(province)}"
+
+
+class ReportFarm:
+    """
+    workers：进程池大小（payload / PDF）；concurrency：同时在途的 LLM 请求数
+    """
+
+    def __init__(
+        self,
+        cube_path: str,
+        out_dir: str = OUT_DIR,
+        workers: int | None = None,
+        concurrency: int = 8,
+        token_budget: int | None = 6000,
+        llm: bool = True,
+        pdf: bool = True,
+        charts: bool = True,
+        narrative: str = "llm",
+        fallback: bool = True,
+        quality: dict | None = None,
+    ):
+        self.cube_path = cube_path
+        self.quality = quality
+        self.out_dir = out_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.llm = llm
+        self.pdf = pdf
+        self.charts = charts
+        self.compactor = PayloadCompactor(token_budget=token_budget) if token_budget else None
+        self.generator = SectionGenerator(concurrency=concurrency, narrative=narrative, fallback=fallback) if llm else None
+
+    def _path(self, name: str, kind: str) -> str:
+        ext = "pdf" if kind == "Nielsen_Report" else "json"
+        return os.path.join(self.out_dir, f"{kind}_{name}.{ext}")
+
+    def _write_json(self, path: str, obj) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+
+    async def _job(self, pool, brand: str, province: str | None) -> dict:
+        loop = asyncio.get_running_loop()
+        name = job_name(brand, province)
+        rec = {"job": name, "brand": brand, "province": province, "status": "ok"}
+        stage = "payload"
+        try:
+            t = time.perf_counter()
+            payload = await loop.run_in_executor(pool, _build_payload, brand, province)
+            self._write_json(self._path(name, "insight_payload"), payload)
+            rec["payload_s"] = round(time.perf_counter() - t, 3)
+
+            if not self.llm:
+                return rec
+            # 图表在进程池里画，和等 LLM 的时间重叠
+            charts = loop.run_in_executor(pool, _render_charts, payload) if self.pdf and self.charts else None
+            try:
+                stage = "llm"
+                t = time.perf_counter()
+                llm_payload = self.compactor(payload) if self.compactor else payload
+                sections = await self.generator.sections(llm_payload)
+                self._write_json(self._path(name, "llm_text"), {"sections": sections})
+                rec["llm_s"] = round(time.perf_counter() - t, 3)
+
+                if not self.pdf:
+                    return rec
+                stage = "pdf"
+                t = time.perf_counter()
+                if charts is not None:
+                    chart_paths, charts = await charts, None
+                    sections = attach_charts(sections, chart_paths)
+            finally:
+                # LLM 失败时图表结果没人要了：没跑完就取消，跑完了取走结果（包括异常），不留悬空的 future
+                if charts is not None:
+                    if charts.done() and not charts.cancelled():
+                        charts.exception()
+                    else:
+                        charts.cancel()
+            rec["pdf"] = await loop.run_in_executor(pool, _render_pdf, sections, self._path(name, "Nielsen_Report"))
+            rec["pdf_s"] = round(time.perf_counter() - t, 3)
+        except Exception as e:
+            rec.update(status="failed", stage=stage, error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+        return rec
+
+    async def _run(self, jobs: list[tuple[str, str | None]]) -> list[dict]:
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.cube_path, self.quality)) as pool:
+            return await asyncio.gather(*(self._job(pool, b, p) for b, p in jobs))
+
+    def run(self, jobs: list[tuple[str, str | None]]) -> dict:
+        os.makedirs(self.out_dir, exist_ok=True)
+        t = time.perf_counter()
+        records = asyncio.run(self._run(jobs))
+        summary = {
+            "jobs": len(records),
+            "ok": sum(r["status"] == "ok" for r in records),
+            "failed": sum(r["status"] == "failed" for r in records),
+            "workers": self.workers,
+            "wall_s": round(time.perf_counter() - t, 3),
+            "records": records,
+        }
+        self._write_json(os.path.join(self.out_dir, "farm_report.json"), summary)
+        return summary
+
+
+def plan_jobs(cube: pd.DataFrame, brands: list[str] | None = None, by_province: bool = False) -> list:
+    """
+    [(brand, province|None)]；by_province=True 时只生成立方体里实际有数据的品牌 x 省份组合
+    """
+    brands = brands or cube["brand"].dropna().unique().tolist()
+    if not by_province:
+        return [(b, None) for b in brands]
+    sub = cube[cube["brand"].isin(brands) & (cube["province"].astype(str).str.len() > 0)]
+    pairs = sub[["brand", "province"]].dropna().drop_duplicates()
+    return [(b, p) for b, p in pairs.itertuples(index=False)]
+
+
+def _print_summary(summary: dict) -> None:
+    for r in summary["records"]:
+        if r["status"] == "ok":
+            stages = " ".join(f"{k[:-2]}={r[k]:.2f}s" for k in ("payload_s", "llm_s", "pdf_s") if k in r)
+            print(f"  ✅ {r['job']}: {stages}")
+        else:
+            print(f"  ❌ {r['job']}（{r['stage']}）：{r['error']}")
+    print(f"完成 {summary['ok']}/{summary['jobs']}，失败 {summary['failed']}，"
+          f"{summary['workers']} 进程，总耗时 {summary['wall_s']:.1f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="全品牌并行生成报告（payload / LLM / PDF）")
+    parser.add_argument("--brands", nargs="*", default=None, help="只跑这些品牌（默认全部）")
+    parser.add_argument("--by-province", action="store_true", help="按 品牌 x 省份 拆分任务")
+    parser.add_argument("--data", default=None, help="清洗后的数据（默认列式存储，没有则 CSV）")
+    parser.add_argument("--cube", default="data/clean/nielsen_cube.parquet")
+    parser.add_argument("--out", default=OUT_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时在途的 LLM 请求数")
+    parser.add_argument("--token-budget", type=int, default=6000, help="payload 压缩预算；0 表示不压缩")
+    parser.add_argument("--no-llm", action="store_true", help="只生成 payload")
+    parser.add_argument("--narrative", default="llm", choices=["llm", "rules", "draft"],
+                        help="正文来源：llm / rules 规则模板（不调用 LLM）/ draft 模板初稿 + LLM 润色")
+    parser.add_argument("--no-fallback", action="store_true", help="LLM 失败时任务直接失败，不回退到规则模板")
+    parser.add_argument("--no-pdf", action="store_true", help="不渲染 PDF")
+    parser.add_argument("--no-charts", action="store_true", help="PDF 里不放图表")
+    parser.add_argument("--engine", default=None, choices=["pandas", "duckdb"], help="分析引擎（默认 REPORT_ENGINE 或 pandas）")
+    args = parser.parse_args()
+    if args.engine:
+        os.environ["REPORT_ENGINE"] = args.engine  # 工作进程继承环境变量
+
+    store = "data/clean/nielsen_store"
+    data = args.data or (store if os.path.isdir(store) else "data/clean/nielsen_clean.csv")
+    cube, _ = refresh_cube(data, args.cube)  # 立方体落盘后，工作进程各自读取
+
+    farm = ReportFarm(
+        args.cube,
+        out_dir=args.out,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        token_budget=args.token_budget or None,
+        llm=not args.no_llm,
+        pdf=not args.no_pdf,
+        charts=not args.no_charts,
+        narrative=args.narrative,
+        fallback=not args.no_fallback,
+        quality=read_quality_report(data),
+    )
+    summary = farm.run(plan_jobs(cube, args.brands, args.by_province))
+    _print_summary(summary)
+    raise SystemExit(1 if summary["failed"] else 0)
@@ -0,0 +1,435 @@
+# report_server.py
+"""
+常驻报告服务：数据 -> 立方体 -> 聚合表只在启动（和数据更新）时算一次，常驻内存；
+之后的请求只做按品牌派生（毫秒级），PDF 渲染进程常驻（字体只注册一次）
+
+  python report_server.py --port 8800 [--engine duckdb] [--workers 2]
+
+  GET  /health                           数据版本、加载时间、品牌数
+  GET  /brands
+  GET  /payload?brand=X[&period=FY2026Q1][&window=mat]
+                                         payload（period 缺省为最新财季；window 见 analysis.WINDOWS，缺省为财季同比）
+  GET  /all[?period=FY2026Q1][&window=...] 全部品牌的 payload
+  GET  /pdf?brand=X[&period=...][&window=...]
+                                         payload -> LLM 分层文本 -> 图表 -> PDF，返回 PDF 文件
+  POST /jobs                             批量任务，请求体为 JSONL（或 JSON 数组），一行一个任务：
+                                           {"kind": "payload" | "pdf", "brand": "X", "period": "FY2026Q1", "window": "mat", "id": ...}
+                                           {"kind": "all", "period": ...}  展开成全部品牌
+                                         任务并发执行，结果文件写到 --out（文件名带品牌 / 周期 / 窗口），返回每个任务的记录
+  POST /reload                           立即重新加载
+
+后台线程每 --watch 秒检查一次数据（列式存储的逐月清单 / CSV 的修改时间），变了（且已写完）就用
+analysis.refresh_cube 增量更新立方体、重建聚合表；新旧数据整体切换，进行中的请求不受影响
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+from analysis import STORE_MANIFEST, aggregates_from_cube, insight_from_aggregates, refresh_cube
+from quality import read_quality_report
+from charts import attach_charts
+from compact import PayloadCompactor
+from llm_async import SectionGenerator
+from report_farm import _render_charts, _render_pdf, job_name, safe_name
+
+OUT_DIR = "outputs/server"
+
+
+class JobError(ValueError):
+    """请求参数有误（HTTP 400）"""
+
+
+def data_stamp(data_path: str):
+    """
+    数据是否变化的指纹：列式存储看逐月清单，没有清单就看各文件的修改时间；CSV 看修改时间
+    """
+    if os.path.isdir(data_path):
+        manifest = os.path.join(data_path, STORE_MANIFEST)
+        if os.path.exists(manifest):
+            return os.stat(manifest).st_mtime_ns
+        return max((os.stat(os.path.join(d, f)).st_mtime_ns for d, _, fs in os.walk(data_path) for f in fs), default=0)
+    return os.stat(data_path).st_mtime_ns if os.path.exists(data_path) else None
+
+
+class Snapshot:
+    """
+    某一版数据的全部常驻状态（只读）；payload 按 (品牌, 财季) 缓存在这一版上
+    """
+
+    def __init__(self, cube, version: int, changed, quality: dict | None = None):
+        self.version = version
+        self.loaded_at = time.time()
+        self.changed = changed
+        self.cube_rows = len(cube)
+        self.aggs = aggregates_from_cube(cube, quality=quality)
+        self.by_brand = self.aggs.split_by_brand()
+        self.brands = self.aggs.brands()
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def payload(self, brand: str, period: str | None = None, window: str | None = None) -> dict:
+        key = (brand, period, window)
+        hit = self._payloads.get(key)
+        if hit is not None:
+            return hit
+        if brand not in self.by_brand:
+            raise JobError(f"没有这个品牌：{brand}")
+        aggs = self.by_brand[brand]
+        if period:
+            try:
+                aggs = aggs.as_of(period)
+            except (ValueError, IndexError) as e:
+                raise JobError(f"财季格式应为 FY2026Q1：{period}") from e
+        try:
+            payload = insight_from_aggregates(aggs, brand, window=window)
+        except ValueError as e:
+            raise JobError(str(e)) from e
+        with self._lock:
+            self._payloads[key] = payload
+        return payload
+
+
+class WarmData:
+    """
+    持有当前 Snapshot；reload 在锁内构建新版本后整体替换
+    """
+
+    def __init__(self, data_path: str, cube_path: str, engine=None):
+        self.data_path = data_path
+        self.cube_path = cube_path
+        self.engine = engine
+        self.snapshot: Snapshot | None = None
+        self.stamp = None
+        self._lock = threading.Lock()
+
+    def reload(self, force: bool = False) -> bool:
+        with self._lock:
+            stamp = data_stamp(self.data_path)
+            if not force and self.snapshot is not None and stamp == self.stamp:
+                return False
+            t = time.perf_counter()
+            # 没有逐月清单的列式存储：refresh_cube 只能看目录时间，文件被改写时察觉不到，直接重建
+            rebuild = (self.snapshot is not None and os.path.isdir(self.data_path)
+                       and not os.path.exists(os.path.join(self.data_path, STORE_MANIFEST)))
+            cube, changed = refresh_cube(self.data_path, self.cube_path, rebuild=rebuild, engine=self.engine)
+            version = self.snapshot.version + 1 if self.snapshot else 1
+            self.snapshot = Snapshot(cube, version, changed, read_quality_report(self.data_path))
+            self.stamp = stamp
+            print(f"✅ 数据 v{version}：立方体 {len(cube):,} 行，{len(self.snapshot.brands)} 个品牌，"
+                  f"{time.perf_counter() - t:.2f}s（变化月份：{'全量' if changed is None else len(changed)}）")
+            return True
+
+    def watch(self, interval: float, stop: threading.Event) -> None:
+        """
+        指纹变化后要连续两次检查都不再变才重新加载：避免读到正在写入的文件
+        """
+        pending = None
+        while not stop.wait(interval):
+            try:
+                stamp = data_stamp(self.data_path)
+                if stamp == self.stamp:
+                    pending = None
+                elif stamp != pending:
+                    pending = stamp
+                else:
+                    self.reload()
+            except Exception:
+                traceback.print_exc()  # 保留旧版本，下一轮再试
+
+
+class ReportService:
+    """
+    payload 在请求线程里直接派生；PDF 任务交给常驻事件循环（LLM 并发）+ 常驻进程池（图表 / PDF）
+    """
+
+    def __init__(
+        self,
+        data: WarmData,
+        out_dir: str = OUT_DIR,
+        workers: int = 1,
+        concurrency: int = 8,
+        token_budget: int | None = 6000,
+        charts: bool = True,
+        narrative: str = "llm",
+        fallback: bool = True,
+    ):
+        self.data = data
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.workers = workers
+        self.charts = charts
+        self.compactor = PayloadCompactor(token_budget=token_budget) if token_budget else None
+        self.generator = SectionGenerator(concurrency=concurrency, narrative=narrative, fallback=fallback)
+        self._pool = None
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="report-loop", daemon=True).start()
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:  # 第一次出 PDF 时才拉起渲染进程；本进程有多个线程，不能 fork
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _write_json(self, path: str, obj) -> str:
+        tmp = _tmp_path(path)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        return path
+
+    def _out(self, name: str, kind: str) -> str:
+        ext = "pdf" if kind == "Nielsen_Report" else "json"
+        return os.path.join(self.out_dir, f"{kind}_{name}.{ext}")
+
+    # ---------- 任务 ----------
+
+    async def _pdf(self, snap: Snapshot, brand: str, period: str | None, window: str | None = None) -> tuple[str, dict]:
+        loop = asyncio.get_running_loop()
+        payload = await asyncio.to_thread(snap.payload, brand, period, window)  # 不占住事件循环（别的任务在等 LLM）
+        charts = loop.run_in_executor(self.pool, _render_charts, payload) if self.charts else None
+        sections = await self.generator.sections(self.compactor(payload) if self.compactor else payload)
+        if charts is not None:
+            sections = attach_charts(sections, await charts)
+        path = self._out(_output_name(brand, period, window), "Nielsen_Report")
+        # 同一品牌 / 周期 / 窗口的并发请求各写各的临时文件，写完整体替换，读到的总是完整的 PDF
+        tmp = await loop.run_in_executor(self.pool, _render_pdf, sections, _tmp_path(path))
+        os.replace(tmp, path)
+        return path, payload
+
+    async def _job(self, snap: Snapshot, job: dict) -> dict:
+        kind, brand, period, window = job.get("kind", "payload"), job.get("brand"), job.get("period"), job.get("window")
+        rec = {k: v for k, v in job.items() if k in ("id", "kind", "brand", "period", "window")}
+        rec["status"] = "ok"
+        t = time.perf_counter()
+        try:
+            if kind not in ("payload", "pdf"):
+                raise JobError(f"未知的任务类型：{kind}")
+            if not brand:
+                raise JobError("缺少 brand")
+            if kind == "payload":
+                payload = await asyncio.to_thread(snap.payload, brand, period, window)
+                rec["payload"] = self._write_json(self._out(_output_name(brand, period, window), "insight_payload"), payload)
+            else:
+                rec["pdf"], _ = await self._pdf(snap, brand, period, window)
+        except Exception as e:
+            rec.update(status="failed", error=f"{type(e).__name__}: {e}")
+        rec["s"] = round(time.perf_counter() - t, 4)
+        return rec
+
+    async def _batch(self, snap: Snapshot, jobs: list[dict]) -> list[dict]:
+        return await asyncio.gather(*(self._job(snap, j) for j in jobs))
+
+    def run_jobs(self, jobs: list[dict]) -> dict:
+        """
+        一批任务在同一版数据上并发执行；{"kind": "all"} 展开成全部品牌的 payload 任务
+        """
+        snap = self.data.snapshot
+        expanded = []
+        for j in jobs:
+            if j.get("kind") == "all":
+                expanded += [{**j, "kind": j.get("each", "payload"), "brand": b} for b in snap.brands]
+            else:
+                expanded.append(j)
+        t = time.perf_counter()
+        records = asyncio.run_coroutine_threadsafe(self._batch(snap, expanded), self._loop).result()
+        return {
+            "version": snap.version,
+            "jobs": len(records),
+            "ok": sum(r["status"] == "ok" for r in records),
+            "failed": sum(r["status"] == "failed" for r in records),
+            "wall_s": round(time.perf_counter() - t, 3),
+            "records": records,
+        }
+
+    def pdf(self, brand: str, period: str | None, window: str | None = None) -> str:
+        snap = self.data.snapshot
+        if brand not in snap.by_brand:
+            raise JobError(f"没有这个品牌：{brand}")
+        return asyncio.run_coroutine_threadsafe(self._pdf(snap, brand, period, window), self._loop).result()[0]
+
+
+def _output_name(brand: str, period: str | None, window: str | None) -> str:
+    # 不同窗口的结果是不同的报告，文件名里要带上窗口
+    name = job_name(brand, period)
+    window = (window or "").strip().lower()
+    return f"{name}__{safe_name(window)}" if window else name
+
+
+def _tmp_path(path: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+
+
+def parse_jobs(body: bytes) -> list[dict]:
+    text = body.decode("utf-8").strip()
+    if not text:
+        return []
+    try:
+        if text.startswith("["):
+            jobs = json.loads(text)
+        else:
+            jobs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    except json.JSONDecodeError as e:
+        raise JobError(f"任务不是合法的 JSON / JSONL：{e}") from e
+    if not all(isinstance(j, dict) for j in jobs):
+        raise JobError("每个任务应为 JSON 对象")
+    return jobs
+
+
+def make_handler(service: ReportService):
+    data = service.data
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):  # 默认写 stderr 且每个请求一行，太吵
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str, headers: dict | None = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, obj, status: int = 200) -> None:
+            body = json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+            self._send(status, body, "application/json; charset=utf-8")
+
+        def _dispatch(self, fn) -> None:
+            try:
+                fn()
+            except JobError as e:
+                self._json({"error": str(e)}, 400)
+            except Exception as e:
+                traceback.print_exc()
+                self._json({"error": f"{type(e).__name__}: {e}"}, 500)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            snap = data.snapshot
+
+            def handle():
+                if url.path == "/health":
+                    self._json({"status": "ok", "version": snap.version, "loaded_at": snap.loaded_at,
+                                "cube_rows": snap.cube_rows, "brands": len(snap.brands), "data": data.data_path})
+                elif url.path == "/brands":
+                    self._json(snap.brands)
+                elif url.path == "/payload":
+                    if "brand" not in q:
+                        raise JobError("缺少 brand")
+                    self._json(snap.payload(q["brand"], q.get("period"), q.get("window")))
+                elif url.path == "/all":
+                    self._json({b: snap.payload(b, q.get("period"), q.get("window")) for b in snap.brands})
+                elif url.path == "/pdf":
+                    if "brand" not in q:
+                        raise JobError("缺少 brand")
+                    path = service.pdf(q["brand"], q.get("period"), q.get("window"))
+                    with open(path, "rb") as f:
+                        self._send(200, f.read(), "application/pdf",
+                                   {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}"})
+                else:
+                    self._json({"error": f"未知路径：{url.path}"}, 404)
+
+            self._dispatch(handle)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def handle():
+                if url.path == "/jobs":
+                    self._json(service.run_jobs(parse_jobs(body)))
+                elif url.path == "/reload":
+                    data.reload(force=True)
+                    self._json({"status": "ok", "version": data.snapshot.version})
+                else:
+                    self._json({"error": f"未知路径：{url.path}"}, 404)
+
+            self._dispatch(handle)
+
+    return Handler
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8800,
+    data_path: str | None = None,
+    cube_path: str = "data/clean/nielsen_cube.parquet",
+    watch: float = 2.0,
+    **service_kwargs,
+) -> None:
+    store = "data/clean/nielsen_store"
+    data_path = data_path or (store if os.path.isdir(store) else "data/clean/nielsen_clean.csv")
+    data = WarmData(data_path, cube_path)
+    data.reload(force=True)
+    service = ReportService(data, **service_kwargs)
+    stop = threading.Event()
+    if watch > 0:
+        threading.Thread(target=data.watch, args=(watch, stop), name="data-watch", daemon=True).start()
+
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f"🚀 http://{host}:{server.server_address[1]}  （数据：{data_path}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="常驻报告服务（数据和聚合常驻内存）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--data", default=None, help="清洗后的数据（默认列式存储，没有则 CSV）")
+    parser.add_argument("--cube", default="data/clean/nielsen_cube.parquet")
+    parser.add_argument("--engine", default=None, choices=["pandas", "duckdb"], help="分析引擎（默认 REPORT_ENGINE 或 pandas）")
+    parser.add_argument("--watch", type=float, default=2.0, help="检查数据更新的间隔秒数；0 表示不检查")
+    parser.add_argument("--out", default=OUT_DIR)
+    parser.add_argument("--workers", type=int, default=1, help="图表 / PDF 渲染进程数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时在途的 LLM 请求数")
+    parser.add_argument("--token-budget", type=int, default=6000, help="payload 压缩预算；0 表示不压缩")
+    parser.add_argument("--no-charts", action="store_true", help="PDF 里不放图表")
+    parser.add_argument("--narrative", default="llm", choices=["llm", "rules", "draft"],
+                        help="正文来源：llm / rules 规则模板（不调用 LLM）/ draft 模板初稿 + LLM 润色")
+    parser.add_argument("--no-fallback", action="store_true", help="LLM 失败时任务直接失败，不回退到规则模板")
+    args = parser.parse_args()
+    if args.engine:
+        os.environ["REPORT_ENGINE"] = args.engine
+
+    serve(
+        args.host,
+        args.port,
+        args.data,
+        args.cube,
+        watch=args.watch,
+        out_dir=args.out,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        token_budget=args.token_budget or None,
+        charts=not args.no_charts,
+        narrative=args.narrative,
+        fallback=not args.no_fallback,
+    )
@@ -1,44 +1,338 @@
 # run_report.py
-import os, json
-import pandas as pd
-from analysis import build_insight
-from llm import generate_text
-from report import create_pdf
+"""
+报告流水线命令行（每个子命令只导入自己用到的重依赖）：
+  python run_report.py                   # = all：analyze -> generate -> render（输入没变就沿用已有 PDF）
+  python run_report.py ingest data/raw/nielsen.xlsx --incremental   # Excel -> 列式存储（参数同 scripts/excel_to_csv.py）
+  python run_report.py analyze           # 立方体 + payload -> outputs/insight_payload.json（pandas）
+  python run_report.py generate          # payload -> LLM 文本 -> outputs/llm_text.json（openai；缓存全命中时不建客户端）
+  python run_report.py render            # 已生成的文本 + 图表 -> PDF（reportlab / matplotlib；不导入 pandas / openai）
+其余配置仍走环境变量（REPORT_BRAND / REPORT_LLM_MODE / REPORT_ALL_BRANDS ...），--brand 可覆盖 REPORT_BRAND，
+--engine 可覆盖 REPORT_ENGINE（明细扫描/上卷用 pandas 还是内嵌 DuckDB，见 engine.py），
+--no-llm 等同 REPORT_LLM_MODE=rules（规则模板直接出正文，见 narrative.py），
+--window 可覆盖 REPORT_WINDOW（总览/下钻的对比窗口：fq / mat / ytd / r3m / 2025-03:2025-08，见 analysis.window_months）
+"""
+import os, sys, json, hashlib, atexit
 
-USE_CACHE = False
+from llm_cache import canonical_json
+from profiling import TRACE_PATH, dump, span
+
+# LLM 缓存按 (payload, 提示词模板, 模型, temperature) 内容寻址，见 llm_cache.py
+# REPORT_LLM_CACHE=off：完全绕过缓存；=refresh：强制重新生成并覆盖缓存
+LLM_CACHE_MODE = os.getenv("REPORT_LLM_CACHE", "on")
 os.makedirs("outputs", exist_ok=True)
-CACHE_PATH = "outputs/llm_text.json"
+LLM_TEXT_PATH = "outputs/llm_text.json"
+PAYLOAD_PATH = "outputs/insight_payload.json"
+# REPORT_LLM_MODE=sections：四个分析层并发生成（默认，见 llm_async.py）；=single：整篇一次生成；
+# =rules：不调用 LLM，规则模板直接出正文（narrative.py，毫秒级）
+LLM_MODE = os.getenv("REPORT_LLM_MODE", "sections")
+# REPORT_LLM_DRAFT=1：分层模式下先用规则模板写初稿，LLM 只负责润色（提示词只带初稿和关键数字）
+LLM_DRAFT = os.getenv("REPORT_LLM_DRAFT", "") == "1"
+# LLM 失败（重试用尽 / 超时 / 额度不足）时回退到规则模板；REPORT_LLM_FALLBACK=0 则直接报错
+LLM_FALLBACK = os.getenv("REPORT_LLM_FALLBACK", "1") != "0"
+# 本次 generate 是否有分层回退到了模板：回退的结果不记入清单，下次运行会再试 LLM
+FALLBACK_USED = False
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+# 发给 LLM 前的 payload 压缩（见 compact.py）；REPORT_TOKEN_BUDGET=0 表示不压缩
+TOKEN_BUDGET = int(os.getenv("REPORT_TOKEN_BUDGET", "6000"))
+LLM_OPTIONS = {"use_cache": LLM_CACHE_MODE != "off", "refresh": LLM_CACHE_MODE == "refresh"}
+
+def _window(value: str | None) -> str | None:
+    # 与 payload 里记录的窗口名同一写法（analysis 里统一 strip + lower），增量判断才能直接比较
+    value = (value or "").strip().lower()
+    return value or None
+
+# 对比窗口（见 analysis.WINDOWS）：为空 = 最新财季 vs 去年同季
+WINDOW = _window(os.getenv("REPORT_WINDOW"))
 
 # 你想分析的品牌（按你 Excel 里的品牌名称精确填写）
 BRAND = os.getenv("REPORT_BRAND", "外星人电解质水")  # 可在命令行设置 REPORT_BRAND 来切换
+# REPORT_ALL_BRANDS=1：一次聚合输出全部品牌的 payload（不生成 PDF；全品牌并行出 PDF 用 report_farm.py）
+# 再加 REPORT_ALL_BRANDS_LLM=1：全部品牌 x 四个分析层并发生成文本
+ALL_BRANDS = os.getenv("REPORT_ALL_BRANDS", "") == "1"
+ALL_BRANDS_LLM = os.getenv("REPORT_ALL_BRANDS_LLM", "") == "1"
+ALL_PAYLOADS_PATH = "outputs/insight_payloads.json"
+ALL_SECTIONS_PATH = "outputs/llm_sections.json"
+PDF_PATH = "outputs/Nielsen_Report.pdf"
+# 图表（见 charts.py）：REPORT_CHARTS=0 关闭；REPORT_CHART_WORKERS>1 时未命中缓存的图并行渲染
+CHARTS = os.getenv("REPORT_CHARTS", "1") != "0"
+CHART_WORKERS = int(os.getenv("REPORT_CHART_WORKERS", "1"))
+
+# 增量刷新（默认开启）：立方体只重算新增/重述的月份；payload 指纹没变的品牌不再重新生成文本和 PDF
+# REPORT_INCREMENTAL=0 强制全部重新生成
+INCREMENTAL = os.getenv("REPORT_INCREMENTAL", "1") != "0"
+MANIFEST_PATH = "outputs/report_manifest.json"
+
+# ✅ 改这里：读清洗后的数据（优先列式存储，没有则回退 CSV）
+STORE_PATH = "data/clean/nielsen_store"
+DATA_PATH = os.getenv("REPORT_DATA") or (STORE_PATH if os.path.isdir(STORE_PATH) else "data/clean/nielsen_clean.csv")
+# 预聚合立方体：首次（或源数据更新后）从明细构建并落盘，之后所有品牌/周期查询只读立方体
+CUBE_PATH = os.getenv("REPORT_CUBE", "data/clean/nielsen_cube.parquet")
+
+def payload_digest(payload: dict) -> str:
+    # 文本/PDF 的输入 = payload + 生成方式（模式、模型、提示词、温度）；任一变化都要重新生成
+    mode = LLM_MODE + ("+draft" if _narrative() == "draft" else "")
+    llm_inputs = None
+    if LLM_MODE != "rules":
+        from llm import DEFAULT_MODEL, PROMPT_DATA, PROMPT_DRAFT, PROMPT_HEADER, SECTION_PROMPTS, TEMPERATURE
+        llm_inputs = [DEFAULT_MODEL, TEMPERATURE, PROMPT_HEADER, SECTION_PROMPTS, PROMPT_DRAFT, PROMPT_DATA]
+    return hashlib.sha256(canonical_json([payload, mode, llm_inputs, TOKEN_BUDGET, CHARTS]).encode("utf-8")).hexdigest()
+
+def _narrative() -> str:
+    # 分层生成器的正文来源，见 llm_async.SectionGenerator
+    return "rules" if LLM_MODE == "rules" else "draft" if LLM_DRAFT else "llm"
+
+def load_json(path: str, default):
+    if not (INCREMENTAL and os.path.exists(path)):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def read_json(path: str, what: str):
+    # 单独跑 generate / render 时读上一步的输出（与 INCREMENTAL 无关）
+    if not os.path.exists(path):
+        raise SystemExit(f"❌ 找不到{what}：{path}，先运行上一步")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_json(path: str, obj) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
 
 def to_sections(report_text: str):
     # MVP：先把 LLM 文本整体放进 PDF
     return [("执行摘要", report_text or "")]
 
-# ✅ 改这里：读清洗后的数据
-df = pd.read_csv("data/clean/nielsen_clean.csv")
+def load_manifest() -> dict:
+    return load_json(MANIFEST_PATH, {"payloads": {}, "pdfs": {}})
+
+def get_compactor():
+    from compact import PayloadCompactor
+
+    return PayloadCompactor(token_budget=TOKEN_BUDGET) if TOKEN_BUDGET > 0 else None
+
+def ingest(argv: list[str]) -> None:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+    from excel_to_csv import cli
+
+    cli(argv)
+
+def refresh():
+    from analysis import refresh_cube
+
+    with span("cube") as st:
+        cube, changed_months = refresh_cube(DATA_PATH, CUBE_PATH)
+        st["rows_out"] = len(cube)
+    if changed_months:
+        print(f"✅ 立方体增量更新：{len(changed_months)} 个月份（{changed_months[0]} ~ {changed_months[-1]}）")
+    return cube, changed_months
+
+def analyze_all(cube, changed_months) -> dict:
+    from analysis import brands_in_months, insight_many_from_cube
+    from quality import read_quality_report
+
+    payloads = load_json(ALL_PAYLOADS_PATH, {})
+    all_brands = cube["brand"].dropna().unique().tolist()
+    if changed_months is None or not payloads or any((p.get("window") or {}).get("name") != WINDOW for p in payloads.values()):
+        todo = all_brands  # 换了对比窗口，旧 payload 全部作废
+    else:
+        # 只有变动月份里出现过的品牌（以及上次没有的品牌）需要重算 payload
+        todo = sorted(set(brands_in_months(cube, changed_months)) | (set(all_brands) - set(payloads)))
+    with span("payload", brands=len(todo)):
+        payloads.update(insight_many_from_cube(cube, todo, window=WINDOW, quality=read_quality_report(DATA_PATH)))
+    save_json(ALL_PAYLOADS_PATH, payloads)
+    print(f"✅ 全品牌 payload 生成完成：{ALL_PAYLOADS_PATH}（{len(payloads)} 个品牌，本次重算 {len(todo)} 个）")
+    return payloads
+
+def generate_all(payloads: dict) -> None:
+    import asyncio
+
+    from llm_async import SectionGenerator
+
+    manifest = load_manifest()
+    compactor = get_compactor()
+    all_sections = load_json(ALL_SECTIONS_PATH, {})
+    digests = {b: payload_digest(p) for b, p in payloads.items()}
+    stale = {b: p for b, p in payloads.items() if manifest["payloads"].get(b) != digests[b] or b not in all_sections}
+    llm_payloads = {b: compactor(p) for b, p in stale.items()} if compactor else stale
+    with span("llm", brands=len(llm_payloads)):
+        generator = SectionGenerator(concurrency=LLM_CONCURRENCY, **LLM_OPTIONS,
+                                     narrative=_narrative(), fallback=LLM_FALLBACK)
+        all_sections.update(asyncio.run(generator.sections_many(llm_payloads)))
+    save_json(ALL_SECTIONS_PATH, all_sections)
+    # 有分层回退到模板的品牌不记指纹，下次再试 LLM
+    manifest["payloads"].update({b: digests[b] for b in stale if b not in generator.fallback_brands})
+    save_json(MANIFEST_PATH, manifest)
+    print(f"✅ 全品牌 LLM 文本生成完成：{ALL_SECTIONS_PATH}（本次生成 {len(stale)} 个品牌）")
+
+def analyze(cube=None) -> dict:
+    from analysis import insight_from_cube
+    from quality import read_quality_report
+
+    if cube is None:
+        cube, _ = refresh()
+    # ✅ 改这里：新版 analysis.py 返回结构化 payload（给 LLM 用）
+    # 所有聚合都按 brand 分组，只取立方体里本品牌的切片
+    with span("payload"):
+        payload = insight_from_cube(cube, brand=BRAND, window=WINDOW, quality=read_quality_report(DATA_PATH))
+
+    # 可选：把 payload 也落盘，方便你调试（不耗 token）
+    save_json(PAYLOAD_PATH, payload)
+    return payload
+
+def generate(payload: dict | None = None) -> list:
+    global FALLBACK_USED
+    if payload is None:
+        payload = read_json(PAYLOAD_PATH, " payload")
+    if LLM_MODE == "rules":
+        from narrative import narrative_sections
+
+        with span("llm", mode=LLM_MODE):
+            sections = narrative_sections(payload)
+        print("✅ 规则模板正文（未调用 LLM）")
+        return _save_sections(sections, payload)
+
+    from llm import generate_text, get_cache  # openai 客户端第一次真正调用 LLM 时才创建
+
+    llm_payload = payload
+    compactor = get_compactor()
+    if compactor:
+        with span("compact"):
+            llm_payload = compactor(payload)
+        r = compactor.last_report
+        print(f"payload 压缩：约 {r['tokens_before']:,} -> {r['tokens_after']:,} tokens（-{r['saved_pct']}%，预算 {r['token_budget']:,}）")
+
+    with span("llm", mode=LLM_MODE):
+        if LLM_MODE == "single":
+            try:
+                report_text = generate_text(llm_payload, **LLM_OPTIONS)
+                sections = to_sections(report_text)
+            except Exception as e:
+                if not LLM_FALLBACK:
+                    raise
+                from narrative import narrative_sections
+
+                print(f"⚠️ LLM 调用失败（{type(e).__name__}: {e}），改用规则模板正文")
+                sections = narrative_sections(payload)
+                report_text = _join_sections(sections)
+                FALLBACK_USED = True
+        else:
+            import asyncio
+
+            from llm_async import SectionGenerator
+
+            generator = SectionGenerator(concurrency=LLM_CONCURRENCY, **LLM_OPTIONS,
+                                         narrative=_narrative(), fallback=LLM_FALLBACK)
+            sections = asyncio.run(generator.sections(llm_payload))
+            report_text = _join_sections(sections)
+            if generator.stats["fallbacks"]:
+                FALLBACK_USED = True
+                print(f"⚠️ {generator.stats['fallbacks']} 个分析层 LLM 调用失败，已改用规则模板正文")
+    stats = get_cache().stats
+    if stats["hits"] and not stats["misses"]:
+        print("✅ 使用缓存的 LLM 文本")
+    else:
+        print("✅ LLM 原始输出如下：\n")
+        print(report_text)  # 你要的 print（调试用）
+    print(f"LLM 缓存：hits={stats['hits']} misses={stats['misses']} writes={stats['writes']} evictions={stats['evictions']}")
+    return _save_sections(sections, payload, report_text)
+
+def _join_sections(sections: list) -> str:
+    return "\n\n".join(f"{title}\n{body}" for title, body in sections)
+
+def _save_sections(sections: list, payload: dict, report_text: str | None = None) -> list:
+    # sections 和 payload 指纹一起落盘，render 可以单独重跑
+    report_text = _join_sections(sections) if report_text is None else report_text
+    save_json(LLM_TEXT_PATH, {"report_text": report_text, "sections": sections, "digest": None if FALLBACK_USED else payload_digest(payload)})
+    return sections
+
+def render(sections: list | None = None, payload: dict | None = None, digest: str | None = None) -> None:
+    from report import create_pdf
+
+    if sections is None:
+        text = read_json(LLM_TEXT_PATH, " LLM 文本")
+        sections = [tuple(s) for s in text.get("sections") or to_sections(text.get("report_text"))]
+        digest = text.get("digest")
+    if CHARTS:
+        from charts import attach_charts, render_charts
+
+        if payload is None:
+            payload = read_json(PAYLOAD_PATH, " payload")
+        with span("charts", workers=CHART_WORKERS):
+            sections = attach_charts(sections, render_charts([payload], workers=CHART_WORKERS)[0])
+    with span("pdf", sections=len(sections)) as st:
+        st["pages"] = create_pdf(sections, out_path=PDF_PATH)
+    if digest:
+        manifest = load_manifest()
+        manifest["pdfs"][PDF_PATH] = digest
+        save_json(MANIFEST_PATH, manifest)
+    print(f"✅ PDF 生成完成：{PDF_PATH}")
+
+def run_all() -> None:
+    cube, changed_months = refresh()
+    if ALL_BRANDS:
+        payloads = analyze_all(cube, changed_months)
+        if ALL_BRANDS_LLM:
+            generate_all(payloads)
+        return
+
+    payload = analyze(cube)
+    digest = payload_digest(payload)
+    manifest = load_manifest()
+    if manifest["pdfs"].get(PDF_PATH) == digest and os.path.exists(PDF_PATH):
+        print(f"✅ {BRAND} 的输入没有变化，沿用已有 PDF：{PDF_PATH}")
+        return
+
+    sections = generate(payload)
+    if FALLBACK_USED:
+        render(sections, payload)  # 不记指纹：下次运行重新尝试 LLM
+        return
+    render(sections, payload, digest)
+    manifest = load_manifest()
+    manifest["payloads"][BRAND] = digest
+    save_json(MANIFEST_PATH, manifest)
+    print("✅ 本次分析品牌：", BRAND)
 
-# ✅ 改这里：新版 analysis.py 返回结构化 payload（给 LLM 用）
-payload = build_insight(df, brand=BRAND)
+def main(argv: list[str] | None = None) -> None:
+    import argparse
 
-# 可选：把 payload 也落盘，方便你调试（不耗 token）
-with open("outputs/insight_payload.json", "w", encoding="utf-8") as f:
-    json.dump(payload, f, ensure_ascii=False, indent=2)
+    global BRAND, WINDOW, LLM_MODE
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["ingest"]:
+        return ingest(argv[1:])  # 参数原样转给 scripts/excel_to_csv.py
 
-if USE_CACHE and os.path.exists(CACHE_PATH):
-    with open(CACHE_PATH, "r", encoding="utf-8") as f:
-        report_text = json.load(f)["report_text"]
-    print("✅ 使用缓存的 LLM 文本")
-else:
-    report_text = generate_text(payload)
-    print("✅ LLM 原始输出如下：\n")
-    print(report_text)  # 你要的 print（调试用）
-    with open(CACHE_PATH, "w", encoding="utf-8") as f:
-        json.dump({"report_text": report_text}, f, ensure_ascii=False, indent=2)
+    parser = argparse.ArgumentParser(description="尼尔森报告流水线")
+    parser.add_argument("command", nargs="?", default="all", choices=["ingest", "analyze", "generate", "render", "all"])
+    parser.add_argument("--brand", default=None, help="覆盖 REPORT_BRAND")
+    parser.add_argument("--engine", default=None, choices=["pandas", "duckdb"], help="覆盖 REPORT_ENGINE")
+    parser.add_argument("--no-llm", action="store_true", help="不调用 LLM，用规则模板生成正文（= REPORT_LLM_MODE=rules）")
+    parser.add_argument("--window", default=None, help="覆盖 REPORT_WINDOW：fq / mat / ytd / r3m / YYYY-MM:YYYY-MM")
+    args = parser.parse_args(argv)
+    BRAND = args.brand or BRAND
+    WINDOW = _window(args.window) or WINDOW
+    if args.no_llm:
+        LLM_MODE = "rules"
+    if args.engine:
+        os.environ["REPORT_ENGINE"] = args.engine
 
-sections = to_sections(report_text)
+    # 分阶段埋点（见 profiling.py）：REPORT_TRACE=1 时把每个阶段的耗时/内存/行数和 LLM 指标写到 outputs/trace.json
+    atexit.register(lambda: dump(TRACE_PATH, command=args.command, brand=BRAND, all_brands=ALL_BRANDS,
+                                 llm_mode=LLM_MODE, data=DATA_PATH, engine=os.getenv("REPORT_ENGINE", "pandas"),
+                                 window=WINDOW))
+    if args.command == "analyze":
+        if ALL_BRANDS:
+            analyze_all(*refresh())
+        else:
+            analyze()
+            print(f"✅ payload：{PAYLOAD_PATH}")
+    elif args.command == "generate":
+        if ALL_BRANDS:
+            generate_all(read_json(ALL_PAYLOADS_PATH, "全品牌 payload"))
+        else:
+            generate()
+    elif args.command == "render":
+        render()
+    else:
+        run_all()
 
-create_pdf(sections, out_path="outputs/Nielsen_Report.pdf")
-print("✅ PDF 生成完成：outputs/Nielsen_Report.pdf")
-print("✅ 本次分析品牌：", BRAND)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# scripts/bench.py
+"""
+流水线基准：合成数据（scripts/synth_data.py）上逐个函数计时 + 内存峰值（tracemalloc）
+  python scripts/bench.py --rows 100000 200000 --repeat 3
+  python scripts/bench.py --rows 1000000 --compare bench_results/20261017-101500.json
+
+结果写到 bench_results/<时间戳>.json；--compare 给出与上一次结果的耗时比值（>1 表示变慢）
+"""
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import analysis  # noqa: E402
+from excel_to_csv import MarketParser, compute_metrics, parse_market  # noqa: E402
+from synth_data import synthetic_frame  # noqa: E402
+
+RESULTS_DIR = "bench_results"
+
+
+def measure(fn, repeat: int = 3) -> dict:
+    """
+    最快一次的耗时 + 单独一次带 tracemalloc 的内存峰值（追踪本身会拖慢，所以分开跑）
+    """
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"best_s": round(min(times), 4), "mean_s": round(sum(times) / len(times), 4), "peak_mb": round(peak / 2**20, 2)}
+
+
+def cases(df: pd.DataFrame) -> dict:
+    """
+    {名称: 无参函数}；前置数据在这里准备好，不计入被测函数的耗时
+    """
+    timed = analysis.add_time_fields(df)
+    with_cat = analysis.build_brand_category(timed)
+    aggs = analysis.build_aggregates(df)
+    brand = aggs.agg_fq["brand"].iloc[0]
+    fy = int(aggs.agg_prov.loc[aggs.agg_prov["brand"] == brand, "fy"].max())
+    markets = df["market_raw"].astype(str)
+    uniques = markets.unique()
+    raw = df.copy()
+
+    out = {
+        "add_time_fields": lambda: analysis.add_time_fields(df),
+        "agg_period[brand,fq]": lambda: analysis.agg_period(with_cat, keys=["brand"], period_key="fq"),
+        "agg_period[brand,province,fq]": lambda: analysis.agg_period(with_cat, keys=["brand", "province"], period_key="fq"),
+        "decompose_share_change[province]": lambda: analysis.decompose_share_change(aggs.agg_prov, "province", brand, fy),
+        "share_decomposition_series[province]": lambda: analysis.share_decomposition_series(aggs.agg_prov, "province"),
+        "build_insight": lambda: analysis.build_insight(df, brand),
+        "parse_market[unique]": lambda: [parse_market(m) for m in uniques],
+        "MarketParser.parse": lambda: MarketParser().parse(markets),
+        "compute_metrics": lambda: compute_metrics(raw.copy()),
+    }
+    try:
+        from report import create_pdf
+
+        payload = analysis.insight_from_aggregates(aggs, brand)
+        body = json.dumps(payload, ensure_ascii=False, indent=1, default=str)
+        sections = [(f"第 {i + 1} 节", body) for i in range(4)]
+        pdf_path = os.path.join(tempfile.mkdtemp(), "bench.pdf")
+        out["create_pdf"] = lambda: create_pdf(sections, out_path=pdf_path)
+    except ImportError:
+        pass  # 没装 reportlab 就跳过
+    return out
+
+
+def run(rows: list[int], repeat: int = 3, only: list[str] | None = None) -> dict:
+    result = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "runs": {},
+    }
+    for n in rows:
+        t = time.perf_counter()
+        df = synthetic_frame(n)
+        print(f"[{n:,} 行] 生成数据 {time.perf_counter() - t:.2f}s")
+        runs = {}
+        for name, fn in cases(df).items():
+            if only and not any(o in name for o in only):
+                continue
+            runs[name] = measure(fn, repeat)
+            r = runs[name]
+            print(f"  {name:<34} {r['best_s']:>9.4f}s  峰值 {r['peak_mb']:>9.2f} MB")
+        result["runs"][str(n)] = runs
+    return result
+
+
+def compare(cur: dict, prev: dict) -> None:
+    print(f"对比 {prev.get('created')}（比值 = 本次 / 上次，>1 表示变慢）")
+    for n, runs in cur["runs"].items():
+        for name, r in runs.items():
+            p = prev.get("runs", {}).get(n, {}).get(name)
+            if p and p["best_s"] > 0:
+                ratio = r["best_s"] / p["best_s"]
+                flag = "  ⚠️" if ratio > 1.2 else ""
+                print(f"  [{int(n):,}] {name:<34} x{ratio:.2f}{flag}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="流水线基准测试（合成数据）")
+    parser.add_argument("--rows", type=int, nargs="*", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="*", default=None, help="只跑名称包含这些子串的用例")
+    parser.add_argument("--out", default=None, help="结果 JSON（默认 bench_results/<时间戳>.json）")
+    parser.add_argument("--compare", default=None, help="与之前的结果 JSON 对比")
+    args = parser.parse_args()
+
+    res = run(args.rows, args.repeat, args.only)
+    out = args.out or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(res, f, ensure_ascii=False, indent=2)
+    print(f"✅ 结果：{out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(res, json.load(f))
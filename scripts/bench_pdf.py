@@ -0,0 +1,63 @@
+# scripts/bench_pdf.py
+"""
+PDF 渲染基准：生成约 20 页的报告，测 页/秒
+  python scripts/bench_pdf.py --pages 20 --repeat 5
+第一次渲染包含字体解析，之后复用同一个 PdfRenderer（进程内缓存）
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from report import get_renderer  # noqa: E402
+
+PARAGRAPH = (
+    "本季度品牌销额同比增长，份额提升主要来自华东和华南的加权铺货率提升；"
+    "单点卖力基本持平，说明增长以铺货驱动为主。现代渠道中超市与便利店表现分化，"
+    "便利店份额同比提升，超市份额小幅下滑，需要关注大卖场客流下降的影响。"
+)
+
+def make_sections(pages: int) -> list:
+    # 每节不到半页正文：段落 + 列表项混排
+    sections = []
+    for i in range(int(pages * 2.3)):
+        body = "\n\n".join([PARAGRAPH * 2, "- 做什么：" + PARAGRAPH, "- 为什么：" + PARAGRAPH, "1）预期影响：" + PARAGRAPH])
+        sections.append((f"第 {i + 1} 节", body))
+    return sections
+
+def bench(pages: int = 20, repeat: int = 5, embed: bool = True) -> dict:
+    sections = make_sections(pages)
+    out = os.path.join(tempfile.mkdtemp(), "bench.pdf")
+
+    t = time.perf_counter()
+    renderer = get_renderer(embed=embed)
+    n = renderer.render(sections, out)
+    first = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for _ in range(repeat):
+        n = renderer.render(sections, out)
+    warm = (time.perf_counter() - t) / repeat
+
+    return {
+        "font": renderer.font_name,
+        "pages": n,
+        "first_s": round(first, 3),
+        "warm_s": round(warm, 3),
+        "pages_per_s": round(n / warm, 1),
+        "file_kb": round(os.path.getsize(out) / 1024, 1),
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-embed", action="store_true", help="用内置 CID 字体（不嵌入字体）")
+    args = parser.parse_args()
+
+    r = bench(args.pages, args.repeat, embed=not args.no_embed)
+    print(f"字体 {r['font']}：{r['pages']} 页，首次 {r['first_s']}s，复用 {r['warm_s']}s/份，"
+          f"{r['pages_per_s']} 页/秒，文件 {r['file_kb']} KB")
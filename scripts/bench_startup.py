@@ -0,0 +1,98 @@
+# scripts/bench_startup.py
+"""
+冷启动基准：每个子命令在全新的解释器里跑，记录墙钟和实际导入了哪些重依赖
+  python scripts/bench_startup.py                          # 只测导入（python run_report.py <子命令> 的模块开销）
+  python scripts/bench_startup.py --run render generate    # 在当前目录真正执行这些子命令（需要已有 outputs/）
+
+eager 一行是旧 run_report.py 的导入集合（所有模块在 import 时一次性加载），作为对照；
+轻量子命令加载了 ALLOWED_HEAVY 以外的重依赖时打印 ❌ 并以退出码 1 结束（防止模块级导入悄悄回归）
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["pandas", "numpy", "pyarrow", "reportlab", "matplotlib", "openai"]
+
+# 子命令实际用到的模块（与 run_report.py 里各函数的延迟导入一致）
+IMPORTS = {
+    "eager": ["analysis", "charts", "compact", "llm", "llm_async", "report"],
+    "analyze": ["analysis"],
+    "generate": ["compact", "llm", "llm_async"],
+    "render": ["report", "charts"],
+    "ingest": ["excel_to_csv"],
+}
+
+# 轻量子命令允许加载的重依赖（没列出的子命令不检查）
+ALLOWED_HEAVY = {
+    "generate": set(),
+    "render": {"reportlab"},
+}
+
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+sys.path[:0] = {paths!r}
+{body}
+print(json.dumps({{"s": time.perf_counter() - t, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def probe(body: str, cwd: str | None = None) -> dict:
+    code = _PROBE.format(paths=[ROOT, os.path.join(ROOT, "scripts")], body=body, heavy=HEAVY)
+    out = subprocess.run([sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit {out.returncode}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(body: str, repeat: int, cwd: str | None = None) -> dict:
+    runs = [probe(body, cwd) for _ in range(repeat)]
+    return {"median_s": round(statistics.median(r["s"] for r in runs), 3), "heavy": runs[-1]["heavy"]}
+
+
+def main(repeat: int = 5, run: list[str] | None = None) -> dict:
+    results = {}
+    base = "import run_report\n"
+    for name, modules in IMPORTS.items():
+        body = base + "".join(f"import {m}\n" for m in modules)
+        results[f"import:{name}"] = measure(body, repeat)
+    for cmd in run or []:
+        body = f"import run_report\ntry:\n    run_report.main([{cmd!r}])\nexcept SystemExit:\n    pass\n"
+        results[f"run:{cmd}"] = measure(body, repeat, cwd=os.getcwd())
+
+    eager = results["import:eager"]["median_s"]
+    for name, r in results.items():
+        ratio = f"{r['median_s'] / eager:.0%}" if eager else "-"
+        print(f"{name:<18} {r['median_s']:>7.3f}s  ({ratio} of eager)  {', '.join(r['heavy']) or '-'}")
+    return results
+
+
+def regressions(results: dict) -> list[str]:
+    out = []
+    for name, allowed in ALLOWED_HEAVY.items():
+        extra = set(results[f"import:{name}"]["heavy"]) - allowed
+        if extra:
+            out.append(f"{name} 加载了 {', '.join(sorted(extra))}")
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="run_report 子命令冷启动耗时")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--run", nargs="*", default=None, help="在当前目录真正执行的子命令")
+    parser.add_argument("--out", default=None, help="结果 JSON")
+    args = parser.parse_args()
+
+    res = main(args.repeat, args.run)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+    problems = regressions(res)
+    for p in problems:
+        print(f"❌ {p}")
+    raise SystemExit(1 if problems else 0)
@@ -0,0 +1,166 @@
+# scripts/check_engine_parity.py
+"""
+分析引擎一致性核对：同一份合成数据（scripts/synth_data.py）分别用 pandas 和 DuckDB 引擎
+构建立方体、生成全部品牌的 payload 和全历史份额拆解，逐项比对；
+另外：
+  - 增量刷新：部分行去掉日期（落在 fy=0 分区，清单月份键为 ""），两个引擎只重建 "" 和最新月份的立方体并比对
+  - 把数据截到季中（最新财季只有 1 个月），核对 window 为空与 window="fq" 的 payload 相同（同比同口径）
+  python scripts/check_engine_parity.py --rows 200000
+  python scripts/check_engine_parity.py --rows 1000000 --source store csv
+
+字符串 / 空值必须完全相同；数值允许 --rtol 的相对误差（默认 1e-9；两个引擎都用 float64 累加，
+只有求和顺序不同，差异在 1e-12 量级）。有差异时打印前几处并以退出码 1 结束
+"""
+import math
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from analysis import (  # noqa: E402
+    CUBE_KEYS,
+    MARKET_LEVELS,
+    SERIES_PERIODS,
+    insight_many_from_cube,
+    month_key,
+    share_history_from_cube,
+    window_months,
+)
+from engine import DuckDBEngine, PandasEngine  # noqa: E402
+from excel_to_csv import month_checksums, to_store_frame, write_store  # noqa: E402
+from synth_data import synthetic_frame  # noqa: E402
+
+
+def diff(a, b, rtol: float, path: str = "", out: list | None = None) -> list:
+    """
+    递归比对两个 JSON 风格的对象，返回 [(路径, a, b), ...]；NaN 与 NaN、None 与 None 视为相同
+    """
+    out = [] if out is None else out
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k in sorted(set(a) | set(b), key=str):
+            diff(a.get(k), b.get(k), rtol, f"{path}.{k}", out)
+    elif isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            out.append((f"{path}[len]", len(a), len(b)))
+        for i, (x, y) in enumerate(zip(a, b)):
+            diff(x, y, rtol, f"{path}[{i}]", out)
+    elif isinstance(a, float) and isinstance(b, float):
+        if math.isnan(a) or math.isnan(b):
+            if not (math.isnan(a) and math.isnan(b)):
+                out.append((path, a, b))
+        elif not math.isclose(a, b, rel_tol=rtol, abs_tol=1e-12):
+            out.append((path, a, b))
+    elif a != b:
+        out.append((path, a, b))
+    return out
+
+
+def frame_records(df) -> list:
+    return df.astype(object).where(df.notna(), float("nan")).to_dict(orient="records")
+
+
+def check(source: str, rtol: float) -> list:
+    engines = {"pandas": PandasEngine(), "duckdb": DuckDBEngine()}
+    results = {}
+    for name, engine in engines.items():
+        t = time.perf_counter()
+        cube = engine.build_cube(source)
+        t_cube = time.perf_counter() - t
+        t = time.perf_counter()
+        payloads = insight_many_from_cube(cube, engine=engine)
+        t_payload = time.perf_counter() - t
+        history = {dim: frame_records(share_history_from_cube(cube, dim, engine=engine)) for dim in MARKET_LEVELS}
+        results[name] = {
+            "cube": frame_records(cube.sort_values(CUBE_KEYS, na_position="last").reset_index(drop=True)),
+            "payloads": payloads,
+            "history": history,
+        }
+        print(f"  {name:<7} 立方体 {len(cube):,} 行 {t_cube:.2f}s，payload {len(payloads)} 个品牌 {t_payload:.2f}s")
+    return diff(results["pandas"], results["duckdb"], rtol)
+
+
+def check_incremental(df, store: str, rtol: float) -> list:
+    """
+    refresh_cube 增量重建时的调用方式：build_cube(store, fy=变动月份所在财年, months=变动月份)，
+    变动月份里带上日期缺失的 ""
+    """
+    df = df.copy()
+    df.loc[df.index[::97], "date"] = None
+    write_store(df, store)
+    manifest = month_checksums(to_store_frame(df))
+    latest = max(m for m in manifest if m)
+    months = ["", latest]
+    fys = sorted({manifest[m]["fy"] for m in months})
+    cubes = {}
+    for name, engine in {"pandas": PandasEngine(), "duckdb": DuckDBEngine()}.items():
+        cube = engine.build_cube(store, fy=fys, months=months)
+        cubes[name] = frame_records(cube.sort_values(CUBE_KEYS, na_position="last").reset_index(drop=True))
+    print(f"  增量：月份 {months}（财年 {fys}），立方体 {len(cubes['pandas']):,} 行")
+    return diff(cubes["pandas"], cubes["duckdb"], rtol)
+
+
+def check_partial_quarter(df, rtol: float) -> list:
+    """
+    只保留到最新财季的第一个月：window 为空（财季聚合表 + 季中回退）与 window="fq"（前缀和）两条路径逐项比对
+    """
+    months = month_key(df["date"])
+    to_number, to_key = SERIES_PERIODS["month"][1], SERIES_PERIODS["month"][2]
+    start, _ = window_months("fq", to_number(months[months != ""].max()))
+    part = df[(months <= to_key(start)).to_numpy()]
+    out = []
+    for name, engine in {"pandas": PandasEngine(), "duckdb": DuckDBEngine()}.items():
+        cube = engine.build_cube(part)
+        default = insight_many_from_cube(cube, engine=engine)
+        fq = insight_many_from_cube(cube, engine=engine, window="fq")
+        for p in fq.values():
+            p.pop("window", None)
+            p["metric_definition"].pop("window", None)
+            for dim in ("province_drilldown", "channel_drilldown"):
+                p[dim].pop("window", None)
+        out += diff(default, fq, rtol, path=name)
+    print(f"  截至 {to_key(start)}（季中）：window 为空 vs window=\"fq\"")
+    return out
+
+
+def main(rows: int = 200_000, seed: int = 0, sources: list[str] | None = None, rtol: float = 1e-9) -> int:
+    df = synthetic_frame(rows, seed)
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {"store": os.path.join(tmp, "store"), "csv": os.path.join(tmp, "clean.csv")}
+        for name in sources or ["store", "csv"]:
+            if name == "store":
+                write_store(df, paths["store"])
+            else:
+                df.to_csv(paths["csv"], index=False)
+            print(f"{name}（{rows:,} 行）")
+            mismatches = check(paths[name], rtol)
+            for path, a, b in mismatches[:10]:
+                print(f"  ❌ {path}: pandas={a!r} duckdb={b!r}")
+            print(f"  {'❌' if mismatches else '✅'} 差异 {len(mismatches)} 处")
+            failed += bool(mismatches)
+        mismatches = check_incremental(df, os.path.join(tmp, "store_incr"), rtol)
+        for path, a, b in mismatches[:10]:
+            print(f"  ❌ {path}: pandas={a!r} duckdb={b!r}")
+        print(f"  {'❌' if mismatches else '✅'} 差异 {len(mismatches)} 处")
+        failed += bool(mismatches)
+    mismatches = check_partial_quarter(df, rtol)
+    for path, a, b in mismatches[:10]:
+        print(f"  ❌ {path}: 默认={a!r} fq 窗口={b!r}")
+    print(f"  {'❌' if mismatches else '✅'} 差异 {len(mismatches)} 处")
+    failed += bool(mismatches)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="pandas / DuckDB 分析引擎结果一致性核对")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--source", nargs="*", default=None, choices=["store", "csv"], help="数据源（默认两种都核对）")
+    parser.add_argument("--rtol", type=float, default=1e-9)
+    args = parser.parse_args()
+    raise SystemExit(main(args.rows, args.seed, args.source, args.rtol))
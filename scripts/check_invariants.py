@@ -0,0 +1,106 @@
+# scripts/check_invariants.py
+"""
+口径不变量核对（合成数据 scripts/synth_data.py）：
+  - 市场层级：大区 / 省份的汇总等于直接报告的大区行 / 省份合计行；省份合计缺失时由 省份 x 渠道 上卷；
+    大区行（全国/东部/CN，渠道 == 大区）不出现在渠道和渠道大类层级里
+  - 数据质量：度量为 0 / 为空的行数写进列式存储的 _quality.json，与数据里实际的行数一致
+  python scripts/check_invariants.py --rows 200000
+
+有不满足的项时打印前几处并以退出码 1 结束
+"""
+import math
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from analysis import MEASURE_COLUMNS, _nonempty, market_level  # noqa: E402
+from engine import PandasEngine  # noqa: E402
+from excel_to_csv import write_store  # noqa: E402
+from quality import read_quality_report, scan_dataset, write_quality_report  # noqa: E402
+from synth_data import AREAS, synthetic_frame  # noqa: E402
+
+
+def _totals(cube, dim: str, mask=None):
+    part = market_level(cube, dim) if mask is None else cube.loc[mask]
+    return part.groupby(["brand", dim, "month"], observed=True)["sales_value"].sum()
+
+
+def _compare(name: str, got, want, out: list) -> None:
+    got = got.reindex(want.index)
+    for key, a, b in zip(want.index, got.to_numpy(), want.to_numpy()):
+        if not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6):
+            out.append((f"{name}{key}", a, b))
+
+
+def check_levels(df) -> list:
+    """
+    去掉一半省份的省份合计行后建立方体：有合计行的省份 / 大区等于直接报告的行，其余省份等于 省份 x 渠道 之和
+    """
+    provinces = sorted(set(df["province"].dropna()) - {""})
+    dropped = set(provinces[::2])
+    total_rows = df["province"].isin(dropped) & ~_nonempty(df["channel"])
+    cube = PandasEngine().build_cube(df[~total_rows.to_numpy()])
+    has_prov, has_ch = _nonempty(cube["province"]), _nonempty(cube["channel"])
+    channel, area = cube["channel"].astype(object).to_numpy(), cube["area"].astype(object).to_numpy()
+    dropped_rows = cube["province"].isin(dropped).to_numpy()
+
+    out = []
+    _compare("area", _totals(cube, "area"), _totals(cube, "area", _nonempty(cube["area"]) & ~has_prov & (channel == area)), out)
+    _compare("province", _totals(cube, "province"), _totals(cube, "province", has_prov & ~has_ch), out)
+    _compare("province", _totals(cube, "province"), _totals(cube, "province", has_prov & has_ch & dropped_rows), out)
+    for dim in ("channel", "channel_group"):
+        members = set(market_level(cube, dim)[dim].astype(object))
+        out += [(f"{dim}[{m}]", "大区出现在渠道层级", None) for m in sorted(members & set(AREAS))]
+    print(f"  市场层级：立方体 {len(cube):,} 行，去掉省份合计行的省份 {len(dropped)} 个")
+    return out
+
+
+def check_quality(df) -> list:
+    """
+    每隔若干行把销额置 0、加权铺货置空，入库后重扫：报告里 zero / empty 的行数等于数据里的实际行数
+    """
+    df = df.copy()
+    df.loc[df.index[::101], "sales_value"] = 0.0
+    df.loc[df.index[::103], "wdist_pct"] = np.nan
+    out = []
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, "store")
+        write_store(df, store)
+        write_quality_report(scan_dataset(store), store)
+        issues = read_quality_report(store)["issues"]
+    for c in MEASURE_COLUMNS:
+        v = df[c].astype("float32")  # 列式存储里度量是 float32
+        for issue, want in (("zero", int((v == 0).sum())), ("empty", int(v.isna().sum()))):
+            got = issues.get(f"{issue}:{c}", {}).get("rows", 0)
+            if got != want:
+                out.append((f"issues[{issue}:{c}]", got, want))
+    print(f"  数据质量：销额为 0 {issues.get('zero:sales_value', {}).get('rows', 0):,} 行，"
+          f"加权铺货为空 {issues.get('empty:wdist_pct', {}).get('rows', 0):,} 行")
+    return out
+
+
+def main(rows: int = 200_000, seed: int = 0) -> int:
+    df = synthetic_frame(rows, seed)
+    failed = 0
+    for check in (check_levels, check_quality):
+        problems = check(df)
+        for path, a, b in problems[:10]:
+            print(f"  ❌ {path}: {a!r} != {b!r}")
+        print(f"  {'❌' if problems else '✅'} 不满足 {len(problems)} 处")
+        failed += bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="市场层级 / 数据质量口径不变量核对")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    raise SystemExit(main(args.rows, args.seed))
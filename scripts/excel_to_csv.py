@@ -1,8 +1,21 @@
 # scripts/excel_to_csv.py
+import hashlib
+import json
 import os
 import re
+import shutil
+import sys
+import time
+import numpy as np
 import pandas as pd
 
+# 允许直接 python scripts/excel_to_csv.py 运行时复用根目录模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fiscal import fiscal_fields  # noqa: E402
+# 列式存储的类型约定（维度 category / 度量 float32）与 analysis.load_dataset 读入时共用
+from analysis import DIM_COLUMNS, MEASURE_COLUMNS, STORE_MANIFEST, month_key, read_store_manifest  # noqa: E402
+from quality import QualityScan, read_quality_report, scan_dataset, summary_lines, write_quality_report  # noqa: E402
+
 PROVINCES = {
     "北京","天津","上海","重庆","河北","山西","辽宁","吉林","黑龙江","江苏","浙江","安徽","福建","江西","山东",
     "河南","湖北","湖南","广东","海南","四川","贵州","云南","陕西","甘肃","青海","内蒙古","广西","西藏",
@@ -13,13 +26,16 @@ CHANNEL_HINTS = {
     "现代渠道","传统渠道","电商","餐饮","便利店","超市","大卖场","KA","CVS","GT","MT","O2O","社区团购","线上","线下"
 }
 
-def parse_market(market: str) -> dict:
+def parse_market(market: str, provinces: set | None = None, channels: set | None = None) -> dict:
     """
     市场字段示例：
       - 全国/东部/安徽/CN
       - 全国/现代渠道/超市/CN
     输出：大区、省份、渠道（尽量解析；解析不到就为空）
+    provinces / channels 为空时用默认的 PROVINCES / CHANNEL_HINTS
     """
+    provinces = PROVINCES if provinces is None else provinces
+    channels = CHANNEL_HINTS if channels is None else channels
     market = str(market) if market is not None else ""
     parts = [p.strip() for p in market.split("/") if p.strip()]
     # 去掉末尾 CN
@@ -32,27 +48,87 @@ def parse_market(market: str) -> dict:
 
     # 经验：parts[0] 常是 全国
     for p in parts:
-        if p in PROVINCES:
+        if p in provinces:
             province = p
 
     # 找渠道：优先匹配 CHANNEL_HINTS，其次取最后一段（但不等于省份）
     for p in parts:
-        if p in CHANNEL_HINTS:
+        if p in channels:
             channel = p
 
     if not channel and len(parts) >= 2:
         last = parts[-1]
-        if last not in PROVINCES and last != "全国":
+        if last not in provinces and last != "全国":
             channel = last
 
     # 大区：通常是 全国之后的第一个，且不是渠道/省份
     if len(parts) >= 2:
         cand = parts[1]
-        if cand not in PROVINCES and cand not in CHANNEL_HINTS:
+        if cand not in provinces and cand not in channels:
             area = cand
 
     return {"area": area, "province": province, "channel": channel, "market_raw": market}
 
+MARKET_FIELDS = ["area", "province", "channel"]
+
+class MarketParser:
+    """
+    市场维度解析（带记忆）：尼尔森明细里 market 只有几百个不同取值，却重复几百万行。
+    每个不同的 market 字符串只解析一次（factorize + 查表），再用一次 take 展开到整列。
+
+    - extra_provinces / extra_channels：在 PROVINCES / CHANNEL_HINTS 之外追加自定义词典
+    - dimension()：已解析的市场维度表（market_raw, area, province, channel）
+    - save / load：维度表落盘，跨批次、跨运行复用；词典变化时旧行自动失效重解析
+    """
+
+    def __init__(self, extra_provinces=None, extra_channels=None):
+        self.provinces = set(PROVINCES) | set(extra_provinces or ())
+        self.channels = set(CHANNEL_HINTS) | set(extra_channels or ())
+        self.dict_key = hashlib.md5(
+            ("|".join(sorted(self.provinces)) + "#" + "|".join(sorted(self.channels))).encode("utf-8")
+        ).hexdigest()[:12]
+        self._dim: dict = {}  # market 原值 -> parse_market 结果
+
+    def _lookup(self, market) -> dict:
+        key = "nan" if pd.isna(market) else market
+        hit = self._dim.get(key)
+        if hit is None:
+            hit = parse_market(market, provinces=self.provinces, channels=self.channels)
+            self._dim[key] = hit
+        return hit
+
+    def parse(self, markets: pd.Series) -> pd.DataFrame:
+        """
+        返回与 markets 同 index 的 area / province / channel（category）+ market_raw
+        """
+        codes, uniques = pd.factorize(markets, use_na_sentinel=False)
+        parsed = [self._lookup(m) for m in uniques]
+        out = {}
+        for c in MARKET_FIELDS + ["market_raw"]:
+            vals = pd.Categorical([p[c] for p in parsed])
+            out[c] = pd.Categorical.from_codes(vals.codes[codes], categories=vals.categories)
+        return pd.DataFrame(out, index=markets.index)
+
+    def dimension(self) -> pd.DataFrame:
+        rows = [{"market": k, **v} for k, v in self._dim.items()]
+        return pd.DataFrame(rows, columns=["market", "market_raw"] + MARKET_FIELDS)
+
+    def save(self, path: str) -> None:
+        dim = self.dimension()
+        dim["dict_key"] = self.dict_key
+        dim.to_csv(path, index=False, encoding="utf-8-sig")
+
+    def load(self, path: str) -> "MarketParser":
+        if not os.path.exists(path):
+            return self
+        dim = pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+        if "dict_key" not in dim.columns:
+            return self
+        dim = dim[dim["dict_key"] == self.dict_key]
+        for r in dim.to_dict(orient="records"):
+            self._dim[r["market"]] = {c: r[c] for c in MARKET_FIELDS + ["market_raw"]}
+        return self
+
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     将不同来源/中文列名对齐到统一英文列名
@@ -136,20 +212,226 @@ def compute_metrics(df: pd.DataFrame) -> pd.DataFrame:
 
     return df
 
-def main(
-    input_path: str = "data/raw/nielsen.xlsx",
-    output_path: str = "data/clean/nielsen_clean.csv",
-):
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+def to_store_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    转成列式存储的紧凑类型，并加上分区列 fy（财年）
+    """
+    out = pd.DataFrame(index=df.index)
+    out["date"] = pd.to_datetime(df["date"], errors="coerce")
+    for c in DIM_COLUMNS:
+        out[c] = df[c].astype(object).fillna("").astype(str).astype("category")
+    for c in MEASURE_COLUMNS:
+        out[c] = pd.to_numeric(df[c], errors="coerce").astype("float32")
+    # 日期缺失的行放到 fy=0 分区，避免丢行
+    out["fy"] = fiscal_fields(out["date"])["fy"].fillna(0).astype("int32")
+    return out
+
+# 行组按品牌有序，行组统计里的 brand 最小/最大值才窄，brand 过滤可以直接跳过整个行组
+STORE_ROW_GROUP_ROWS = 256 * 1024
+COMPACT_BATCH_ROWS = 64 * 1024
+
+def write_store(df: pd.DataFrame, store_path: str = "data/clean/nielsen_store", append: bool = False) -> None:
+    """
+    写 Parquet 数据集：按 fy 分区（fy=2025/<uuid>-0.parquet ...），维度列字典编码
+    append=True 时只新增文件（流式分块写入用），否则全量重写
+    读取见 analysis.load_dataset（支持列裁剪 + brand/fy 谓词下推）
+    """
+    # 全量重写：先清掉旧分区，避免残留已不存在的财年
+    if not append and os.path.isdir(store_path):
+        shutil.rmtree(store_path)
+    _write_store_frame(to_store_frame(df), store_path)
+
+def _write_store_frame(frame: pd.DataFrame, store_path: str, replace_partitions: bool = False) -> None:
+    """
+    replace_partitions=True：只覆盖 frame 涉及的 fy 分区，其余分区不动
+    写入前按 brand / date 排序（见 compact_store）
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("写入列式存储需要 pyarrow：pip install pyarrow") from e
+
+    frame = frame.sort_values(["brand", "date"], kind="stable")
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=store_path,
+        partition_cols=["fy"],
+        row_group_size=STORE_ROW_GROUP_ROWS,
+        existing_data_behavior="delete_matching" if replace_partitions else "overwrite_or_ignore",
+    )
+
+def compact_store(store_path: str, batch_rows: int = COMPACT_BATCH_ROWS) -> int:
+    """
+    流式写入后每个 fy 分区里是“块数”个小文件，各自按 brand / date 有序但互相交叠：
+    逐个分区做 k 路归并，用 ParquetWriter 边归并边写成一个文件，不把整个财年读进内存
+    （内存峰值 ≈ 文件数 x batch_rows + 一个行组）。只有一个文件的分区不动；返回重写的分区数
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rewritten = 0
+    for name in sorted(os.listdir(store_path)):
+        part = os.path.join(store_path, name)
+        if not (name.startswith("fy=") and os.path.isdir(part)):
+            continue
+        files = sorted(os.path.join(part, f) for f in os.listdir(part) if f.endswith(".parquet"))
+        if len(files) <= 1:
+            continue
+        schema = _wide_dictionaries(pq.ParquetFile(files[0]).schema_arrow)
+        tmp = os.path.join(part, "compacted.parquet.tmp")
+        with pq.ParquetWriter(tmp, schema) as writer:
+            # 攒够整行组再写，行组大小与 _write_store_frame 一致
+            pending = schema.empty_table()
+            for table in _merge_sorted(files, schema, batch_rows):
+                pending = pa.concat_tables([pending, table])
+                full = len(pending) // STORE_ROW_GROUP_ROWS * STORE_ROW_GROUP_ROWS
+                if full:
+                    writer.write_table(pending.slice(0, full).unify_dictionaries(), row_group_size=STORE_ROW_GROUP_ROWS)
+                    pending = pending.slice(full)
+            if len(pending):
+                writer.write_table(pending.unify_dictionaries(), row_group_size=STORE_ROW_GROUP_ROWS)
+        for f in files:
+            os.remove(f)
+        os.replace(tmp, os.path.join(part, "part-0.parquet"))
+        rewritten += 1
+    return rewritten
+
+def _wide_dictionaries(schema):
+    # 各文件的类别表不同、合并后可能超过 int8 码值（pandas 按类别数选的），统一放宽到 int32
+    import pyarrow as pa
+
+    fields = [
+        f.with_type(pa.dictionary(pa.int32(), f.type.value_type)) if pa.types.is_dictionary(f.type) else f
+        for f in schema
+    ]
+    return pa.schema(fields, metadata=schema.metadata)
+
+def _sort_key(table) -> tuple:
+    # 与 _write_store_frame 的排序一致：品牌按字符串（类别按字符串排序）、日期缺失排最后
+    import pyarrow as pa
+
+    brand = table["brand"].cast(pa.string()).fill_null("").to_numpy().astype(str)
+    date = table["date"].to_numpy().astype("datetime64[ns]")
+    key = date.astype("int64")
+    key[np.isnat(date)] = 2**63 - 1
+    return brand, key
+
+def _merge_sorted(files: list[str], schema, batch_rows: int):
+    """
+    k 个各自有序的 Parquet 文件 -> 依次产出有序的 Arrow 表
+    每轮把各文件缓冲区里 <= 前沿（各缓冲区末行的最小键）的行取出来排序输出；末行最小的那个缓冲区一定被取空
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    readers = [pq.ParquetFile(f).iter_batches(batch_size=batch_rows) for f in files]
+    buffers = [None] * len(files)  # (表, brand, date)：排序键随缓冲区一起切，不重复计算
+    while True:
+        for i, reader in enumerate(readers):
+            while reader is not None and (buffers[i] is None or not len(buffers[i][0])):
+                batch = next(reader, None)
+                if batch is None:
+                    readers[i] = reader = None
+                else:
+                    table = pa.Table.from_batches([batch]).cast(schema)
+                    buffers[i] = (table, *_sort_key(table))
+        live = [i for i, b in enumerate(buffers) if b is not None and len(b[0])]
+        if not live:
+            return
+        fb, fd = min((buffers[i][1][-1], buffers[i][2][-1]) for i in live)
+        out = []
+        for i in live:
+            table, brand, date = buffers[i]
+            # 缓冲区有序：<= 前沿的行是前缀，二分找切点
+            lo, hi = np.searchsorted(brand, fb, side="left"), np.searchsorted(brand, fb, side="right")
+            n = int(lo + np.searchsorted(date[lo:hi], fd, side="right"))
+            out.append((table.slice(0, n), brand[:n], date[:n]))
+            buffers[i] = (table.slice(n), brand[n:], date[n:])
+        order = np.lexsort((np.concatenate([o[2] for o in out]), np.concatenate([o[1] for o in out])))
+        yield pa.concat_tables([o[0] for o in out]).unify_dictionaries().take(order)
+
+def month_checksums(frame: pd.DataFrame) -> dict:
+    """
+    逐月校验和：{month: {"checksum": 行哈希之和 mod 2^64, "rows": 行数, "fy": 财年分区}}
+    行哈希求和与行顺序、分块方式无关，所以可以逐块累加（见 _merge_checksums）
+    """
+    cols = ["date"] + DIM_COLUMNS + MEASURE_COLUMNS
+    h = pd.util.hash_pandas_object(frame[cols], index=False)
+    g = pd.DataFrame({"month": month_key(frame["date"]).to_numpy(), "fy": frame["fy"].to_numpy(), "h": h.to_numpy()})
+    out = {}
+    for (month, fy), part in g.groupby(["month", "fy"], sort=False):
+        out[month] = {"checksum": int(part["h"].sum()), "rows": len(part), "fy": int(fy)}
+    return out
+
+def _merge_checksums(acc: dict, part: dict) -> None:
+    for month, v in part.items():
+        cur = acc.setdefault(month, {"checksum": 0, "rows": 0, "fy": v["fy"]})
+        cur["checksum"] = (cur["checksum"] + v["checksum"]) % 2**64
+        cur["rows"] += v["rows"]
+
+def _save_store_manifest(store_path: str, months: dict, refresh: dict) -> None:
+    manifest = {
+        "months": {m: {**v, "checksum": f"{v['checksum']:016x}"} for m, v in sorted(months.items())},
+        "last_refresh": refresh,
+    }
+    os.makedirs(store_path, exist_ok=True)
+    tmp = os.path.join(store_path, STORE_MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(store_path, STORE_MANIFEST))
+
+def apply_increment(staging_path: str, store_path: str, incoming: dict) -> dict:
+    """
+    把暂存区（本次交付的数据）合并进列式存储：
+      - 新月份：追加
+      - 已交付月份校验和变化（重述）：整月替换
+      - 校验和相同的月份：跳过
+    只重写受影响月份所在的 fy 分区；返回 {"new": [...], "restated": [...]}
+    """
+    import pyarrow.parquet as pq
+
+    known = read_store_manifest(store_path).get("months", {})
+    incoming_hex = {m: f"{v['checksum']:016x}" for m, v in incoming.items()}
+    new = sorted(m for m in incoming if m not in known)
+    restated = sorted(m for m in incoming if m in known and known[m]["checksum"] != incoming_hex[m])
+    affected = set(new) | set(restated)
+
+    if affected:
+        fys = sorted({incoming[m]["fy"] for m in affected} | {known[m]["fy"] for m in restated})
+        fresh = pq.read_table(staging_path, filters=[("fy", "in", fys)]).to_pandas()
+        fresh = fresh[month_key(fresh["date"]).isin(affected).to_numpy()]
+        parts = [fresh]
+        if os.path.isdir(store_path):
+            old = pq.read_table(store_path, filters=[("fy", "in", fys)]).to_pandas()
+            parts.insert(0, old[~month_key(old["date"]).isin(affected).to_numpy()])
+        merged = pd.concat(parts, ignore_index=True)
+        _write_store_frame(to_store_frame(merged), store_path, replace_partitions=True)
 
-    xl = pd.ExcelFile(input_path)
-    # 默认取第一个 sheet；你也可以按名字选择
-    df = xl.parse(xl.sheet_names[0])
+    months = {m: {**v, "checksum": int(v["checksum"], 16)} for m, v in known.items()}
+    months.update({m: incoming[m] for m in affected})
+    refresh = {"new": new, "restated": restated, "at": time.strftime("%Y-%m-%d %H:%M:%S")}
+    _save_store_manifest(store_path, months, refresh)
+    return refresh
+
+# 输出你后续分析需要的“规范字段”
+KEEP_COLUMNS = [
+    "date","brand","category","market_raw","area","province","channel",
+    "sales_value","sales_volume","price",
+    "share_value_pct","wdist_pct","ndist_pct","velocity_value"
+]
+
+def clean_frame(df: pd.DataFrame, market_parser: MarketParser | None = None) -> pd.DataFrame:
+    """
+    单个数据块的清洗：列名对齐 -> 解析市场维度 -> 计算指标 -> 规范字段
+    market_parser：跨块复用的市场解析器（已解析的 market 不再重复解析）
+    """
     df = normalize_columns(df)
 
     # 解析市场维度
     if "market" in df.columns:
-        parsed = df["market"].apply(parse_market).apply(pd.Series)
+        parsed = (market_parser or MarketParser()).parse(df["market"])
         df = pd.concat([df, parsed], axis=1)
     else:
         df["market_raw"] = ""
@@ -159,21 +441,181 @@ def main(
 
     df = compute_metrics(df)
 
-    # 输出你后续分析需要的“规范字段”
-    keep = [
-        "date","brand","category","market_raw","area","province","channel",
-        "sales_value","sales_volume","price",
-        "share_value_pct","wdist_pct","ndist_pct","velocity_value"
-    ]
-    for k in keep:
+    for k in KEEP_COLUMNS:
         if k not in df.columns:
             df[k] = pd.NA
 
-    df_out = df[keep].copy()
-    df_out.to_csv(output_path, index=False, encoding="utf-8-sig")
+    return df[KEEP_COLUMNS].copy()
+
+def iter_sheet_chunks(input_path: str, sheets: list[str] | None = None, chunk_rows: int = 50_000):
+    """
+    只读模式逐行读取 Excel（openpyxl read_only），按 chunk_rows 行切块产出：
+      (sheet_name, DataFrame)
+    sheets 为空则读取全部 sheet；内存占用只与 chunk_rows 有关，与工作簿大小无关
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(input_path, read_only=True, data_only=True)
+    try:
+        names = sheets or wb.sheetnames
+        for name in names:
+            if name not in wb.sheetnames:
+                raise KeyError(f"{input_path} 中没有 sheet：{name}")
+            rows = wb[name].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            header = [str(h) if h is not None else f"col_{i}" for i, h in enumerate(header)]
+
+            buf = []
+            for row in rows:
+                if row is None or all(v is None for v in row):
+                    continue
+                buf.append(row)
+                if len(buf) >= chunk_rows:
+                    yield name, pd.DataFrame(buf, columns=header)
+                    buf = []
+            if buf:
+                yield name, pd.DataFrame(buf, columns=header)
+    finally:
+        wb.close()
 
+def main(
+    input_paths: str | list[str] = "data/raw/nielsen.xlsx",
+    output_path: str = "data/clean/nielsen_clean.csv",
+    store_path: str | None = "data/clean/nielsen_store",
+    sheets: list[str] | None = None,
+    chunk_rows: int = 50_000,
+    market_dim_path: str | None = "data/clean/market_dim.csv",
+    extra_provinces: list[str] | None = None,
+    extra_channels: list[str] | None = None,
+    incremental: bool = False,
+    quality: bool = True,
+):
+    """
+    流式清洗：逐个文件、逐个 sheet、逐块处理并增量追加到 CSV / 列式存储
+    全量写入结束后整理列式存储（compact_store）：每个财年分区一个按 brand / date 排序的文件
+    市场维度表（market_dim_path）跨块、跨运行复用
+    incremental=True：季度增量交付。数据先写暂存区，按逐月校验和只合并新增/重述的月份
+    （见 apply_increment）；不重写 CSV
+    quality=True：清洗的同一遍里逐块做质量 / 异常扫描（quality.QualityScan），报告写到列式存储目录
+    （没有列式存储时写在 CSV 旁边）。增量模式不在清洗时扫描：合并后分块重扫整个存储（quality.scan_dataset），
+    报告覆盖全部数据——只扫本次交付会丢掉旧数据的发现，重复键查不到存储里已有的行，几个月的交付也凑不够环比突变的点数
+    """
+    if isinstance(input_paths, str):
+        input_paths = [input_paths]
+    if incremental and not store_path:
+        raise ValueError("增量模式需要列式存储（store_path）")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    target = f"{store_path}.incoming" if incremental else store_path
+    if target and os.path.isdir(target):
+        shutil.rmtree(target)
+
+    market_parser = MarketParser(extra_provinces, extra_channels)
+    if market_dim_path:
+        market_parser.load(market_dim_path)
+
+    total = 0
+    wrote_header = False
+    checksums: dict = {}
+    scan = QualityScan() if quality and not incremental else None
+    for input_path in input_paths:
+        sheet_rows, sheet_start, current = 0, time.perf_counter(), None
+        for sheet, chunk in iter_sheet_chunks(input_path, sheets=sheets, chunk_rows=chunk_rows):
+            if sheet != current:
+                if current is not None:
+                    _report_sheet(input_path, current, sheet_rows, sheet_start)
+                sheet_rows, sheet_start, current = 0, time.perf_counter(), sheet
+
+            df_out = clean_frame(chunk, market_parser)
+            if not incremental:
+                df_out.to_csv(
+                    output_path,
+                    mode="a" if wrote_header else "w",
+                    header=not wrote_header,
+                    index=False,
+                    encoding="utf-8" if wrote_header else "utf-8-sig",
+                )
+                wrote_header = True
+            frame = to_store_frame(df_out) if target or scan else None
+            if target:
+                _merge_checksums(checksums, month_checksums(frame))
+                _write_store_frame(frame, target)
+            if scan:
+                scan.update(frame)
+
+            sheet_rows += len(df_out)
+            total += len(df_out)
+        if current is not None:
+            _report_sheet(input_path, current, sheet_rows, sheet_start)
+
+    if market_dim_path:
+        market_parser.save(market_dim_path)
+
+    inputs = [os.path.basename(p) for p in input_paths]
+    if scan:
+        report = scan.report(scope={"inputs": inputs, "incremental": False})
+        print("\n".join(summary_lines(report)))
+        print(f"✅ 质量报告：{write_quality_report(report, store_path or output_path)}")
+
+    if incremental:
+        refresh = apply_increment(target, store_path, checksums) if checksums else {"new": [], "restated": []}
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        print(f"Rows: {total:,}")
+        print(f"✅ 增量合并完成: {store_path}（新增月份 {len(refresh['new'])} 个，重述月份 {len(refresh['restated'])} 个）")
+        if refresh["restated"]:
+            print("  重述月份：", ", ".join(refresh["restated"]))
+        if quality and (refresh["new"] or refresh["restated"] or read_quality_report(store_path) is None):
+            report = scan_dataset(store_path, scope={"inputs": inputs, "incremental": True, **refresh})
+            print("\n".join(summary_lines(report)))
+            print(f"✅ 质量报告（合并后全量重扫）：{write_quality_report(report, store_path)}")
+        return refresh
+
+    if store_path:
+        compact_store(store_path)
+        _save_store_manifest(store_path, checksums, {"new": sorted(checksums), "restated": [], "at": time.strftime("%Y-%m-%d %H:%M:%S")})
     print(f"✅ 输出完成: {output_path}")
-    print(f"Rows: {len(df_out):,}")
+    print(f"Rows: {total:,}")
+    if store_path:
+        print(f"✅ 列式存储完成: {store_path}")
+
+def _report_sheet(input_path: str, sheet: str, rows: int, start: float) -> None:
+    secs = time.perf_counter() - start
+    rate = rows / secs if secs > 0 else float("inf")
+    print(f"  {os.path.basename(input_path)} / {sheet}: {rows:,} 行，{secs:.1f}s，{rate:,.0f} 行/秒")
+
+def cli(argv: list[str] | None = None) -> None:
+    """
+    命令行入口；run_report.py ingest 也转发到这里
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="尼尔森 Excel -> 清洗后的 CSV / 列式存储（流式）")
+    parser.add_argument("inputs", nargs="*", default=["data/raw/nielsen.xlsx"], help="一个或多个 .xlsx 文件")
+    parser.add_argument("--sheets", nargs="*", default=None, help="只处理这些 sheet（默认全部）")
+    parser.add_argument("--output", default="data/clean/nielsen_clean.csv")
+    parser.add_argument("--store", default="data/clean/nielsen_store", help="列式存储目录；传空字符串则不写")
+    parser.add_argument("--chunk-rows", type=int, default=50_000)
+    parser.add_argument("--market-dim", default="data/clean/market_dim.csv", help="市场维度表（跨运行复用）；传空字符串则不读写")
+    parser.add_argument("--extra-provinces", nargs="*", default=None, help="追加的省份词典")
+    parser.add_argument("--extra-channels", nargs="*", default=None, help="追加的渠道词典")
+    parser.add_argument("--incremental", action="store_true", help="季度增量：只合并新增/重述的月份到已有列式存储")
+    parser.add_argument("--no-quality", action="store_true", help="跳过入库时的质量 / 异常扫描")
+    args = parser.parse_args(argv)
+
+    main(
+        args.inputs,
+        output_path=args.output,
+        store_path=args.store or None,
+        sheets=args.sheets,
+        chunk_rows=args.chunk_rows,
+        market_dim_path=args.market_dim or None,
+        extra_provinces=args.extra_provinces,
+        extra_channels=args.extra_channels,
+        incremental=args.incremental,
+        quality=not args.no_quality,
+    )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
@@ -0,0 +1,85 @@
+# scripts/mock_llm_server.py
+"""
+本地 OpenAI 兼容 mock 服务（仅标准库），用于离线测试 llm / llm_async：
+  python scripts/mock_llm_server.py --port 8008 --delay 0.5 --rate-limit-every 3
+  LLM_BASE_URL=http://127.0.0.1:8008/v1 OPENAI_API_KEY=mock python run_report.py
+
+- POST /v1/chat/completions：返回固定格式的 chat.completion，正文回显提示词里的分析层标题
+- --delay：每个请求的模拟延迟（秒），用来观察并发效果
+- --rate-limit-every N：每第 N 个请求返回 429（带 Retry-After），用来验证退避重试
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(delay: float, rate_limit_every: int, retry_after: float):
+    lock = threading.Lock()
+    counter = {"n": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: dict, headers: dict | None = None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                return self._send(404, {"error": {"message": "not found"}})
+            length = int(self.headers.get("Content-Length") or 0)
+            req = json.loads(self.rfile.read(length) or b"{}")
+
+            with lock:
+                counter["n"] += 1
+                n = counter["n"]
+            if rate_limit_every and n % rate_limit_every == 0:
+                return self._send(
+                    429,
+                    {"error": {"message": "rate limited", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                    {"Retry-After": str(retry_after)},
+                )
+
+            time.sleep(delay)
+            prompt = req["messages"][-1]["content"]
+            layer = next((ln for ln in prompt.splitlines() if ln[:2] in ("1）", "2）", "3）", "4）")), "")
+            self._send(200, {
+                "id": f"mock-{n}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": req.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"[mock #{n}] {layer}"},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": len(prompt), "completion_tokens": 8, "total_tokens": len(prompt) + 8},
+            })
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 8008, delay: float = 0.0, rate_limit_every: int = 0, retry_after: float = 0.1):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(delay, rate_limit_every, retry_after))
+    print(f"mock LLM: http://127.0.0.1:{server.server_port}/v1")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    args = parser.parse_args()
+
+    serve(args.port, args.delay, args.rate_limit_every, args.retry_after).serve_forever()
@@ -0,0 +1,140 @@
+# scripts/synth_data.py
+"""
+确定性的合成尼尔森数据（scripts/excel_to_csv.py 的输出口径，KEEP_COLUMNS），用于基准测试：
+  python scripts/synth_data.py --rows 1000000 --out data/synth/nielsen_1m.csv
+  python scripts/synth_data.py --rows 50000000 --store data/synth/store_50m   # 分块流式写列式存储
+
+数据是 品牌 x 市场 x 月 的面板：
+  - 市场：全国 / 大区 / 省份（PROVINCES） / 渠道（CHANNEL_HINTS） / 省份 x 渠道，行数越多市场越细
+  - 月份：连续 48 个月（4 个完整财年，FY 从 12 月开始）
+  - 销额 = 品牌体量 x 市场权重 x 季节性（夏季高峰） x 年增长 x 噪声；份额、铺货率、单价按品牌参数生成
+同样的 (rows, seed, chunk_rows) 每次生成完全一样的数据。
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from excel_to_csv import CHANNEL_HINTS, KEEP_COLUMNS, PROVINCES, MarketParser, write_store  # noqa: E402
+
+START = "2021-12-01"  # FY2022 第一个月
+MONTHS = 48
+AREAS = ["东部", "南部", "西部", "北部", "中部", "东北", "西北"]
+MODERN = {"超市", "大卖场", "便利店", "KA", "CVS", "MT"}
+
+
+def build_markets() -> list[str]:
+    """
+    市场字符串（与真实数据同样的 / 分隔格式），顺序固定
+    """
+    provinces = sorted(PROVINCES)
+    channels = sorted(CHANNEL_HINTS - {"现代渠道", "传统渠道"})
+    area_of = {p: AREAS[i % len(AREAS)] for i, p in enumerate(provinces)}
+    markets = ["全国/CN"] + [f"全国/{a}/CN" for a in AREAS]
+    markets += [f"全国/{area_of[p]}/{p}/CN" for p in provinces]
+    markets += [f"全国/{'现代渠道' if c in MODERN else '传统渠道'}/{c}/CN" for c in channels]
+    markets += [f"全国/{area_of[p]}/{p}/{c}/CN" for p in provinces for c in channels]
+    return markets
+
+
+def _market_weights(markets: list[str], rng) -> np.ndarray:
+    # 全国=1，其余按层级分配占比（同一层级内 Dirichlet 抽样）
+    depth = np.array([m.count("/") for m in markets])
+    w = np.ones(len(markets))
+    for d in np.unique(depth[depth > 1]):
+        idx = np.flatnonzero(depth == d)
+        w[idx] = rng.dirichlet(np.full(len(idx), 2.0)) * (1.0 if d < 4 else 0.5)
+    return w
+
+
+def iter_synthetic(n_rows: int, seed: int = 0, chunk_rows: int = 1_000_000):
+    """
+    分块产出 DataFrame（列 = KEEP_COLUMNS），总行数 n_rows；内存只与 chunk_rows 有关
+    """
+    markets = build_markets()
+    n_markets = len(markets)
+    per_brand = n_markets * MONTHS
+    n_brands = max(1, -(-n_rows // per_brand))
+
+    rng = np.random.default_rng(seed)
+    base = rng.lognormal(13.0, 1.0, n_brands)          # 品牌体量（全国月销额）
+    growth = rng.normal(0.05, 0.15, n_brands)          # 年增长率
+    share = np.clip(rng.dirichlet(np.full(n_brands, 0.8)) * 100.0, 0.05, 60.0)  # 份额%（品类内）
+    price = rng.uniform(3.0, 12.0, n_brands)
+    wdist = rng.uniform(20.0, 95.0, n_brands)
+    mweight = _market_weights(markets, rng)
+
+    parsed = MarketParser().parse(pd.Series(markets))
+    month_idx = np.arange(MONTHS)
+    dates = pd.date_range(START, periods=MONTHS, freq="MS")
+    season = 1.0 + 0.35 * np.sin((dates.month.to_numpy() - 4) / 12.0 * 2 * np.pi)
+    brands = np.array([f"品牌{i:05d}" for i in range(n_brands)], dtype=object)
+
+    for start in range(0, n_rows, chunk_rows):
+        stop = min(n_rows, start + chunk_rows)
+        crng = np.random.default_rng([seed, start])
+        i = np.arange(start, stop)
+        b, rest = np.divmod(i, per_brand)
+        m, t = np.divmod(rest, MONTHS)
+
+        noise = crng.lognormal(0.0, 0.12, len(i))
+        sales = base[b] * mweight[m] * season[t] * (1.0 + growth[b]) ** (month_idx[t] / 12.0) * noise
+        sh = np.clip(share[b] * crng.lognormal(0.0, 0.1, len(i)), 0.01, 80.0)
+        pr = price[b] * crng.lognormal(0.0, 0.05, len(i))
+        wd = np.clip(wdist[b] * mweight[m] ** 0.05 + crng.normal(0.0, 3.0, len(i)), 1.0, 100.0)
+        nd = wd * crng.uniform(0.6, 0.95, len(i))
+
+        yield pd.DataFrame({
+            "date": dates[t],
+            "brand": pd.Categorical.from_codes(b, categories=brands),
+            "category": "饮料",
+            "market_raw": parsed["market_raw"].to_numpy()[m],
+            "area": parsed["area"].to_numpy()[m],
+            "province": parsed["province"].to_numpy()[m],
+            "channel": parsed["channel"].to_numpy()[m],
+            "sales_value": sales,
+            "sales_volume": sales / pr,
+            "price": pr,
+            "share_value_pct": sh,
+            "wdist_pct": wd,
+            "ndist_pct": nd,
+            "velocity_value": sales / wd,
+        })[KEEP_COLUMNS]
+
+
+def synthetic_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    return pd.concat(iter_synthetic(n_rows, seed), ignore_index=True)
+
+
+def main(n_rows: int, out: str | None = None, store: str | None = None, seed: int = 0, chunk_rows: int = 1_000_000):
+    if out:
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    if store and os.path.isdir(store):
+        import shutil
+        shutil.rmtree(store)
+    for k, chunk in enumerate(iter_synthetic(n_rows, seed, chunk_rows)):
+        if out:
+            chunk.to_csv(out, mode="a" if k else "w", header=k == 0, index=False,
+                         encoding="utf-8" if k else "utf-8-sig")
+        if store:
+            write_store(chunk, store, append=True)
+    print(f"✅ 合成数据 {n_rows:,} 行 -> {out or ''} {store or ''}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="生成确定性的合成尼尔森数据")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="输出 CSV")
+    parser.add_argument("--store", default=None, help="输出列式存储目录")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+    if not (args.out or args.store):
+        parser.error("至少指定 --out 或 --store")
+
+    main(args.rows, out=args.out, store=args.store, seed=args.seed, chunk_rows=args.chunk_rows)